@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************************************************************
+# *File: DAQ_Benchmark
+# *
+# *Copyright: 2020 Michael Bourg michaelbourg72@gmail.com
+# *All rights reserved
+# *
+# *The information in this file is meant to be used to measure the speed of Data_Visualization. The copying and/or
+# *distribution of this file without the written consent of the author is strictly prohibited.
+# *
+# *Author: Michael Bourg
+# *
+# *Description:    A Python script that writes synthetic raw data sets in the formats read by Data_Visualization and
+# *                times the loading and plotting of them.
+# *                    - Agilent 34972A exports (UTF-16, channel table, "Alarm" column after every channel)
+# *                    - HBM MX403B exports (whitespace separated, time in seconds)
+# *                The number of channels, the number of scans and the shape of the signals (noise, warm up ramp,
+# *                thermal runaway, transients) are set by the user, the files are written in blocks so 100M scan
+# *                files do not have to fit in memory.
+# *                Every file is then loaded and graphed in a fresh process and the parse time, rows/s, peak memory
+# *                (RSS) and render time of every figure are saved to a .json file, two .json files can be compared
+# *                to see if a change made the program faster or slower:
+# *                    python DAQ_Benchmark.py --sizes 10000 100000 1000000 --out before.json
+# *                    python DAQ_Benchmark.py --sizes 10000 100000 1000000 --out after.json --compare before.json
+# *
+# **************************************************************************************************************************
+
+###Import required packages
+import pandas as pd
+import numpy as np
+import os
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+### Settings
+
+blockRows = 500000                                              # scans generated and written at a time
+scanInterval = 0.16                                             # seconds between Agilent scans
+sampleRate = 1000                                               # HBM samples per second
+benchGraphs = ['temp', 'pressure', 'current', 'custom']         # graph types rendered per file, see graphTypes
+
+def makeSignal(scans, total, channel, shape = 'ramp', noise = 0.01, transients = 0, seed = 0):
+    """
+    **********************************************************************************************************************
+    *Function: makeSignal()
+    *Decription:
+        *    This function computes the values of one channel for a block of scans. The signal only depends on the
+             scan numbers, so a file written in blocks is the same as a file written at once.
+        *    Shapes:
+                -'flat'    : constant level
+                -'ramp'    : warm up from 0 to the level (first order response)
+                -'runaway' : warm up, then an exponential rise over the last quarter of the run
+        *    Transients are short spikes decaying over about 20 scans, placed at random (same places for every
+             block of the file).
+
+        *Parameters:
+            *    scans      : scan numbers of the block (0 based)
+            *    total      : number of scans in the file
+            *    channel    : channel number, gives every channel its own level and noise
+            *    shape      : 'flat', 'ramp' or 'runaway'
+            *    noise      : standard deviation of the noise, relative to the level
+            *    transients : number of spikes in the file
+            *    seed       : random seed of the file
+
+            *Return
+            *    Array of the channel values
+    **********************************************************************************************************************
+    """
+
+    level = 1.0 + channel
+    x = scans / max(total - 1, 1)
+    if shape == 'flat':
+        y = np.full(len(scans), level)
+    elif shape == 'ramp':
+        y = level * (1 - np.exp(-x * 8))
+    elif shape == 'runaway':
+        y = level * (1 - np.exp(-x * 8)) + level * np.expm1(np.clip(x - 0.75, 0, None) * 12) / 10
+    else:
+        raise ValueError('Unknown signal shape: ' + str(shape))
+
+    #the noise of a block is seeded by the block, the spikes by the file
+    rng = np.random.default_rng([seed, channel, int(scans[0]) if len(scans) else 0])
+    y = y + rng.normal(0, noise * level, len(scans))
+    if transients:
+        spikes = np.random.default_rng([seed, channel])
+        where = spikes.integers(0, total, transients)
+        height = spikes.uniform(0.5, 2.0, transients) * level
+        for start, h in zip(where, height):
+            hit = (scans >= start) & (scans < start + 100)
+            y[hit] += h * np.exp(-(scans[hit] - start) / 20)
+
+    return(y)
+
+def formatATime(times):
+    """
+    **********************************************************************************************************************
+    *Function: formatATime()
+    *Decription:
+        *    This function writes time stamps the way the Agilent 34972A does (M/D/YYYY HH:MM:SS:mmm, the month,
+             day and hour are not padded, milliseconds below 100 are written with 2 digits).
+
+        *Parameters:
+            *    times : DatetimeIndex of the scans
+
+            *Return
+            *    Array of time stamp strings
+    **********************************************************************************************************************
+    """
+
+    def text(values, width = 1):
+        return(np.strings.zfill(np.asarray(values).astype('U4'), width))
+
+    stamp = text(times.month)
+    for sep, values, width in (('/', times.day, 1), ('/', times.year, 4), (' ', times.hour, 1),
+                               (':', times.minute, 2), (':', times.second, 2), (':', times.microsecond // 1000, 2)):
+        stamp = np.strings.add(np.strings.add(stamp, sep), text(values, width))
+
+    return(stamp)
+
+def makeAgilentFile(fileName, numSense = 4, rows = 10000, shape = 'ramp', noise = 0.01, transients = 0,
+                    alarmHigh = None, seed = 0):
+    """
+    **********************************************************************************************************************
+    *Function: makeAgilentFile()
+    *Decription:
+        *    This function writes a synthetic Agilent 34972A raw data set (UTF-16 export) with the same preamble,
+             channel table and "Scan,Time,<value>,Alarm <channel>,..." layout as the instrument, see readAHeader().
+        *    Scans are about "scanInterval" apart with the small jitter of the real unit. When "alarmHigh" is
+             given the channels have a high alarm test and the alarm columns are 1 above it.
+
+        *Parameters:
+            *    fileName   : location of the new file
+            *    numSense   : number of channels
+            *    rows       : number of scans
+            *    shape, noise, transients : signal shape, see makeSignal()
+            *    alarmHigh  : high alarm limit of the channels, no alarm test if None
+            *    seed       : random seed
+
+            *Return
+            *    Location of the new file
+    **********************************************************************************************************************
+    """
+
+    start = pd.Timestamp('2019-05-14 13:42:06.298')
+    channels = [str(101 + i) for i in range(numSense)]
+    test = 'Off' if alarmHigh is None else 'Hi'
+    high = 1 if alarmHigh is None else alarmHigh
+    date = str(start.month) + '/' + str(start.day) + '/' + str(start.year)
+    lines = ['Name:,Data 8199 2391 ' + date + start.strftime(' %H:%M:%S'),
+             'Owner:,benchmark',
+             'Comments:,synthetic data set',
+             'Acquisition Date:,' + date + ' ' + str(start.hour % 12 or 12) + start.strftime(':%M:%S %p'),
+             '&Instrument:,34972A,Address:,USB0::2391::8199::SYNTHETIC::0::INSTR,Modules:,1,Slot1:,34902A',
+             'Total Channels:,' + str(numSense),
+             'Channel,Name,Function,Range,Resolution,AdvSettings,Scale,Gain,Offset,Label,Test,Low,High,HWAlarm']
+    lines += [c + ',,DC Voltage,Auto,5.5,DC Voltage#10M#1#0.016#Auto#0.001,False,1,0,VDC,' + test + ',0,' +
+              str(high) + ',Alarm 1' for c in channels]
+    lines += ['Scan  Control:,Start Action:,Immediately,Stop Action:,User Terminated',
+              ','.join(['Scan', 'Time'] + [v for c in channels for v in (c + ' (VDC)', 'Alarm ' + c)])]
+
+    rng = np.random.default_rng(seed)
+    elapsed = 0
+    with open(fileName, 'wb') as f:
+        f.write('\n'.join(lines).encode('UTF-16') + '\n'.encode('UTF-16-LE'))
+        for first in range(0, rows, blockRows):
+            scans = np.arange(first, min(first + blockRows, rows))
+            #scan to scan time in ms, every 8th scan is slower like on the real unit
+            step = np.round(scanInterval * 1000 + rng.normal(0, 1, len(scans))).astype('int64')
+            step[scans % 8 == 0] += 74
+            ms = elapsed + np.cumsum(step) - step[0]
+            elapsed = ms[-1] + step[-1] if len(ms) else elapsed
+            block = {'Scan': scans + 1, 'Time': formatATime(start + pd.to_timedelta(ms, unit = 'ms'))}
+            for i, c in enumerate(channels):
+                y = makeSignal(scans, rows, i, shape, noise, transients, seed)
+                block[c + ' (VDC)'] = y
+                block['Alarm ' + c] = np.zeros(len(y), 'int8') if alarmHigh is None else (y > alarmHigh).astype('int8')
+            text = pd.DataFrame(block).to_csv(header = False, index = False, float_format = '%.8g',
+                                              lineterminator = '\n')
+            f.write(text.encode('UTF-16-LE'))
+
+    return(fileName)
+
+def makeHBMFile(fileName, numSense = 4, rows = 10000, shape = 'ramp', noise = 0.01, transients = 0, seed = 0):
+    """
+    **********************************************************************************************************************
+    *Function: makeHBMFile()
+    *Decription:
+        *    This function writes a synthetic HBM MX403B raw data set: a few preamble lines, the column names and
+             tab separated rows of time (seconds, "sampleRate" per second) and channel values, see readHBMHeader().
+
+        *Parameters:
+            *    fileName   : location of the new file
+            *    numSense   : number of channels
+            *    rows       : number of samples
+            *    shape, noise, transients : signal shape, see makeSignal()
+            *    seed       : random seed
+
+            *Return
+            *    Location of the new file
+    **********************************************************************************************************************
+    """
+
+    columns = ['Time'] + ['MX403B_CH' + str(i + 1) for i in range(numSense)]
+    with open(fileName, 'w', newline = '\n') as f:
+        f.write('catman export of a synthetic data set\n')
+        f.write('Sample rate: ' + str(sampleRate) + ' Hz\n')
+        f.write('Channels: ' + str(numSense) + '\n')
+        f.write('\t'.join(columns) + '\n')
+        for first in range(0, rows, blockRows):
+            scans = np.arange(first, min(first + blockRows, rows))
+            block = [scans / sampleRate] + [makeSignal(scans, rows, i, shape, noise, transients, seed)
+                                            for i in range(numSense)]
+            np.savetxt(f, np.column_stack(block), fmt = ['%.6f'] + ['%.7g'] * numSense, delimiter = '\t')
+
+    return(fileName)
+
+def runCase(kind, fileName, numSense, folder):
+    """
+    **********************************************************************************************************************
+    *Function: runCase()
+    *Decription:
+        *    This function loads and graphs one synthetic file, it runs in a fresh process (see runBenchmark())
+             so the peak memory belongs to this file only.
+        *    The file is parsed with an empty cache, loaded a second time from the cache, then every graph
+             type of "benchGraphs" is drawn and saved. The time of every stage is kept (see span() in
+             Data_Visualization).
+
+        *Parameters:
+            *    kind     : 'agilent' or 'hbm'
+            *    fileName : location of the synthetic file
+            *    numSense : number of channels
+            *    folder   : folder of the cache and of the graphs
+
+            *Return
+            *    Dictionary of the measures
+    **********************************************************************************************************************
+    """
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import Data_Visualization as DV
+
+    DV.cacheDir = os.path.join(folder, 'cache')
+    DV.profile = True
+    shutil.rmtree(DV.cacheDir, ignore_errors = True)
+    names = ['Sensor ' + str(i + 1) for i in range(numSense)]
+    load = DV.loadARawData if kind == 'agilent' else DV.loadHBMRawData
+
+    t = time.perf_counter()
+    data = load(fileName, colNames = names)
+    parseSec = time.perf_counter() - t
+    parseRSS = DV.peakRSS()
+    t = time.perf_counter()
+    load(fileName)
+    cachedSec = time.perf_counter() - t
+
+    render = {}
+    for graphType in benchGraphs:
+        graph = {'type': graphType, 'series': names, 'title': kind + ' ' + graphType}
+        t = time.perf_counter()
+        DV.drawGraph(data, graph, folder)
+        render[graphType] = time.perf_counter() - t
+
+    result = {'rows': len(data),
+              'parseSec': parseSec,
+              'rowsPerSec': len(data) / parseSec,
+              'cachedSec': cachedSec,
+              'parsePeakRSSMB': parseRSS,
+              'renderSec': render,
+              'peakRSSMB': DV.peakRSS(),
+              'stages': DV.profileReport().to_dict('index')}
+    shutil.rmtree(DV.cacheDir, ignore_errors = True)
+
+    return(result)
+
+def runBenchmark(sizes, numSense = 4, kinds = ('agilent', 'hbm'), folder = None, keep = False, **signal):
+    """
+    **********************************************************************************************************************
+    *Function: runBenchmark()
+    *Decription:
+        *    This function writes a synthetic file for every size and format and measures it in a fresh process
+             (see runCase()). The files are deleted after their case unless "keep" is True, a file already in
+             the folder is used again.
+
+        *Parameters:
+            *    sizes    : list of scan counts
+            *    numSense : number of channels
+            *    kinds    : formats, 'agilent' and/or 'hbm'
+            *    folder   : work folder, a temporary folder if None
+            *    keep     : keep the synthetic files
+            *    signal   : shape, noise, transients (see makeSignal()) and alarmHigh (see makeAgilentFile())
+
+            *Return
+            *    Dictionary of the results (machine, versions and one entry per file)
+    **********************************************************************************************************************
+    """
+
+    import Data_Visualization as DV
+
+    folder = folder or tempfile.mkdtemp(prefix = 'DAQ_bench_')
+    os.makedirs(folder, exist_ok = True)
+    results = {'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+               'machine': platform.platform(),
+               'processor': platform.processor(),
+               'cpus': os.cpu_count(),
+               'python': platform.python_version(),
+               'pandas': pd.__version__,
+               'numpy': np.__version__,
+               'plotPoints': DV.plotPoints,
+               'plotMethod': DV.plotMethod,
+               'results': []}
+
+    for kind in kinds:
+        for rows in sizes:
+            fileName = os.path.join(folder, kind + '_' + str(numSense) + 'ch_' + str(rows) +
+                                    ('.csv' if kind == 'agilent' else '.txt'))
+            t = time.perf_counter()
+            if not os.path.exists(fileName):
+                if kind == 'agilent':
+                    makeAgilentFile(fileName, numSense, rows, **signal)
+                else:
+                    makeHBMFile(fileName, numSense, rows, **{k: v for k, v in signal.items() if k != 'alarmHigh'})
+            generateSec = time.perf_counter() - t
+            print('Measuring', os.path.basename(fileName), '...')
+
+            #a fresh process per file, the peak memory is not carried over
+            with ProcessPoolExecutor(max_workers = 1) as pool:
+                result = pool.submit(runCase, kind, fileName, numSense, folder).result()
+            result.update({'format': kind, 'channels': numSense, 'fileBytes': os.path.getsize(fileName),
+                           'generateSec': generateSec})
+            results['results'].append(result)
+            print('   {rows} rows, parse {parseSec:.2f} s ({rowsPerSec:,.0f} rows/s), cache {cachedSec:.2f} s, '
+                  'render {render:.2f} s, peak {peakRSSMB} MB'.format(render = sum(result['renderSec'].values()),
+                                                                       **result))
+            if not keep:
+                os.remove(fileName)
+
+    return(results)
+
+def compareResults(old, new):
+    """
+    **********************************************************************************************************************
+    *Function: compareResults()
+    *Decription:
+        *    This function prints the speed of two benchmark runs side by side, matched by format, channels and
+             rows. A ratio above 1 means the new run is faster (or uses less memory).
+
+        *Parameters:
+            *    old : results of the reference run (see runBenchmark())
+            *    new : results of the new run
+
+            *Return
+            *    DataFrame of the comparison
+    **********************************************************************************************************************
+    """
+
+    def table(results):
+        df = pd.DataFrame(results['results'])
+        df['renderSec'] = [sum(r.values()) for r in df['renderSec']]
+        return(df.set_index(['format', 'channels', 'rows']))
+
+    a, b = table(old), table(new)
+    both = a.index.intersection(b.index)
+    a, b = a.loc[both], b.loc[both]
+    comparison = pd.DataFrame({'parse old (s)': a['parseSec'], 'parse new (s)': b['parseSec'],
+                               'parse x': a['parseSec'] / b['parseSec'],
+                               'cache x': a['cachedSec'] / b['cachedSec'],
+                               'render x': a['renderSec'] / b['renderSec'],
+                               'memory x': a['peakRSSMB'] / b['peakRSSMB']})
+    print(comparison.round(2).to_string())
+
+    return(comparison)
+
+###Main program starts here
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark Data_Visualization on synthetic DAQ files')
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [10000, 100000, 1000000],
+                        help = 'scan counts, from 10000 up to 100000000')
+    parser.add_argument('--channels', type = int, default = 4, help = 'number of channels')
+    parser.add_argument('--formats', nargs = '+', default = ['agilent', 'hbm'], choices = ['agilent', 'hbm'])
+    parser.add_argument('--shape', default = 'ramp', choices = ['flat', 'ramp', 'runaway'])
+    parser.add_argument('--noise', type = float, default = 0.01, help = 'noise relative to the signal level')
+    parser.add_argument('--transients', type = int, default = 0, help = 'spikes per file')
+    parser.add_argument('--alarm', type = float, default = None, help = 'high alarm limit of the Agilent channels')
+    parser.add_argument('--folder', help = 'work folder of the synthetic files, a temporary folder if not given')
+    parser.add_argument('--keep', action = 'store_true', help = 'keep the synthetic files')
+    parser.add_argument('--out', default = 'benchmark.json', help = 'results file')
+    parser.add_argument('--compare', help = 'results file of an earlier run to compare with')
+    args = parser.parse_args()
+
+    results = runBenchmark(args.sizes, args.channels, args.formats, args.folder, args.keep, shape = args.shape,
+                           noise = args.noise, transients = args.transients, alarmHigh = args.alarm)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent = 2)
+    print('Results saved to', args.out)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compareResults(json.load(f), results)
@@ -41,9 +41,261 @@
 
 ###Import required packages
 import pandas as pd
+import numpy as np
 import csv
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import hashlib
+import importlib
+import glob
+import gzip
+import queue
+import argparse
+import atexit
+import contextlib
+import functools
+import threading
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+#matplotlib is imported by the graph functions on first use, conversion and batch runs without graphs never load it
+
+### Settings
+
+cacheDir = os.path.join(os.path.expanduser('~'), 'DAQ_cache')   # parsed data sets, see loadCache()
+cacheSize = 20 * 1024**3                                        # bytes kept in the cache before old entries are removed
+storeSize = 1024**3                                             # HBM files larger than this go to a memory-mapped store
+storeDtype = 'float32'                                          # channel type in the store, 'float64' for full precision
+outDir = 'C:/Users/mb89539/Desktop/Data_Analysis_workbook/create_csvs/'   # saved .csv files and graphs
+exportFormat = 'csv'                                            # saved files without an extension, see exportType()
+floatFormat = '%.8g'                                            # numbers in saved .csv files (8 digits, like the DAQ)
+exportRows = 500000                                             # rows written at a time, see exportData()
+summaryRows = 10000                                             # x-positions kept in a "summary" export
+plotPoints = 2000                                               # x-positions kept per graph, 0 to plot every sample
+plotMethod = 'minmax'                                           # decimation, 'minmax' envelope or 'lttb', see decimate()
+reportDpi = 200                                                 # resolution of the report pages, see buildReport()
+calFile = ''                                                    # calibration file used by the menus, see readCalibration()
+scaleChannels = False                                           # apply the Agilent channel table Mx+B to raw readings
+followBytes = 64 * 1024**2                                      # bytes parsed per refresh of a followed file
+followRows = 200000                                             # scans kept on screen by the live graph, see FollowGraph()
+followInterval = 1.0                                            # seconds between refreshes of the live graph
+overRange = 9.9e37                                              # Agilent reading of an overload or open input
+scanGap = 5                                                     # scan intervals over this many median ones are events
+pyramidFactor = 8                                               # rows per summary of a pyramid level, 0 for no pyramid
+pyramidRows = 1000000                                           # data sets this long get a pyramid, see savePyramid()
+sessionStep = 1.0                                               # seconds between points of a merged session
+filterWindow = 11                                               # samples in a rolling or Savitzky-Golay window
+filterOrder = 2                                                 # polynomial order of the Savitzky-Golay filter
+psdSegment = 4096                                               # samples per FFT segment, see spectrumChunks()
+poolFigures = 2                                                 # idle figures kept per graph type, see takeFigure()
+catalogFile = os.path.join(cacheDir, 'catalog.sqlite')         # run catalog of every data set loaded, '' for none
+profile = False                                                 # record the time spent in every stage, see span()
+profileMemory = False                                           # also trace Python memory in every stage (slower)
+
+#predesigned graphs, see drawGraph()
+graphTypes = {
+'temp': {'name': 'Temperature Graph', 'xlabel': 'Time (sec)', 'ylabel': 'Temp (C)', 'mult': 1},
+'pressure': {'name': 'Pressure Graph', 'xlabel': 'Time (sec)', 'ylabel': 'Pressure (psi)', 'mult': 50},
+'current': {'name': 'Current', 'xlabel': 'Time (sec)', 'ylabel': 'Current (A)', 'mult': 1},
+'custom': {'name': 'Custom Graph', 'xlabel': '', 'ylabel': '', 'mult': 1, 'rotation': 45}
+}
+
+#DAQ formats in menu order, see addReader() and detectDAQ()
+readers = {
+1: {'name': 'Agilent 34972A "Raw Data"', 'magic': ['Acquisition Date:', 'Total Channels:', '34972A'],
+    'load': 'loadARawData', 'header': 'readAHeader', 'options': ['alarms']},
+2: {'name': 'Agilent 34972A "Processed"', 'sniff': 'sniffProcData', 'load': 'loadProcData'},
+3: {'name': 'HBM MX403B "Raw Data"', 'sniff': 'sniffHBMData', 'load': 'loadHBMRawData', 'header': 'readHBMHeader',
+    'index': 'Time'},
+4: {'name': 'HBM MX840B "Processed"', 'magic': ['MX840'], 'load': 'loadTextData', 'header': 'readTextHeader',
+    'index': 'Time', 'args': {'daq': 4}},
+5: {'name': 'SMUToolBox', 'magic': ['SMUToolBox', 'SMU ToolBox'], 'load': 'loadTextData', 'header': 'readTextHeader',
+    'index': 'Time', 'args': {'daq': 5}},
+6: {'name': 'BMMToolBox', 'magic': ['BMMToolBox', 'BMM ToolBox'], 'load': 'loadTextData', 'header': 'readTextHeader',
+    'index': 'Time', 'args': {'daq': 6}}
+}
+
+### Instrumentation
+
+spans = []                                                      # stages recorded while "profile" is on, see span()
+spanLocal = threading.local()                                   # open stages of each thread
+
+def peakRSS():
+    """    
+    **********************************************************************************************************************
+    *Function: peakRSS()
+    *Decription: 
+        *    This function returns the largest memory (resident set size) used so far by this process. It uses
+             the "resource" module (Linux, macOS) or psutil (Windows) when it is installed.
+             
+            *Return
+            *    Peak RSS in MB, None if it can not be measured
+    **********************************************************************************************************************
+    """
+    
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil                               # only needed on Windows
+        except ImportError:
+            return(None)
+        info = psutil.Process().memory_info()
+        return(getattr(info, 'peak_wset', info.rss) / 1024**2)
+    
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #kB on Linux, bytes on macOS
+    return(peak / (1024**2 if sys.platform == 'darwin' else 1024))
+
+def span(name, detail = None):
+    """    
+    **********************************************************************************************************************
+    *Function: span()
+    *Decription: 
+        *    This function times one stage of the program (header parse, bulk parse, time decode, calibration,
+             export, render, ...) when "profile" is True:
+                    with span('export') as stage:
+                        data.to_csv(fileName)
+                        stage['rows'] = len(data)
+        *    Every stage is added to "spans" with its wall time, CPU time, rows, peak RSS and, when
+             "profileMemory" is True, the peak Python memory seen by tracemalloc. Stages can be nested.
+        *    When "profile" is False nothing is recorded, the stage costs one test.
+             
+        *Parameters:
+            *    name   : stage name, the stages of the same name are added up by profileReport()
+            *    detail : more about this stage (graph title, file name, ...)
+            
+            *Return
+            *    Context manager giving the stage record (dictionary)
+    **********************************************************************************************************************
+    """
+    
+    if not profile:
+        return(contextlib.nullcontext({}))
+    return(recordSpan(name, detail))
+
+@contextlib.contextmanager
+def recordSpan(name, detail = None):
+    """    
+    **********************************************************************************************************************
+    *Function: recordSpan()
+    *Decription: 
+        *    This function records one stage for span() and timed(). The tracemalloc peak is reset at the start of
+             every stage and passed on to the enclosing stage when it ends, so nested stages do not hide the
+             peak of their parent.
+             
+        *Parameters:
+            *    name   : stage name
+            *    detail : more about this stage
+            
+            *Return
+            *    Context manager giving the stage record (dictionary)
+    **********************************************************************************************************************
+    """
+    
+    stack = spanLocal.__dict__.setdefault('stack', [])
+    record = {'name': name, 'detail': detail, 'rows': None, 'start': time.time(),
+              'pid': os.getpid(), 'tid': threading.get_ident()}
+    if profileMemory:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        record['peak'] = 0
+    stack.append(record)
+    wall, cpu = time.perf_counter(), time.process_time()
+    
+    try:
+        yield record
+    finally:
+        record['wall'] = time.perf_counter() - wall
+        record['cpu'] = time.process_time() - cpu
+        stack.pop()
+        if profileMemory:
+            peak = max(record.pop('peak'), tracemalloc.get_traced_memory()[1])
+            record['tracedMB'] = peak / 1024**2
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        record['rssMB'] = peakRSS()
+        spans.append(record)
+        
+def timed(name):
+    """    
+    **********************************************************************************************************************
+    *Function: timed()
+    *Decription: 
+        *    This function is a decorator recording every call of a function as a stage, see span(). The rows are
+             the length of the data set given as first argument (the rows processed), or of the returned data set
+             when the first argument is not a data set (loaders).
+             
+        *Parameters:
+            *    name : stage name
+            
+            *Return
+            *    Decorator
+    **********************************************************************************************************************
+    """
+    
+    def decorate(func):
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            if not profile:
+                return(func(*args, **kwargs))
+            with recordSpan(name) as stage:
+                result = func(*args, **kwargs)
+                for obj in (args[0] if args else None, result):
+                    if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index, np.ndarray)):
+                        stage['rows'] = len(obj)
+                        break
+            return(result)
+        return(run)
+    
+    return(decorate)
+
+def profileReport(fileName = None):
+    """    
+    **********************************************************************************************************************
+    *Function: profileReport()
+    *Decription: 
+        *    This function prints the recorded stages (see span()) added up by name: calls, wall and CPU seconds,
+             rows, rows/s and peak memory. Nested stages are also counted in their parent.
+        *    With a .json file name the stages are saved as a Chrome trace (open it in chrome://tracing or
+             https://ui.perfetto.dev), any other file name saves the summary table as .csv.
+             
+        *Parameters:
+            *    fileName : location of the trace (.json) or of the table, nothing saved if None
+            
+            *Return
+            *    DataFrame of the summary table
+    **********************************************************************************************************************
+    """
+    
+    df = pd.DataFrame(spans, columns = ['name', 'detail', 'rows', 'start', 'pid', 'tid', 'wall', 'cpu',
+                                       'rssMB', 'tracedMB'])
+    table = df.groupby('name', sort = False).agg(calls = ('wall', 'size'), wall = ('wall', 'sum'),
+                                                 cpu = ('cpu', 'sum'), rows = ('rows', 'sum'),
+                                                 rssMB = ('rssMB', 'max'), tracedMB = ('tracedMB', 'max'))
+    #no rows for stages that do not count them
+    table['rows'] = table['rows'].where(df.groupby('name', sort = False)['rows'].count() > 0)
+    table.insert(4, 'rowsPerSec', table['rows'] / table['wall'])
+    print(table.round(3).to_string())
+    
+    if fileName and fileName.lower().endswith('.json'):
+        events = [{'name': s['name'], 'ph': 'X', 'ts': s['start'] * 1e6, 'dur': s['wall'] * 1e6,
+                   'pid': s['pid'], 'tid': s['tid'],
+                   'args': {k: s.get(k) for k in ('detail', 'rows', 'cpu', 'rssMB', 'tracedMB') if s.get(k) is not None}}
+                  for s in spans]
+        with open(fileName, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    elif fileName:
+        table.to_csv(fileName)
+        
+    return(table)
 
 ### Functions
     
@@ -52,14 +304,16 @@ def pickDAQ():
     **********************************************************************************************************************
     *Function: pickDAQ()
     *Decription: 
-        *    This function lets the user select the DAQ from which the data comes
+        *    This function lets the user select the DAQ from which the data comes, when it can not be found from
+             the file header (see detectDAQ())
                 -0 : TO QUIT
                  1 : Agilent 34972A "RawData"
                  2 : Agilent 34972A "Processed""
-                 3 : HBM MX403B "Raw Data"            (to be implemented in future revision)
-                 4 : HBM MX840B "Processes"
-                 5 : SMUToolBox          (to be implemented in future revision)
-                 6 : BMMToolBox          (to be implemented in future revision)
+                 3 : HBM MX403B "Raw Data"
+                 4 : HBM MX840B "Processed"
+                 5 : SMUToolBox
+                 6 : BMMToolBox
+                 and the DAQs added with addReader()
         *    The function prints the DAQ list (above) to the screen and prompts the user for a selection. 
         
         *Parameters:
@@ -70,27 +324,18 @@ def pickDAQ():
     **********************************************************************************************************************
     """
     
-    daq_list = {
-    0: {'name': "TO QUIT"},
-    1: {'name': 'Agilent 34972A "Raw Data"'},
-    2: {'name': 'Agilent 34972A "Processed"'},
-    3: {'name': 'HBM MX403B "Raw Data"'},
-    4: {'name': 'HBM MX403B "Processed"'}
-    }
     print("Data Acquisition Units:")
-    
-    for x, y in daq_list.items():
-        print(x, ':', daq_list[x]['name'])
+    print(0, ':', "TO QUIT")
+    for x, reader in readers.items():
+        print(x, ':', reader['name'])
  
-    while x != 0:
+    while True:
         print("\nSelect a data acquisition unit: ")
         x = int(input())
  
-        if x in daq_list.keys():
-            x = int(x)
-            print("\nYou have chosen {0}".format(daq_list[x]['name']))
-            if x == 1 or 2:
-                return x
+        if x in readers.keys():
+            print("\nYou have chosen {0}".format(readers[x]['name']))
+            return x
             
         elif x == 0:
             quit()
@@ -98,223 +343,3828 @@ def pickDAQ():
         else:
             print("Your choice is not available.")
 
-def getARawData():
+def addReader(daq, name, load, sniff = None, magic = None, header = None, index = None, options = None, args = None):
     """    
     **********************************************************************************************************************
-    *Function: getARawData()
+    *Function: addReader()
     *Decription: 
-        *    This function gets the raw data set from the user and asks:
-                -For Agilent 34972A raw data sets
-                    -The number of sensors
-                    -If multiplier is needed (to provide data corrections andimprove analysis)(to be implemented in future
-                    updates)
-        *    The function performs a visual inspection of the data through the head(), tail(), info(), len(), size 
-             functions or attributes to provide verification of correct files
+        *    This function adds a DAQ format to "readers", so it is listed by pickDAQ(), found by detectDAQ() and
+             read by loadRawData(), the batch mode and the sessions.
+        *    The functions may be given by name, 'loadTextData' for a function of this file or 'module:function' for
+             a function of another module. The module is only imported when a file of that format is read (see
+             readerFunc()), give "magic" rather than "sniff" so finding the DAQ of a file does not import it either.
              
         *Parameters:
-            *    User input for number of sensors
-            *    User input for file name
-            *    User input for multiplier (for data correction and analysis)
+            *    daq     : DAQ number, the menu choice and the 'daq' of the batch jobs
+            *    name    : DAQ name shown in the menu
+            *    load    : load(rawFile, colNames = None, ...), returns the named DataFrame (see loadHBMRawData())
+            *    sniff   : sniff(text), score of the first 64 kB of a file, 0 if it is not of this format
+            *    magic   : strings of the file header that only this format has (score 2 when one is found)
+            *    header  : header(rawFile), dictionary with the sensor names in 'values' (see readAHeader())
+            *    index   : column made the index by nameCols(), None if the loader already indexes the data
+            *    options : batch job keys passed on to load(), ['alarms'] for the Agilent 34972A
+            *    args    : fixed keyword arguments of load()
             
             *Return
-            *    Variable in which data is stored and passed for global usage
+            *    Dictionary "reader" added to "readers"
+    **********************************************************************************************************************
+    """
+    
+    reader = {'name': name, 'load': load, 'index': index}
+    for key, value in (('sniff', sniff), ('magic', magic), ('header', header), ('options', options), ('args', args)):
+        if value is not None:
+            reader[key] = value
+    readers[daq] = reader
+    
+    return(reader)
+
+def readerFunc(daq, key):
+    """    
+    **********************************************************************************************************************
+    *Function: readerFunc()
+    *Decription: 
+        *    This function returns a function of a DAQ format ('load', 'sniff' or 'header', see addReader()). A name
+             is looked up the first time only, a 'module:function' name imports the module then.
+             
+        *Parameters:
+            *    daq : DAQ number in "readers"
+            *    key : 'load', 'sniff' or 'header'
+            
+            *Return
+            *    The function, None if the format has none
+    **********************************************************************************************************************
+    """
+    
+    func = readers[daq].get(key)
+    if isinstance(func, str):
+        if ':' in func:
+            module, name = func.split(':', 1)
+            func = getattr(importlib.import_module(module), name)
+        else:
+            func = globals()[func]
+        readers[daq][key] = func
+    
+    return(func)
+
+def headText(fileName, size = 65536):
+    """    
+    **********************************************************************************************************************
+    *Function: headText()
+    *Decription: 
+        *    This function reads the first "size" bytes of a file as text, UTF-16 when the file starts with a byte
+             order mark (Agilent 34972A exports) and UTF-8 otherwise. Bytes that do not decode are replaced.
+             
+        *Parameters:
+            *    fileName : location of the file
+            *    size     : bytes read
+            
+            *Return
+            *    String "text"
+    **********************************************************************************************************************
+    """
+    
+    with open(fileName, 'rb') as f:
+        raw = f.read(size)
+    if raw[:2] in (b'\xff\xfe', b'\xfe\xff'):
+        return(raw[:len(raw) // 2 * 2].decode('UTF-16', errors = 'replace'))
+    
+    return(raw.decode('utf-8', errors = 'replace').lstrip('\ufeff'))
+
+def sniffProcData(text):
+    """    
+    **********************************************************************************************************************
+    *Function: sniffProcData()
+    *Decription: 
+        *    This function recognises a processed .csv file (an Agilent 34972A "Processed" export or a file saved by
+             this program): a line of column names, then rows of comma separated numbers after the first column.
+             
+        *Parameters:
+            *    text : first lines of the file, see headText()
+            
+            *Return
+            *    1 if the file looks like a processed .csv file, 0 otherwise
+    **********************************************************************************************************************
+    """
+    
+    rows = list(csv.reader(text.splitlines()[:3], dialect = csv.excel))
+    if len(rows) < 2 or len(rows[0]) < 2 or len(rows[1]) != len(rows[0]):
+        return(0)
+    try:
+        [float(x) for x in rows[1][1:]]
+    except ValueError:
+        return(0)
+    
+    return(1)
+
+def sniffHBMData(text):
+    """    
+    **********************************************************************************************************************
+    *Function: sniffHBMData()
+    *Decription: 
+        *    This function recognises an HBM MX403B raw data set: after the preamble, rows of whitespace separated
+             numbers (see readHBMHeader()).
+             
+        *Parameters:
+            *    text : first lines of the file, see headText()
+            
+            *Return
+            *    1 if a line of the first 64 kB is made of two numbers or more, 0 otherwise
+    **********************************************************************************************************************
+    """
+    
+    for line in text.splitlines()[:-1]:
+        tokens = line.split()
+        if len(tokens) > 1:
+            try:
+                [float(x) for x in tokens]
+            except ValueError:
+                continue
+            return(1)
+    
+    return(0)
+
+def detectDAQ(fileName):
+    """    
+    **********************************************************************************************************************
+    *Function: detectDAQ()
+    *Decription: 
+        *    This function finds the DAQ of a file from its first 64 kB (see headText()), so the DAQ no longer has
+             to be picked from the menu. Every format of "readers" gives a score, 2 when one of its "magic" strings
+             is in the header (instrument names, Agilent preamble lines) or the score of its "sniff" function (1
+             for the generic .csv and whitespace layouts). The first format of the highest score is used.
+             
+        *Parameters:
+            *    fileName : location of the raw data
+            
+            *Return
+            *    DAQ number in "readers", None if no format recognises the file
+    **********************************************************************************************************************
+    """
+    
+    text = headText(fileName)
+    lower = text.lower()
+    best, found = 0, None
+    for daq, reader in readers.items():
+        if any(magic.lower() in lower for magic in reader.get('magic', [])):
+            score = 2
+        elif reader.get('sniff') is not None:
+            score = readerFunc(daq, 'sniff')(text)
+        else:
+            score = 0
+        if score > best:
+            best, found = score, daq
+            
+    return(found)
+
+@timed('header parse')
+def readAHeader(fileName):
+    """    
+    **********************************************************************************************************************
+    *Function: readAHeader()
+    *Decription: 
+        *    This function reads only the preamble of an Agilent 34972A raw data set (UTF-16 export) and describes
+             the file, so the number of sensors and the rows to skip no longer have to be entered by hand:
+                -Name, Owner, Acquisition Date and Instrument lines
+                -"Total Channels" and the channel table (Function/Range/Scale/Gain/Offset/Label/...)
+                -The "Scan,Time,..." column line
+        *    The byte offset of the first data row is recorded so the bulk parse can start reading at that byte
+             with the column names and dtypes already known.
+             
+        *Parameters:
+            *    fileName : location of the raw data
+            
+            *Return
+            *    Dictionary "header" with the file metadata:
+                    -'name', 'owner', 'acquisitionDate', 'instrument' : preamble fields
+                    -'numSense'   : number of channels
+                    -'channels'   : list of channel table rows (dictionary per channel)
+                    -'columns'    : data column names
+                    -'values'     : sensor value columns, 'alarms' : alarm columns
+                    -'dtype'      : dtype of every data column
+                    -'skiprows'   : number of lines before the column line
+                    -'dataOffset' : byte offset of the first data row
     **********************************************************************************************************************
     """
     
-    numSense = int(input('Please enter number of sensors used: '))
+    header = {'channels': []}
+    tableKeys = None
+    offset = 2                                  # UTF-16 byte order mark
+    skiprows = 0
+    
+    with open(fileName, encoding = 'UTF-16', newline = '') as f:
+        for line in f:
+            offset += len(line.encode('UTF-16-LE'))
+            row = next(csv.reader([line.rstrip('\r\n')], dialect = csv.excel), [''])
+            
+            if row[0] == 'Scan' and len(row) > 1 and row[1] == 'Time':
+                header['columns'] = row
+                break
+            skiprows += 1
+            
+            if row[0] == 'Name:':
+                header['name'] = row[1]
+            elif row[0] == 'Owner:':
+                header['owner'] = row[1]
+            elif row[0] == 'Acquisition Date:':
+                header['acquisitionDate'] = row[1]
+            elif row[0].lstrip('&') == 'Instrument:':
+                header['instrument'] = row[1]
+            elif row[0] == 'Total Channels:':
+                header['numSense'] = int(row[1])
+            elif row[0] == 'Channel':
+                tableKeys = row
+            elif tableKeys is not None and row[0].isdigit():
+                channel = dict(zip(tableKeys, row))
+                channel['Scale'] = (channel.get('Scale') == 'True')
+                channel['Gain'] = float(channel.get('Gain') or 1)
+                channel['Offset'] = float(channel.get('Offset') or 0)
+                header['channels'].append(channel)
+            else:
+                tableKeys = None
+        else:
+            raise ValueError(fileName + ' has no "Scan,Time" line, is this an Agilent 34972A raw data file?')
+            
+    columns = header['columns']
+    header['values'] = [c for c in columns[2:] if not c.startswith('Alarm')]
+    header['alarms'] = [c for c in columns[2:] if c.startswith('Alarm')]
+    header.setdefault('numSense', len(header['values']))
+    if header['numSense'] != len(header['values']):
+        raise ValueError('"Total Channels" is ' + str(header['numSense']) + ' but the file has ' +
+                         str(len(header['values'])) + ' channel columns')
     
-    data = input("Please enter the location of the raw data: ")
-    data = pd.DataFrame(pd.read_csv(data, dialect = csv.excel, skiprows = (numSense + 8),encoding ='UTF-16'))
+    header['dtype'] = {'Scan': 'int64', 'Time': 'str'}
+    header['dtype'].update({c: 'float64' for c in header['values']})
+    header['dtype'].update({c: 'int8' for c in header['alarms']})
+    header['skiprows'] = skiprows
+    header['dataOffset'] = offset
     
-    data = data.set_index('Scan')
-    #drop alarm columns out of the dataframe
-        #can be disabled if alarms are in use
-    for i in range (2, numSense+2):
-        data.drop(data.columns[[i]], axis = 1, inplace = True)
-    #split the 'Time' column
-    data[['Time','HMS']] = data['Time'].str.split(' ',expand=True)
-    #drop "Time" column
-    data.drop('Time', axis = 1, inplace = True)
-    data[['HMS', 'min', 'sec', 'msec']] = data['HMS'].str.split(':',expand=True)
-    data.rename(columns = {'HMS':'Hour'}, inplace = True)
-    data['temp'] = data['Hour'].str.cat(data['min'],sep=" ")
-    data['HMS'] = data['temp'].str.cat(data['sec'],sep=" ")
-    data = data.set_index('HMS')
+    return(header)
+
+@timed('header parse')
+def readHBMHeader(fileName, maxLines = 1000):
+    """    
+    **********************************************************************************************************************
+    *Function: readHBMHeader()
+    *Decription: 
+        *    This function reads only the preamble of an HBM MX403B raw data set (whitespace separated export) and
+             finds where the data starts, replacing the hard coded "skiprows". The first row made only of numbers
+             is the first data row, the line above it holds the column names.
+        *    When the column line does not split into one unique name per data column (names with spaces, or a
+             units line) the columns are named 'Time', 'Channel 1', 'Channel 2', ...
+             
+        *Parameters:
+            *    fileName : location of the raw data
+            *    maxLines : number of lines searched for the first data row
+            
+            *Return
+            *    Dictionary "header" with the file metadata:
+                    -'numSense'   : number of channels (not counting time)
+                    -'columns'    : data column names, 'values' : channel columns
+                    -'dtype'      : dtype of every data column
+                    -'skiprows'   : number of lines before the first data row
+                    -'dataOffset' : byte offset of the first data row
+    **********************************************************************************************************************
+    """
     
+    offset = 0
+    skiprows = 0
+    last = []
+    row = None
+    with open(fileName, 'rb') as f:
+        for line in f:
+            if skiprows >= maxLines:
+                break
+            tokens = line.decode('latin-1').split()
+            try:
+                [float(x) for x in tokens]
+            except ValueError:
+                last = tokens
+            else:
+                if len(tokens) > 1:
+                    row = tokens
+                    break
+            offset += len(line)
+            skiprows += 1
+            
+    if row is None:
+        raise ValueError('No data rows in the first ' + str(maxLines) + ' lines of ' + fileName)
         
-    data = nameCols(data)
+    if len(last) == len(row) and len(set(last)) == len(last):
+        columns = last
+    else:
+        columns = ['Time'] + ['Channel ' + str(i) for i in range(1, len(row))]
+        
+    header = {'numSense': len(columns) - 1,
+              'columns': columns,
+              'values': columns[1:],
+              'dtype': {c: 'float64' for c in columns},
+              'skiprows': skiprows,
+              'dataOffset': offset}
+    
+    return(header)
+
+@timed('header parse')
+def readTextHeader(fileName, maxLines = 1000):
+    """    
+    **********************************************************************************************************************
+    *Function: readTextHeader()
+    *Decription: 
+        *    This function reads the preamble of a delimited text export (HBM MX840B catman ASCII export, SMUToolBox
+             and BMMToolBox .csv files). The separator (tab, ';', ',' or whitespace) and the decimal mark are found
+             from the first data row, a row where every value after the first column is a number.
+        *    The column names come from the lines right above it with one value per column, the top one of unique
+             names, so a units line under the names is skipped. When there is none the columns are named 'Time',
+             'Channel 1', ...
+        *    The first column is the time, seconds or time stamps.
+             
+        *Parameters:
+            *    fileName : location of the raw data
+            *    maxLines : number of lines searched for the first data row
+            
+            *Return
+            *    Dictionary "header" with the file metadata:
+                    -'numSense'   : number of channels (not counting time)
+                    -'columns'    : data column names, 'values' : channel columns
+                    -'dtype'      : dtype of every channel column
+                    -'skiprows'   : number of lines before the first data row
+                    -'sep', 'decimal', 'encoding' : how read_csv() reads the data rows
+    **********************************************************************************************************************
+    """
     
-    fileName = input('Save file as? ')
-    data.to_csv('C:/Users/mb89539/Desktop/Data_Analysis_workbook/create_csvs/' + fileName + '.csv')
+    with open(fileName, 'rb') as f:
+        encoding = 'UTF-16' if f.read(2) in (b'\xff\xfe', b'\xfe\xff') else 'utf-8-sig'
+    lines = []
+    found = None
+    with open(fileName, encoding = encoding, errors = 'replace') as f:
+        for line in f:
+            if len(lines) >= maxLines:
+                break
+            line = line.rstrip('\r\n')
+            for sep in ('\t', ';', ',', None):
+                tokens = [x.strip().strip('"') for x in line.split(sep)]
+                decimal = ',' if sep != ',' and any(',' in x for x in tokens) else '.'
+                try:
+                    [float(x.replace(decimal, '.')) for x in tokens[1:]]
+                except ValueError:
+                    continue
+                if len(tokens) > 1 and all(tokens[1:]):
+                    found = (sep, decimal, tokens)
+                    break
+            if found:
+                break
+            lines.append(line)
+            
+    if found is None:
+        raise ValueError('No data rows in the first ' + str(maxLines) + ' lines of ' + fileName)
+    sep, decimal, row = found
     
-    return(data)
+    columns = ['Time'] + ['Channel ' + str(i) for i in range(1, len(row))]
+    #names over units: the top line of the block of lines with one name per column
+    for line in reversed(lines):
+        names = [x.strip().strip('"') for x in line.split(sep)]
+        if len(names) != len(row):
+            break
+        if len(set(names)) == len(names) and all(names):
+            columns = names
+        
+    header = {'numSense': len(columns) - 1,
+              'columns': columns,
+              'values': columns[1:],
+              'dtype': {c: 'float64' for c in columns[1:]},
+              'skiprows': len(lines),
+              'sep': sep or r'\s+',
+              'decimal': decimal,
+              'encoding': encoding}
+    
+    return(header)
 
-def getHBMRawData():
+@timed('time decode')
+def decodeATime(times):
     """    
     **********************************************************************************************************************
-    *Function: getHBMRawData()
+    *Function: decodeATime()
     *Decription: 
-        *    This function gets the raw data set from the user and asks:
-                -For Agilent 34972A raw data sets
-                    -The number of sensors
-                    -If multiplier is needed (to provide data corrections andimprove analysis)(to be implemented in future
-                    updates)
-        *    The function performs a visual inspection of the data through the head(), tail(), info(), len(), size 
-             functions or attributes to provide verification of correct files
+        *    This function converts the Agilent 34972A "Time" stamps (M/D/YYYY HH:MM:SS:mmm) to a DatetimeIndex
+             without splitting or joining any strings.
+        *    The stamps are viewed as a fixed width byte array and every field is read right to left as digits up
+             to its separator, so the unpadded month/day/hour and the unpadded milliseconds ("13:42:20:07" is 7 ms)
+             are handled. Only the few distinct dates of a run go through the date parser.
+             
+        *Parameters:
+            *    times : column of time stamp strings
+            
+            *Return
+            *    DatetimeIndex (int64 nanoseconds) named 'Time'
+    **********************************************************************************************************************
+    """
+    
+    b = np.asarray(times, dtype = 'S')
+    n = len(b)
+    m = b.view('uint8').reshape(n, b.itemsize)
+    rows = np.arange(n)
+    stop = np.strings.str_len(b).astype('intp')
+    
+    def field(stop, width):
+        #read up to "width" digits ending before "stop", return the value and the end of the next field
+        value = np.zeros(n, 'int64')
+        count = np.zeros(n, 'intp')
+        digit = np.ones(n, bool)
+        for k in range(1, width + 1):
+            pos = stop - k
+            ch = m[rows, np.maximum(pos, 0)].astype('int64') - 48
+            digit &= (pos >= 0) & (ch >= 0) & (ch <= 9)
+            value += np.where(digit, ch * 10 ** (k - 1), 0)
+            count += digit
+        return(value, stop - count - 1)
+    
+    msec, stop = field(stop, 3)
+    sec, stop = field(stop, 2)
+    mins, stop = field(stop, 2)
+    hour, stop = field(stop, 2)
+    year, stop = field(stop, 4)
+    day, stop = field(stop, 2)
+    month, stop = field(stop, 2)
+    
+    #few distinct dates in a run, parse only those
+    keys, inv = np.unique(year * 10000 + month * 100 + day, return_inverse = True)
+    dayNs = pd.to_datetime(keys.astype('U8'), format = '%Y%m%d').as_unit('ns').asi8
+    ns = dayNs[inv] + ((hour * 60 + mins) * 60 + sec) * 1000000000 + msec * 1000000
+    
+    return(pd.DatetimeIndex(ns.view('datetime64[ns]'), name = 'Time'))
+
+@timed('alarm packing')
+def packAlarms(alarms):
+    """    
+    **********************************************************************************************************************
+    *Function: packAlarms()
+    *Decription: 
+        *    This function packs the "Alarm 1xx" columns of a block into one bitmask per scan. Bit i is set when the
+             i-th alarm column is not 0. Up to 16 channels fit a uint16, up to 64 channels a uint64.
+             
+        *Parameters:
+            *    alarms : DataFrame of the alarm columns, in channel order
+            
+            *Return
+            *    Array of the packed alarm states, one per scan
+    **********************************************************************************************************************
+    """
+    
+    k = alarms.shape[1]
+    if k > 64:
+        raise ValueError('Cannot pack ' + str(k) + ' alarm columns, 64 at most')
+    dtype = 'uint16' if k <= 16 else 'uint64'
+    bits = np.left_shift(np.uint64(1), np.arange(k, dtype = 'uint64'))
+    
+    return(((alarms.to_numpy() != 0) * bits).sum(axis = 1).astype(dtype))
+
+def alarmTransitions(data):
+    """    
+    **********************************************************************************************************************
+    *Function: alarmTransitions()
+    *Decription: 
+        *    This function finds the scans at which the packed 'Alarms' state changes (an alarm is raised or 
+             cleared). A scan with alarms already raised at the start of the data counts as a transition.
+             
+        *Parameters:
+            *    data : DataFrame with the 'Alarms' column made by readAChunks()
+            
+            *Return
+            *    Index of the transition scans
+    **********************************************************************************************************************
+    """
+    
+    mask = data['Alarms'].to_numpy()
+    rows = np.flatnonzero(np.diff(mask, prepend = mask.dtype.type(0)) != 0)
+    
+    return(data.index[rows])
+
+def readAChunks(fileName, chunkSize = 100000, header = None, alarms = False):
+    """    
+    **********************************************************************************************************************
+    *Function: readAChunks()
+    *Decription: 
+        *    This function streams an Agilent 34972A raw data set (UTF-16 export) in blocks of "chunkSize" scans
+             instead of loading the whole file at once. The UTF-16 input is decoded incrementally by the csv reader,
+             so peak memory depends on the chunk size and not on the file size.
+        *    Each block is cleaned the same way as the full data set (time stamps decoded to a DatetimeIndex with
+             an 'Elapsed (sec)' column counted from the first scan of the file) and the sensor columns are typed as
+             float64.
+        *    Only the sensor value columns are parsed, the alarm columns are skipped by the csv reader. If "alarms"
+             is True the alarm columns are read and packed into a single 'Alarms' bitmask column (see packAlarms()).
+             
+        *    The file is opened at the first data row found by readAHeader(), with the column names and dtypes
+             from the header, so pandas does not skip or infer anything.
+             
+        *Parameters:
+            *    fileName  : location of the raw data
+            *    chunkSize : number of scans per block
+            *    header    : dictionary returned by readAHeader(), read from the file if None
+            *    alarms    : keep the alarm states as an 'Alarms' bitmask column
+            
+            *Return
+            *    Generator of DataFrame blocks, one per chunk, in file order
+    **********************************************************************************************************************
+    """
+    
+    if header is None:
+        header = readAHeader(fileName)
+    
+    with open(fileName, 'rb') as raw:
+        raw.seek(header['dataOffset'])
+        yield from parseABlocks(raw, header, chunkSize, alarms)
+        
+def parseABlocks(raw, header, chunkSize = 100000, alarms = False, t0 = None):
+    """    
+    **********************************************************************************************************************
+    *Function: parseABlocks()
+    *Decription: 
+        *    This function parses the data rows of an Agilent 34972A raw data set from a binary stream placed at the 
+             start of a row (UTF-16-LE, no byte order mark). It does the block work of readAChunks() and followA().
+             
+        *Parameters:
+            *    raw       : binary stream (open file or io.BytesIO)
+            *    header    : dictionary returned by readAHeader()
+            *    chunkSize : number of scans per block
+            *    alarms    : keep the alarm states as an 'Alarms' bitmask column
+            *    t0        : time of the first scan of the file (int64 ns), the first scan of the stream if None
+            
+            *Return
+            *    Generator of DataFrame blocks
+    **********************************************************************************************************************
+    """
+    
+    #columns read from the file, the alarm columns are never built unless asked for
+    usecols = ['Time'] + header['values']
+    if alarms:
+        usecols = usecols + header['alarms']
+        
+    f = io.TextIOWrapper(raw, encoding = 'UTF-16-LE', newline = '')
+    reader = pd.read_csv(f, dialect = csv.excel, header = None, names = header['columns'], usecols = usecols,
+                         dtype = {c: header['dtype'][c] for c in usecols}, chunksize = chunkSize)
+    while True:
+        #the csv reader decodes, splits and projects the columns of a block in one call
+        with span('bulk parse') as stage:
+            data = next(reader, None)
+        if data is None:
+            break
+        stage['rows'] = len(data)
+        if alarms:
+            data['Alarms'] = packAlarms(data[header['alarms']])
+            data = data.drop(columns = header['alarms'])
+        #time stamps to a DatetimeIndex and seconds since the first scan
+        stamps = decodeATime(data.pop('Time'))
+        if t0 is None:
+            t0 = stamps.asi8[0]
+        data['Elapsed (sec)'] = (stamps.asi8 - t0) / 1e9
+        data.index = stamps
+        
+        yield data
+    
+
+def followA(state):
+    """    
+    **********************************************************************************************************************
+    *Function: followA()
+    *Decription: 
+        *    This function reads the scans appended to an Agilent 34972A raw data file since the last call, for
+             files that are still being written. Only the complete rows after the byte offset kept in "state" are
+             parsed (at most "followBytes" at a time) and the offset is moved past them, so each call costs only
+             the new data whatever the length of the file. A row still being written is left for the next call.
+        *    Start with state = {'file': rawFile}, the header and the offset of the first data row are added on the
+             first call.
+             
+        *Parameters:
+            *    state : dictionary with 'file', and after the first call 'header', 'offset', 't0', 'alarms'
+            
+            *Return
+            *    DataFrame of the new scans (empty if nothing new)
+    **********************************************************************************************************************
+    """
+    
+    if 'header' not in state:
+        state['header'] = readAHeader(state['file'])
+        state['offset'] = state['header']['dataOffset']
+        state.setdefault('t0', None)
+        state.setdefault('alarms', False)
+        
+    with open(state['file'], 'rb') as raw:
+        raw.seek(state['offset'])
+        new = raw.read(followBytes)
+        
+    #end of the last complete row, a UTF-16-LE newline on a 2 byte boundary
+    end = new.rfind(b'\n\x00')
+    while end > 0 and end % 2:
+        end = new.rfind(b'\n\x00', 0, end + 1)
+    if end < 0:
+        return(pd.DataFrame())
+    
+    data = pd.concat(parseABlocks(io.BytesIO(new[:end + 2]), state['header'], alarms = state['alarms'],
+                                  t0 = state['t0']))
+    state['offset'] += end + 2
+    if state['t0'] is None:
+        state['t0'] = data.index.asi8[0]
+        
+    return(data)
+
+def newRing(columns, rows):
+    """    
+    **********************************************************************************************************************
+    *Function: newRing()
+    *Decription: 
+        *    This function makes a ring buffer holding the last "rows" scans of some columns, for the live graph.
+             The buffer has room for twice "rows" so the last scans are always contiguous and can be handed to
+             matplotlib as views, see ringAppend() and ringView().
+             
+        *Parameters:
+            *    columns : column names
+            *    rows    : number of scans kept
+            
+            *Return
+            *    Dictionary "ring"
+    **********************************************************************************************************************
+    """
+    
+    return({'columns': list(columns),
+            'x': np.empty(2 * rows),
+            'values': np.empty((len(columns), 2 * rows)),
+            'rows': rows,
+            'end': 0})
+
+def ringAppend(ring, x, values):
+    """    
+    **********************************************************************************************************************
+    *Function: ringAppend()
+    *Decription: 
+        *    This function appends scans to a ring buffer. When the buffer is full the last "rows" scans are moved
+             to its start, which happens once every "rows" scans, so appending costs the new scans only.
+             
+        *Parameters:
+            *    ring   : dictionary from newRing()
+            *    x      : x values of the new scans
+            *    values : DataFrame (or 2-D array, one column per ring column) of the new scans
+            
+            *Return
+            *    None
+    **********************************************************************************************************************
+    """
+    
+    rows = ring['rows']
+    x = np.asarray(x)[-rows:]
+    values = np.asarray(values)[-rows:].T
+    n = len(x)
+    if ring['end'] + n > 2 * rows:
+        keep = min(ring['end'], rows - n)
+        ring['x'][:keep] = ring['x'][ring['end'] - keep:ring['end']]
+        ring['values'][:, :keep] = ring['values'][:, ring['end'] - keep:ring['end']]
+        ring['end'] = keep
+    ring['x'][ring['end']:ring['end'] + n] = x
+    ring['values'][:, ring['end']:ring['end'] + n] = values
+    ring['end'] += n
+
+def ringView(ring):
+    """    
+    **********************************************************************************************************************
+    *Function: ringView()
+    *Decription: 
+        *    This function gives the last "rows" scans of a ring buffer, as views (nothing is copied).
+             
+        *Parameters:
+            *    ring : dictionary from newRing()
+            
+            *Return
+            *    x values and the 2-D array of values (one row per column)
+    **********************************************************************************************************************
+    """
+    
+    start = max(ring['end'] - ring['rows'], 0)
+    return(ring['x'][start:ring['end']], ring['values'][:, start:ring['end']])
+
+def saveChunks(chunks, fileName):
+    """    
+    **********************************************************************************************************************
+    *Function: saveChunks()
+    *Decription: 
+        *    This function is the end of a block pipeline. It writes each block to the .csv file as it arrives, the 
+             header is only written with the first block (see writeChunks()).
+             
+        *Parameters:
+            *    chunks   : generator of DataFrame blocks
+            *    fileName : location of the .csv file to create
+            
+            *Return
+            *    Number of rows written
+    **********************************************************************************************************************
+    """
+    
+    return(writeChunks(chunks, fileName, 'csv'))
+
+def exportType(fileName):
+    """    
+    **********************************************************************************************************************
+    *Function: exportType()
+    *Decription: 
+        *    This function gives the export format from the file extension:
+                -'.csv'                  : 'csv'       text, numbers written with "floatFormat"
+                -'.csv.gz', '.csv.zst'   : 'csv.gz', 'csv.zst'   compressed text (zstd needs the zstandard package)
+                -'.parquet'              : 'parquet'   columnar, needs the pyarrow package
+                -'.h5', '.hdf5'          : 'hdf5'      HDF5 table, needs the PyTables package (tables)
+                -'.npz'                  : 'npz'       one NumPy array per column and one for the index
+             
+        *Parameters:
+            *    fileName : location of the exported file
+            
+            *Return
+            *    Format name, "exportFormat" if the extension is not known
+    **********************************************************************************************************************
+    """
+    
+    name = fileName.lower()
+    for ext, fmt in (('.csv.gz', 'csv.gz'), ('.csv.zst', 'csv.zst'), ('.csv', 'csv'), ('.parquet', 'parquet'),
+                     ('.h5', 'hdf5'), ('.hdf5', 'hdf5'), ('.npz', 'npz')):
+        if name.endswith(ext):
+            return(fmt)
+        
+    return(exportFormat)
+
+def exportPath(name, folder = None):
+    """    
+    **********************************************************************************************************************
+    *Function: exportPath()
+    *Decription: 
+        *    This function makes the location of an exported file from the name given by the user: in "folder"
+             unless the name has a folder, with the extension of "exportFormat" unless it has a known one.
+             
+        *Parameters:
+            *    name   : file name, with or without folder and extension
+            *    folder : output folder, "outDir" if None
+            
+            *Return
+            *    Location of the exported file
+    **********************************************************************************************************************
+    """
+    
+    if not os.path.dirname(name):
+        name = os.path.join(folder or outDir, name)
+    if exportType(name) == exportFormat and not name.lower().endswith('.' + exportFormat.replace('hdf5', 'h5')):
+        name = name + '.' + exportFormat.replace('hdf5', 'h5')
+        
+    return(name)
+
+def writeChunks(chunks, fileName, fmt = None, columns = None):
+    """    
+    **********************************************************************************************************************
+    *Function: writeChunks()
+    *Decription: 
+        *    This function writes a block pipeline (or any list of DataFrame blocks) to one file, block after
+             block, so the data set is never converted to text or copied whole (see exportType() for the formats).
+             The .csv header is only written with the first block, Parquet row groups and HDF5 rows are appended.
+        *    NumPy .npz files hold whole arrays, the blocks are joined before they are saved.
+             
+        *Parameters:
+            *    chunks   : generator of DataFrame blocks
+            *    fileName : location of the file to create
+            *    fmt      : format, from the extension if None
+            *    columns  : columns written, all the columns if None
+            
+            *Return
+            *    Number of rows written
+    **********************************************************************************************************************
+    """
+    
+    fmt = fmt or exportType(fileName)
+    if columns is not None:
+        chunks = (data[columns] for data in chunks)
+    if fmt == 'npz':
+        with span('export', fileName) as stage:
+            data = pd.concat(chunks)
+            arrays = {str(col): data[col].to_numpy() for col in data.columns}
+            np.savez(fileName, **{str(data.index.name or 'index'): data.index.to_numpy()}, **arrays)
+            stage['rows'] = len(data)
+        return(len(data))
+    
+    rows = 0
+    with contextlib.ExitStack() as files:
+        writer = None
+        for data in chunks:
+            with span('export', fileName) as stage:
+                if fmt in ('csv', 'csv.gz', 'csv.zst'):
+                    if writer is None:
+                        if fmt == 'csv.zst':
+                            import zstandard                    # only needed for .csv.zst files
+                            writer = files.enter_context(zstandard.open(fileName, 'wt', newline = ''))
+                        else:
+                            writer = files.enter_context((gzip.open if fmt == 'csv.gz' else open)(fileName, 'wt',
+                                                                                                  newline = ''))
+                    data.to_csv(writer, header = (rows == 0), float_format = floatFormat)
+                elif fmt == 'parquet':
+                    import pyarrow, pyarrow.parquet             # only needed for Parquet files
+                    table = pyarrow.Table.from_pandas(data)
+                    if writer is None:
+                        writer = files.enter_context(pyarrow.parquet.ParquetWriter(fileName, table.schema))
+                    writer.write_table(table)
+                elif fmt == 'hdf5':
+                    if writer is None:
+                        writer = files.enter_context(pd.HDFStore(fileName, 'w'))
+                    writer.append('data', data, format = 'table', index = False)
+                else:
+                    raise ValueError('Unknown export format: ' + str(fmt))
+                stage['rows'] = len(data)
+            rows += len(data)
+            
+    return(rows)
+
+def exportData(data, fileName, fmt = None, columns = None, summary = False, filter = None, window = None):
+    """    
+    **********************************************************************************************************************
+    *Function: exportData()
+    *Decription: 
+        *    This function saves a data set, "exportRows" rows at a time (see writeChunks()). 
+        *    A "summary" export keeps the sensor columns (or "columns") decimated to about "summaryRows"
+             x-positions, with the peaks kept (see decimate() and pyramidView()), small enough to be shared.
+        *    A "filter" is applied block by block as the rows are written (see filterChunks()), a 'spectrum'
+             export saves the power spectral density of the columns instead of the rows (see spectrum()).
+             
+        *Parameters:
+            *    data     : the processed data frame
+            *    fileName : location of the file to create
+            *    fmt      : format (see exportType()), from the extension if None
+            *    columns  : columns saved, all the columns (sensor columns for a summary) if None
+            *    summary  : save the decimated summary instead of every row
+            *    filter   : 'mean', 'median', 'savgol', 'derivative' or 'spectrum', see filterData()
+            *    window   : samples per filter window, "filterWindow" if None
+            
+            *Return
+            *    Location of the saved file
+    **********************************************************************************************************************
+    """
+    
+    if filter == 'spectrum':
+        data, summary, filter = spectrum(data, columns), False, None
+    elif summary:
+        columns = columns or sensorCols(data)
+        if 'pyramid' in data.attrs and not filter:
+            data = pyramidView(data, columns, points = summaryRows)
+        elif filter:
+            data = decimate(filterData(pd.DataFrame(data[columns]), filter, window), summaryRows)
+        else:
+            data = decimate(pd.DataFrame(data[columns]), summaryRows)
+        filter = None
+    elif columns is not None:
+        data = data[columns]
+        
+    chunks = (data.iloc[i:i + exportRows] for i in range(0, len(data), exportRows))
+    if filter:
+        chunks = filterChunks(chunks, filter, window)
+    writeChunks(chunks, fileName, fmt)
+    
+    return(fileName)
+
+exportPool = None                                               # background writer, see startExport()
+
+def startExport(data, fileName, fmt = None, columns = None, summary = False, filter = None, window = None):
+    """    
+    **********************************************************************************************************************
+    *Function: startExport()
+    *Decription: 
+        *    This function saves a data set (see exportData()) in a background thread and returns at once, so
+             the graphs can be made while the file is written. The exports run one after the other in the order
+             they were started and the program waits for them before it ends.
+             
+        *Parameters:
+            *    Same as exportData()
+            
+            *Return
+            *    Future of the export, future.result() waits for it and gives the location of the file
+    **********************************************************************************************************************
+    """
+    
+    global exportPool
+    if exportPool is None:
+        exportPool = ThreadPoolExecutor(max_workers = 1)
+        
+    return(exportPool.submit(exportData, data, fileName, fmt, columns, summary, filter, window))
+
+def exportChunks(chunks, fileName, fmt = None, columns = None):
+    """    
+    **********************************************************************************************************************
+    *Function: exportChunks()
+    *Decription: 
+        *    This function is a pipeline stage (like statChunks()) that passes the blocks on unchanged and writes 
+             them to a file (see writeChunks()) in a background thread, so the blocks are written while the next
+             ones are read or computed. At most a few blocks wait for the writer.
+             
+        *Parameters:
+            *    chunks   : generator of DataFrame blocks
+            *    fileName : location of the file to create
+            *    fmt      : format (see exportType()), from the extension if None
+            *    columns  : columns written, all the columns if None
+            
+            *Return
+            *    Generator of the same blocks, the file is complete when it is exhausted
+    **********************************************************************************************************************
+    """
+    
+    waiting = queue.Queue(maxsize = 4)
+    
+    def blocks():
+        #blocks handed to the writer, None at the end
+        while True:
+            data = waiting.get()
+            if data is None:
+                return
+            yield data
+            
+    with ThreadPoolExecutor(max_workers = 1) as pool:
+        writer = pool.submit(writeChunks, blocks(), fileName, fmt, columns)
+        
+        def put(data):
+            while True:
+                try:
+                    waiting.put(data, timeout = 1)
+                    return
+                except queue.Full:
+                    if writer.done():
+                        writer.result()                 # the writer failed, raise its error
+                        
+        try:
+            for data in chunks:
+                put(data)
+                yield data
+        finally:
+            put(None)
+        writer.result()
+        
+def sensorCols(data):
+    """    
+    **********************************************************************************************************************
+    *Function: sensorCols()
+    *Decription: 
+        *    This function lists the sensor columns of a data set, the numeric columns other than 'Elapsed (sec)'
+             and 'Alarms', in order.
+             
+        *Parameters:
+            *    data : DataFrame or block
+            
+            *Return
+            *    List of column names
+    **********************************************************************************************************************
+    """
+    
+    return([c for c in data.columns if c not in ('Elapsed (sec)', 'Alarms') and data[c].dtype.kind in 'iuf'])
+
+def alarmLimits(header, columns):
+    """    
+    **********************************************************************************************************************
+    *Function: alarmLimits()
+    *Decription: 
+        *    This function reads the high alarm limits of the Agilent 34972A channel table (channels whose alarm
+             test is 'Hi' or 'HiLo'), to be used as thresholds by the channel statistics.
+             
+        *Parameters:
+            *    header  : dictionary returned by readAHeader(), or None
+            *    columns : sensor column names, in channel order
+            
+            *Return
+            *    Dictionary {column name: high limit}
+    **********************************************************************************************************************
+    """
+    
+    channels = (header or {}).get('channels', [])
+    return({col: float(channel['High']) for col, channel in zip(columns, channels)
+            if 'Hi' in channel.get('Test', 'Off') and channel.get('High')})
+
+def newStats(columns, thresholds = None):
+    """    
+    **********************************************************************************************************************
+    *Function: newStats()
+    *Decription: 
+        *    This function starts the statistics of a set of channels, filled block by block with updateStats()
+             and read with finishStats(). Every field is an array with one value per channel.
+             
+        *Parameters:
+            *    columns    : sensor column names
+            *    thresholds : {column name: level}, the first time a channel reaches its level is kept
+            
+            *Return
+            *    Dictionary "stats"
+    **********************************************************************************************************************
+    """
+    
+    k = len(columns)
+    thresholds = thresholds or {}
+    stats = {'columns': list(columns),
+             'threshold': np.array([thresholds.get(c, np.nan) for c in columns], 'float64'),
+             'count': np.zeros(k, 'int64'), 'nan': np.zeros(k, 'int64'), 'overrange': np.zeros(k, 'int64'),
+             'mean': np.zeros(k), 'M2': np.zeros(k), 'sumSq': np.zeros(k),
+             'min': np.full(k, np.inf), 'max': np.full(k, -np.inf), 'crossed': np.zeros(k, bool),
+             'minTime': np.full(k, None, object), 'maxTime': np.full(k, None, object),
+             'crossTime': np.full(k, None, object)}
+    
+    return(stats)
+
+def updateStats(stats, block):
+    """    
+    **********************************************************************************************************************
+    *Function: updateStats()
+    *Decription: 
+        *    This function adds one block of scans to the channel statistics, all channels at once. The block mean
+             and sum of squared deviations are merged into the running ones (Welford/Chan update), so the whole
+             data set is never needed and the variance stays accurate on long runs.
+        *    NaN and overrange readings (see "overRange") are counted and left out of the other statistics.
+             
+        *Parameters:
+            *    stats : dictionary from newStats()
+            *    block : DataFrame block holding the columns of "stats"
+            
+            *Return
+            *    The updated "stats"
+    **********************************************************************************************************************
+    """
+    
+    if len(block) == 0:
+        return(stats)
+    v = block[stats['columns']].to_numpy('float64')
+    cols = np.arange(v.shape[1])
+    nan = np.isnan(v)
+    over = np.abs(v) >= overRange
+    ok = ~(nan | over)
+    stats['nan'] += nan.sum(axis = 0)
+    stats['overrange'] += over.sum(axis = 0)
+    
+    n = ok.sum(axis = 0)
+    x = np.where(ok, v, 0.0)
+    mean = np.divide(x.sum(axis = 0), n, out = np.zeros(len(n)), where = n > 0)
+    m2 = np.square(np.where(ok, v - mean, 0.0)).sum(axis = 0)
+    total = stats['count'] + n
+    weight = np.divide(n, total, out = np.zeros(len(n)), where = total > 0)
+    delta = mean - stats['mean']
+    stats['M2'] += m2 + delta**2 * stats['count'] * weight
+    stats['mean'] += delta * weight
+    stats['count'] = total
+    stats['sumSq'] += np.square(x).sum(axis = 0)
+    
+    for key, fill, pick, better in (('min', np.inf, np.argmin, np.less), ('max', -np.inf, np.argmax, np.greater)):
+        i = pick(np.where(ok, v, fill), axis = 0)
+        value = v[i, cols]
+        new = ok[i, cols] & better(value, stats[key])
+        stats[key][new] = value[new]
+        stats[key + 'Time'][new] = block.index[i[new]].astype(object)
+        
+    hit = ok & (v >= stats['threshold'])
+    first = hit.any(axis = 0) & ~stats['crossed']
+    stats['crossTime'][first] = block.index[hit.argmax(axis = 0)[first]].astype(object)
+    stats['crossed'] |= first
+    
+    return(stats)
+
+def finishStats(stats):
+    """    
+    **********************************************************************************************************************
+    *Function: finishStats()
+    *Decription: 
+        *    This function turns the running channel statistics into the run summary table.
+             
+        *Parameters:
+            *    stats : dictionary from newStats()/updateStats()
+            
+            *Return
+            *    DataFrame, one row per channel: count, nan, overrange, min, minTime, max, maxTime, mean, std, rms,
+                 threshold, crossTime (first scan at or above the threshold)
+    **********************************************************************************************************************
+    """
+    
+    n = stats['count']
+    valid = n > 0
+    summary = pd.DataFrame({'count': n, 'nan': stats['nan'], 'overrange': stats['overrange'],
+                            'min': np.where(valid, stats['min'], np.nan), 'minTime': stats['minTime'],
+                            'max': np.where(valid, stats['max'], np.nan), 'maxTime': stats['maxTime'],
+                            'mean': np.where(valid, stats['mean'], np.nan),
+                            'std': np.sqrt(np.divide(stats['M2'], n - 1, out = np.full(len(n), np.nan),
+                                                     where = n > 1)),
+                            'rms': np.sqrt(np.divide(stats['sumSq'], n, out = np.full(len(n), np.nan),
+                                                     where = valid)),
+                            'threshold': stats['threshold'], 'crossTime': stats['crossTime']},
+                           index = pd.Index(stats['columns'], name = 'Channel'))
+    #time stamps or seconds, like the index of the data set
+    for col in ('minTime', 'maxTime', 'crossTime'):
+        summary[col] = pd.Series(stats[col].tolist(), index = summary.index)
+        
+    return(summary)
+
+def statChunks(chunks, stats):
+    """    
+    **********************************************************************************************************************
+    *Function: statChunks()
+    *Decription: 
+        *    This function is a pipeline stage that adds every block passing through to the
+             channel statistics, so they are ready as soon as the file is read.
+             
+        *Parameters:
+            *    chunks : generator of DataFrame blocks
+            *    stats  : dictionary from newStats()
+            
+            *Return
+            *    Generator of the same blocks
+    **********************************************************************************************************************
+    """
+    
+    for data in chunks:
+        updateStats(stats, data)
+        yield data
+        
+@timed('statistics')
+def channelStats(data, thresholds = None, chunkSize = 1000000):
+    """    
+    **********************************************************************************************************************
+    *Function: channelStats()
+    *Decription: 
+        *    This function computes the run summary of every sensor column in one pass, "chunkSize" scans at a
+             time, so a memory-mapped data set (see loadCache()) is read once and never copied whole.
+        *    The summary is kept in data.attrs['stats'] and returned as it is by the next call. Agilent alarm
+             limits of the channel table are used as thresholds when none are given.
+             
+        *Parameters:
+            *    data       : the processed data frame
+            *    thresholds : {column name: level}, see newStats()
+            *    chunkSize  : number of scans read at a time
+            
+            *Return
+            *    DataFrame of the channel statistics, see finishStats()
+    **********************************************************************************************************************
+    """
+    
+    columns = sensorCols(data)
+    summary = data.attrs.get('stats')
+    if thresholds is None and summary is not None and list(summary.index) == columns:
+        return(summary)
+    
+    if thresholds is None:
+        thresholds = alarmLimits(data.attrs.get('header'), columns)
+    stats = newStats(columns, thresholds)
+    for i in range(0, len(data), chunkSize):
+        updateStats(stats, data.iloc[i:i + chunkSize])
+    data.attrs['stats'] = finishStats(stats)
+    
+    return(data.attrs['stats'])
+
+def yLimits(data, graph, margin = 0.05):
+    """    
+    **********************************************************************************************************************
+    *Function: yLimits()
+    *Decription: 
+        *    This function suggests the y-axis limits of a graph from the channel statistics (see channelStats()):
+             the lowest minimum and highest maximum of the series, with the graph multiplier applied (see
+             seriesMult()) and a margin on both sides.
+             
+        *Parameters:
+            *    data   : the processed data frame
+            *    graph  : graph definition
+            *    margin : space added above and below, as a fraction of the range
+            
+            *Return
+            *    [lower, upper] limits, None for a derivative or a spectrum
+    **********************************************************************************************************************
+    """
+    
+    #the statistics are those of the readings, not of a derivative or a spectrum
+    if graph.get('filter') in ('derivative', 'spectrum'):
+        return(None)
+    summary = channelStats(data).loc[graph['series']]
+    mult = seriesMult(data, graph)
+    lower, upper = sorted([summary['min'].min() * mult, summary['max'].max() * mult])
+    pad = (upper - lower) * margin or abs(upper) * margin or 1
+    
+    return([float('%.4g' % (lower - pad)), float('%.4g' % (upper + pad))])
+
+def timeValue(data, t):
+    """    
+    **********************************************************************************************************************
+    *Function: timeValue()
+    *Decription: 
+        *    This function converts a time to the units of the data set index, int64 nanoseconds for a time stamp
+             index (Agilent) or seconds for a numeric index (HBM). On a time stamp index a number is read as
+             seconds from the first scan, anything else as a time stamp ('2019-05-14 13:50', Timestamp, ...).
+             
+        *Parameters:
+            *    data : the processed data frame
+            *    t    : time
+            
+            *Return
+            *    Time in the index units
+    **********************************************************************************************************************
+    """
+    
+    if not isinstance(data.index, pd.DatetimeIndex):
+        return(float(t))
+    if isinstance(t, (int, float, np.number)):
+        return(int(data.index.asi8[0] + t * 1e9))
+    
+    return(pd.Timestamp(t).as_unit('ns').value)
+
+def windowRows(data, t0 = None, t1 = None):
+    """    
+    **********************************************************************************************************************
+    *Function: windowRows()
+    *Decription: 
+        *    This function finds the first and last row of a time window by binary search (searchsorted) in the
+             sorted time index, int64 nanoseconds or seconds.
+             
+        *Parameters:
+            *    data   : the processed data frame, sorted by time
+            *    t0, t1 : first and last time kept (see timeValue()), from the start or to the end if None
+            
+            *Return
+            *    (first row, row after the last)
+    **********************************************************************************************************************
+    """
+    
+    index = data.index
+    if not index.is_monotonic_increasing:
+        raise ValueError('The time index is not sorted, use data.sort_index() first')
+    keys = index.asi8 if isinstance(index, pd.DatetimeIndex) else np.asarray(index)
+    i = 0 if t0 is None else int(keys.searchsorted(timeValue(data, t0), 'left'))
+    j = len(keys) if t1 is None else int(keys.searchsorted(timeValue(data, t1), 'right'))
+    
+    return(i, j)
+
+def timeWindow(data, t0 = None, t1 = None, columns = None):
+    """    
+    **********************************************************************************************************************
+    *Function: timeWindow()
+    *Decription: 
+        *    This function answers "channels X, Y between t0 and t1". Both ends are found by binary search
+             (searchsorted) in the sorted time index, int64 nanoseconds or seconds, so the cost does not depend on
+             the length of the run. The rows are returned as a slice of "data", no values are copied and only
+             the window is read from a memory-mapped data set.
+             
+        *Parameters:
+            *    data    : the processed data frame, sorted by time
+            *    t0, t1  : first and last time kept (see timeValue()), from the start or to the end if None
+            *    columns : columns kept, all columns if None
+            
+            *Return
+            *    DataFrame of the window
+    **********************************************************************************************************************
+    """
+    
+    i, j = windowRows(data, t0, t1)
+    window = data.iloc[i:j]
+    if columns is not None:
+        window = window[columns]
+        
+    return(window)
+
+@timed('event index')
+def eventIndex(data, thresholds = None, gap = None):
+    """    
+    **********************************************************************************************************************
+    *Function: eventIndex()
+    *Decription: 
+        *    This function lists the events of a run, in time order:
+                -'threshold' : a channel goes above ('up') or back below ('down') its threshold
+                -'alarm'     : an Agilent alarm is raised ('on') or cleared ('off'), from the 'Alarms' column
+                -'gap'       : the time since the previous scan is more than "gap" seconds (default "scanGap" times
+                               the median scan interval), the value is the length of the gap
+        *    The thresholds are the alarm limits of the channel table (see channelStats()) unless given. The list
+             is kept in data.attrs['events'] and returned as it is by the next call without arguments, so zooming
+             on an event (see eventWindow()) never scans the run again.
+             
+        *Parameters:
+            *    data       : the processed data frame
+            *    thresholds : {column name: level}
+            *    gap        : shortest scan gap reported, in seconds
+            
+            *Return
+            *    DataFrame indexed by time: 'row' (scan position), 'event', 'channel', 'state', 'value'
+    **********************************************************************************************************************
+    """
+    
+    if thresholds is None and gap is None and 'events' in data.attrs:
+        return(data.attrs['events'])
+    
+    if thresholds is None:
+        thresholds = channelStats(data)['threshold'].dropna().to_dict()
+    found = []
+    for col, level in thresholds.items():
+        above = (data[col].to_numpy() >= level).view('int8')
+        rows = np.flatnonzero(np.diff(above, prepend = np.int8(0)) != 0)
+        found.append(pd.DataFrame({'row': rows, 'event': 'threshold', 'channel': col,
+                                   'state': np.where(above[rows], 'up', 'down'), 'value': level}))
+        
+    if 'Alarms' in data.columns:
+        mask = data['Alarms'].to_numpy()
+        changed = mask ^ np.concatenate([mask[:1] * 0, mask[:-1]])
+        for bit, col in enumerate(sensorCols(data)):
+            rows = np.flatnonzero((changed >> bit) & 1)
+            on = (mask[rows] >> bit) & 1
+            found.append(pd.DataFrame({'row': rows, 'event': 'alarm', 'channel': col,
+                                       'state': np.where(on, 'on', 'off'), 'value': on.astype('float64')}))
+            
+    index = data.index
+    keys = index.asi8 / 1e9 if isinstance(index, pd.DatetimeIndex) else np.asarray(index, 'float64')
+    if len(keys) > 1:
+        step = np.diff(keys)
+        rows = np.flatnonzero(step > (gap or scanGap * np.median(step))) + 1
+        found.append(pd.DataFrame({'row': rows, 'event': 'gap', 'channel': '', 'state': '',
+                                   'value': step[rows - 1]}))
+        
+    events = pd.concat(found) if found else pd.DataFrame(columns = ['row', 'event', 'channel', 'state', 'value'])
+    events = events.sort_values('row', kind = 'stable')
+    events.index = index[events['row'].to_numpy('int64')]
+    data.attrs['events'] = events
+    
+    return(events)
+
+def eventWindow(data, event, pad = 15):
+    """    
+    **********************************************************************************************************************
+    *Function: eventWindow()
+    *Decription: 
+        *    This function gives the time window around one event of eventIndex(), to zoom a graph on it (see
+             the graph 'event' key in plotGraph()).
+             
+        *Parameters:
+            *    data  : the processed data frame
+            *    event : position of the event in eventIndex()
+            *    pad   : seconds kept before and after the event
+            
+            *Return
+            *    [t0, t1] window, time stamps or seconds like the index
+    **********************************************************************************************************************
+    """
+    
+    t = eventIndex(data).index[event]
+    if isinstance(data.index, pd.DatetimeIndex):
+        pad = pd.Timedelta(seconds = pad)
+        
+    return([t - pad, t + pad])
+
+def timeSeconds(index):
+    """    
+    **********************************************************************************************************************
+    *Function: timeSeconds()
+    *Decription: 
+        *    This function converts a time index to seconds from its first row, for a time stamp index (Agilent) 
+             or a numeric index in seconds (HBM).
+             
+        *Parameters:
+            *    index : time index of the data set or of a block
+            
+            *Return
+            *    Array of seconds (float64)
+    **********************************************************************************************************************
+    """
+    
+    if isinstance(index, pd.DatetimeIndex):
+        keys = index.as_unit('ns').asi8
+        return((keys - keys[0]) / 1e9 if len(keys) else keys.astype(np.float64))
+    
+    return(np.asarray(index, dtype = np.float64))
+
+def filterHalo(method, window = None):
+    """    
+    **********************************************************************************************************************
+    *Function: filterHalo()
+    *Decription: 
+        *    This function gives the number of rows on each side of a row used by a filter (see filterData()), the
+             overlap kept between the blocks of filterChunks().
+             
+        *Parameters:
+            *    method : 'mean', 'median', 'savgol' or 'derivative'
+            *    window : samples per window, "filterWindow" if None
+            
+            *Return
+            *    Rows on each side
+    **********************************************************************************************************************
+    """
+    
+    if method == 'derivative':
+        return(1)
+    
+    return((window or filterWindow) // 2)
+
+def filterData(data, method = 'mean', window = None, columns = None):
+    """    
+    **********************************************************************************************************************
+    *Function: filterData()
+    *Decription: 
+        *    This function filters every sensor column of a data set (or a block) at once, as one 2-D array:
+                -'mean'       : centred rolling mean of "window" samples (running sums, O(n))
+                -'median'     : centred rolling median of "window" samples
+                -'savgol'     : Savitzky-Golay smoothing, a polynomial of order "filterOrder" fitted over "window"
+                                samples, it keeps the peaks that a rolling mean flattens
+                -'derivative' : first derivative per second (dT/dt), central differences on the time index
+        *    The windows are in samples, "window" is made odd so they are centred. At the ends of the data set the
+             rolling windows shrink and the Savitzky-Golay filter repeats the first and last reading, so a row only
+             depends on the "filterHalo()" rows on each side and the result is the same block by block (see
+             filterChunks()).
+             
+        *Parameters:
+            *    data    : the processed data frame or a block
+            *    method  : 'mean', 'median', 'savgol' or 'derivative'
+            *    window  : samples per window, "filterWindow" if None
+            *    columns : columns filtered, the sensor columns if None
+            
+            *Return
+            *    Copy of the data with the columns filtered
+    **********************************************************************************************************************
+    """
+    
+    window = (window or filterWindow) // 2 * 2 + 1
+    half = window // 2
+    columns = sensorCols(data) if columns is None else list(columns)
+    data = data.copy()
+    if not columns or not len(data):
+        return(data)
+    
+    if method in ('mean', 'median'):
+        rolling = data[columns].rolling(window, center = True, min_periods = 1)
+        data[columns] = rolling.mean() if method == 'mean' else rolling.median()
+    elif method == 'savgol':
+        #least squares weights of the window, applied to every column by one product
+        order = min(filterOrder, window - 1)
+        weights = np.linalg.pinv(np.vander(np.arange(-half, half + 1), order + 1, increasing = True))[0]
+        values = np.pad(data[columns].to_numpy(np.float64), ((half, half), (0, 0)), mode = 'edge')
+        data[columns] = np.lib.stride_tricks.sliding_window_view(values, window, axis = 0) @ weights
+    elif method == 'derivative':
+        if len(data) < 2:
+            data[columns] = np.nan
+        else:
+            data[columns] = np.gradient(data[columns].to_numpy(np.float64), timeSeconds(data.index), axis = 0)
+    else:
+        raise ValueError('Unknown filter ' + str(method) + ', use mean, median, savgol or derivative')
+        
+    return(data)
+
+def filterChunks(chunks, method = 'mean', window = None, columns = None):
+    """    
+    **********************************************************************************************************************
+    *Function: filterChunks()
+    *Decription: 
+        *    This function filters a stream of blocks (see readAChunks(), mergeChunks(), exportData()) with
+             filterData(). The last rows of each block are kept and put in front of the next one, so the rows near
+             the block edges see the same neighbours as in the whole data set and the output is the same as
+             filtering everything at once. A row is given out once the "filterHalo()" rows after it have come in.
+             
+        *Parameters:
+            *    chunks  : iterable of DataFrame blocks in time order
+            *    method  : 'mean', 'median', 'savgol' or 'derivative'
+            *    window  : samples per window, "filterWindow" if None
+            *    columns : columns filtered, the sensor columns if None
+            
+            *Return
+            *    Generator of the filtered blocks
+    **********************************************************************************************************************
+    """
+    
+    half = filterHalo(method, window)
+    carry = None
+    done = 0                                    # rows of "carry" already given out
+    for block in chunks:
+        data = block if carry is None else pd.concat([carry, block])
+        end = max(done, len(data) - half)
+        if end > done:
+            yield filterData(data, method, window, columns).iloc[done:end]
+        #the rows still to give out and the rows their windows need
+        keep = max(0, end - half)
+        carry = data.iloc[keep:]
+        #concat() compares the attrs of its inputs, the statistics in them can not be compared
+        carry.attrs = {}
+        done = end - keep
+        
+    if carry is not None and len(carry) > done:
+        yield filterData(carry, method, window, columns).iloc[done:]
+
+def spectrumChunks(chunks, columns = None, segment = None):
+    """    
+    **********************************************************************************************************************
+    *Function: spectrumChunks()
+    *Decription: 
+        *    This function gives the power spectral density of the sensor columns (Welch method), to look at the 
+             ripple of a voltage or the noise of a channel. The stream is cut in segments of "segment" samples that
+             overlap by half, each segment has its mean removed and a Hann window applied, and the periodograms of
+             all the segments of all the channels are computed by one FFT per block and averaged.
+        *    The blocks are read one after the other, the last half segment of a block is kept for the next one.
+             The sample rate is the median interval between the rows, the readings are taken as evenly spaced.
+             
+        *Parameters:
+            *    chunks  : iterable of DataFrame blocks in time order
+            *    columns : columns analysed, the sensor columns of the first block if None
+            *    segment : samples per FFT segment, "psdSegment" if None
+            
+            *Return
+            *    DataFrame of the PSD (units squared per Hz) of every column, indexed by 'Frequency (Hz)'
+    **********************************************************************************************************************
+    """
+    
+    segment = segment or psdSegment
+    step = max(1, segment // 2)
+    taper = np.hanning(segment)
+    total = None
+    count = 0
+    carry = None
+    steps = []
+    for block in chunks:
+        if columns is None:
+            columns = sensorCols(block)
+        if len(block) > 1:
+            steps.append(np.median(np.diff(timeSeconds(block.index))))
+        values = block[columns].to_numpy(np.float64)
+        if carry is not None:
+            values = np.concatenate([carry, values])
+        n = (len(values) - segment) // step + 1 if len(values) >= segment else 0
+        if n > 0:
+            #(segments, channels, samples) view of the block, no copy until the mean is removed
+            segs = np.lib.stride_tricks.sliding_window_view(values, segment, axis = 0)[::step][:n]
+            segs = (segs - segs.mean(axis = -1, keepdims = True)) * taper
+            power = (np.abs(np.fft.rfft(segs, axis = -1)) ** 2).sum(axis = 0)
+            total = power if total is None else total + power
+            count += n
+        carry = values[n * step:]
+        
+    if not count:
+        raise ValueError('The spectrum needs ' + str(segment) + ' readings or more')
+    dt = float(np.median(steps))
+    psd = total / count / ((taper ** 2).sum() / dt)
+    #one-sided, the power of the negative frequencies is added to the positive ones
+    psd[:, 1:(segment + 1) // 2] *= 2
+    
+    return(pd.DataFrame(psd.T, index = pd.Index(np.fft.rfftfreq(segment, dt), name = 'Frequency (Hz)'),
+                        columns = columns))
+
+def spectrum(data, columns = None, segment = None):
+    """    
+    **********************************************************************************************************************
+    *Function: spectrum()
+    *Decription: 
+        *    This function gives the power spectral density of the sensor columns of a data set, "exportRows" rows
+             at a time (see spectrumChunks()). A data set shorter than "segment" is analysed as one segment.
+             
+        *Parameters:
+            *    data    : the processed data frame
+            *    columns : columns analysed, the sensor columns if None
+            *    segment : samples per FFT segment, "psdSegment" if None
+            
+            *Return
+            *    DataFrame of the PSD of every column, indexed by 'Frequency (Hz)'
+    **********************************************************************************************************************
+    """
+    
+    columns = sensorCols(data) if columns is None else list(columns)
+    segment = min(segment or psdSegment, len(data))
+    
+    return(spectrumChunks((data.iloc[i:i + exportRows] for i in range(0, len(data), exportRows)), columns, segment))
+
+def fileKey(fileName):
+    """    
+    **********************************************************************************************************************
+    *Function: fileKey()
+    *Decription: 
+        *    This function makes the cache key of a raw data file from its size, modification time and a hash of its
+             content. Only the first and last MiB are hashed so the key of a multi-GB file is still instant, the
+             size and time catch files that are rewritten in the middle.
+             
+        *Parameters:
+            *    fileName : location of the raw data
+            
+            *Return
+            *    Key string
+    **********************************************************************************************************************
+    """
+    
+    stat = os.stat(fileName)
+    h = hashlib.sha1((str(stat.st_size) + ':' + str(stat.st_mtime_ns)).encode())
+    with open(fileName, 'rb') as f:
+        h.update(f.read(1024**2))
+        if stat.st_size > 2 * 1024**2:
+            f.seek(-1024**2, os.SEEK_END)
+            h.update(f.read())
+            
+    return(h.hexdigest())
+
+@timed('cache save')
+def saveCache(fileName, data, header = None):
+    """    
+    **********************************************************************************************************************
+    *Function: saveCache()
+    *Decription: 
+        *    This function stores a parsed data set (after nameCols()) in the cache so the next load of the same raw
+             file skips the csv parse. Each column and the index are saved as a raw .npy file, the column names, the
+             file header and the bookkeeping go in a meta.json sidecar:
+                    cacheDir/<fileKey>/meta.json, index.npy, c0.npy, c1.npy, ...
+        *    After saving, the least recently used entries are removed until the cache fits in "cacheSize".
+        *    Only numeric and time columns can be cached, other data sets are not saved.
+        *    Long data sets also get a level-of-detail pyramid for zoomed graphs, see savePyramid().
+             
+        *Parameters:
+            *    fileName : location of the raw data the data set was read from
+            *    data     : the parsed DataFrame
+            *    header   : dictionary returned by readAHeader()/readHBMHeader(), stored with the data
+            
+            *Return
+            *    True if the data set was saved
+    **********************************************************************************************************************
+    """
+    
+    if not all(dtype.kind in 'biufM' for dtype in list(data.dtypes) + [data.index.dtype]):
+        return(False)
+    
+    key = fileKey(fileName)
+    entry = os.path.join(cacheDir, key)
+    temp = entry + '.tmp'
+    shutil.rmtree(temp, ignore_errors = True)
+    os.makedirs(temp)
+    
+    np.save(os.path.join(temp, 'index.npy'), data.index.to_numpy())
+    for i, col in enumerate(data.columns):
+        np.save(os.path.join(temp, 'c' + str(i) + '.npy'), data[col].to_numpy())
+        
+    meta = {'source': os.path.abspath(fileName),
+            'columns': [str(col) for col in data.columns],
+            'index': data.index.name,
+            'header': header,
+            'bytes': int(data.memory_usage(index = True).sum()),
+            'used': time.time()}
+    with open(os.path.join(temp, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent = 1)
+        
+    shutil.rmtree(entry, ignore_errors = True)
+    os.replace(temp, entry)
+    savePyramid(entry, data)
+    trimCache(keep = key)
+    
+    return(True)
+
+@timed('cache load')
+def loadCache(fileName):
+    """    
+    **********************************************************************************************************************
+    *Function: loadCache()
+    *Decription: 
+        *    This function looks for a raw data file in the cache. When found, the columns are memory-mapped from
+             their .npy files (read only), so loading does not depend on the file size.
+        *    The scans where the alarms change are recomputed when the data set has an 'Alarms' column.
+             
+        *Parameters:
+            *    fileName : location of the raw data
+            
+            *Return
+            *    The cached DataFrame, or None if the file is not in the cache
+    **********************************************************************************************************************
+    """
+    
+    return(openEntry(os.path.join(cacheDir, fileKey(fileName))))
+
+def openEntry(entry):
+    """    
+    **********************************************************************************************************************
+    *Function: openEntry()
+    *Decription: 
+        *    This function opens one cache entry folder (see saveCache(), convertHBM() and storeChunks()) with its
+             columns memory-mapped, used by loadCache() and by the run catalog (see runData()) which keeps the entry
+             of every run and does not need the raw file.
+             
+        *Parameters:
+            *    entry : cache entry folder
+            
+            *Return
+            *    The cached DataFrame, or None if there is no such entry
+    **********************************************************************************************************************
+    """
+    
+    try:
+        with open(os.path.join(entry, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return(None)
+    
+    if 'rows' in meta:
+        #channel store written by convertHBM() or storeChunks()
+        shape = (meta['rows'],)
+        dtypes = meta.get('dtypes', [meta.get('dtype')] * len(meta['columns']))
+        index = np.memmap(os.path.join(entry, 'index.bin'), meta.get('indexDtype', 'float64'), 'r', shape = shape)
+        cols = {col: np.memmap(os.path.join(entry, 'c' + str(i) + '.bin'), dtype, 'r', shape = shape)
+                for i, (col, dtype) in enumerate(zip(meta['columns'], dtypes))}
+    else:
+        index = np.load(os.path.join(entry, 'index.npy'), mmap_mode = 'r')
+        cols = {col: np.load(os.path.join(entry, 'c' + str(i) + '.npy'), mmap_mode = 'r')
+                for i, col in enumerate(meta['columns'])}
+    data = pd.DataFrame(cols, index = pd.Index(index, name = meta['index']), copy = False)
+    data.attrs['header'] = meta['header']
+    if 'pyramid' in meta:
+        data.attrs['pyramid'] = dict(meta['pyramid'], path = entry)
+    if 'Alarms' in data.columns:
+        data.attrs['alarmTransitions'] = alarmTransitions(data)
+        
+    #mark as recently used
+    meta['used'] = time.time()
+    with open(os.path.join(entry, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent = 1)
+        
+    return(data)
+
+def renameCache(fileName, columns):
+    """    
+    **********************************************************************************************************************
+    *Function: renameCache()
+    *Decription: 
+        *    This function replaces the column names saved with a cache entry, used after nameCols() on a data set
+             that was opened from the cache so the names are kept for the next load.
+             
+        *Parameters:
+            *    fileName : location of the raw data
+            *    columns  : new column names, in order
+            
+            *Return
+            *    None
+    **********************************************************************************************************************
+    """
+    
+    metaFile = os.path.join(cacheDir, fileKey(fileName), 'meta.json')
+    with open(metaFile) as f:
+        meta = json.load(f)
+    meta['columns'] = [str(col) for col in columns]
+    with open(metaFile, 'w') as f:
+        json.dump(meta, f, indent = 1)
+
+@timed('HBM store conversion')
+def convertHBM(fileName, header = None, dtype = None, chunkSize = 1000000):
+    """    
+    **********************************************************************************************************************
+    *Function: convertHBM()
+    *Decription: 
+        *    This function converts a large HBM MX403B raw data set once into a memory-mapped channel store in the
+             cache, so plots and calculations only read the channels and rows they use and the rest stays on disk:
+                    cacheDir/<fileKey>/meta.json, index.bin (time, float64), c0.bin, c1.bin, ... (one per channel)
+        *    The file is parsed in blocks of "chunkSize" rows, each channel is appended to its own file so every
+             channel is contiguous on disk. Channels are stored as "storeDtype" (float32) unless another dtype is
+             given, the time axis is always float64.
+        *    The store is opened with loadCache().
+             
+        *Parameters:
+            *    fileName  : location of the raw data
+            *    header    : dictionary returned by readHBMHeader(), read from the file if None
+            *    dtype     : channel type, 'float32' or 'float64'
+            *    chunkSize : number of rows parsed at a time
+            
+            *Return
+            *    Number of rows stored
+    **********************************************************************************************************************
+    """
+    
+    if header is None:
+        header = readHBMHeader(fileName)
+    if dtype is None:
+        dtype = storeDtype
+    timeCol = header['columns'][0]
+    channels = header['columns'][1:]
+    
+    key = fileKey(fileName)
+    entry = os.path.join(cacheDir, key)
+    temp = entry + '.tmp'
+    shutil.rmtree(temp, ignore_errors = True)
+    os.makedirs(temp)
+    
+    files = [open(os.path.join(temp, 'c' + str(i) + '.bin'), 'wb') for i in range(len(channels))]
+    rows = 0
+    try:
+        with open(os.path.join(temp, 'index.bin'), 'wb') as index:
+            reader = pd.read_csv(fileName, sep = r'\s+', skiprows = header['skiprows'], header = None,
+                                 names = header['columns'], dtype = header['dtype'], chunksize = chunkSize)
+            for data in reader:
+                data[timeCol].to_numpy('float64').tofile(index)
+                for f, col in zip(files, channels):
+                    data[col].to_numpy(dtype).tofile(f)
+                rows += len(data)
+    finally:
+        for f in files:
+            f.close()
+            
+    meta = {'source': os.path.abspath(fileName),
+            'columns': channels,
+            'index': 'Time',
+            'header': header,
+            'rows': rows,
+            'dtype': dtype,
+            'bytes': rows * (8 + np.dtype(dtype).itemsize * len(channels)),
+            'used': time.time()}
+    with open(os.path.join(temp, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent = 1)
+        
+    shutil.rmtree(entry, ignore_errors = True)
+    os.replace(temp, entry)
+    savePyramid(entry, loadCache(fileName))
+    trimCache(keep = key)
+    
+    return(rows)
+
+@timed('block store')
+def storeChunks(chunks, fileName, header = None):
+    """    
+    **********************************************************************************************************************
+    *Function: storeChunks()
+    *Decription: 
+        *    This function is the end of a block pipeline (like saveChunks()). It appends each block to a channel
+             store in the cache as it arrives, the same layout as convertHBM() with the index and the columns kept
+             in the types of the first block:
+                    cacheDir/<fileKey>/meta.json, index.bin, c0.bin, c1.bin, ... (one per column)
+        *    Only one block is held in memory at a time, the data set is opened memory-mapped with loadCache().
+             
+        *Parameters:
+            *    chunks   : generator of DataFrame blocks, numeric and time columns only
+            *    fileName : location of the raw data the blocks are read from
+            *    header   : dictionary returned by readAHeader()/readHBMHeader(), stored with the data
+            
+            *Return
+            *    Number of rows stored
+    **********************************************************************************************************************
+    """
+    
+    key = fileKey(fileName)
+    entry = os.path.join(cacheDir, key)
+    temp = entry + '.tmp'
+    shutil.rmtree(temp, ignore_errors = True)
+    os.makedirs(temp)
+    
+    files = []
+    rows = 0
+    try:
+        for data in chunks:
+            if not files:
+                #the first block sets the columns and their types
+                columns, indexName = [str(col) for col in data.columns], data.index.name
+                dtypes, indexDtype = [data[col].dtype for col in data.columns], data.index.dtype
+                files = [open(os.path.join(temp, name + '.bin'), 'wb')
+                         for name in ['index'] + ['c' + str(i) for i in range(len(columns))]]
+            data.index.to_numpy(indexDtype).tofile(files[0])
+            for f, col, dtype in zip(files[1:], data.columns, dtypes):
+                data[col].to_numpy(dtype).tofile(f)
+            rows += len(data)
+    finally:
+        for f in files:
+            f.close()
+    
+    meta = {'source': os.path.abspath(fileName),
+            'columns': columns,
+            'index': indexName,
+            'header': header,
+            'rows': rows,
+            'dtypes': [dtype.str for dtype in dtypes],
+            'indexDtype': indexDtype.str,
+            'bytes': rows * (indexDtype.itemsize + sum(dtype.itemsize for dtype in dtypes)),
+            'used': time.time()}
+    with open(os.path.join(temp, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent = 1)
+    
+    shutil.rmtree(entry, ignore_errors = True)
+    os.replace(temp, entry)
+    savePyramid(entry, loadCache(fileName))
+    trimCache(keep = key)
+    
+    return(rows)
+
+def savePyramid(entry, data, factor = None):
+    """    
+    **********************************************************************************************************************
+    *Function: savePyramid()
+    *Decription: 
+        *    This function adds a level-of-detail pyramid of the sensor columns to a cache entry, so a zoomed graph
+             of a long run reads a few thousand summaries instead of the raw rows (see pyramidView()).
+        *    Level 1 holds the min, max and mean of every "factor" rows, level 2 of every factor**2 rows, ... up
+             to about a thousand summaries. Level 1 is made from the rows in blocks, the next levels from the level
+             below, so the data set is read once. Every level is written block by block, so the memory used does
+             not depend on the length of the data set. Each level is saved next to the data as float32 .npy files
+             (p<level>_min.npy, p<level>_max.npy, p<level>_mean.npy, columns side by side) with the time of the first 
+             row of every summary (p<level>_index.npy).
+        *    Nothing is done for data sets shorter than "pyramidRows", or when "pyramidFactor" is 0.
+             
+        *Parameters:
+            *    entry  : cache entry folder (see saveCache())
+            *    data   : the cached DataFrame
+            *    factor : rows per summary, "pyramidFactor" if None
+            
+            *Return
+            *    Dictionary of the pyramid ('factor', 'levels', 'positions' of the columns), None if not built
+    **********************************************************************************************************************
+    """
+    
+    factor = factor or pyramidFactor
+    cols = sensorCols(data)
+    if not factor or len(data) < max(pyramidRows, factor) or not cols:
+        return(None)
+    
+    def reduce(index, low, high, total, count):
+        #summaries of "factor" consecutive items, the last one may be shorter
+        m = -(-len(index) // factor) * factor - len(index)
+        low, high, total, count = [np.concatenate([a, np.full((m, a.shape[1]), fill, a.dtype)])
+                                   .reshape(-1, factor, a.shape[1])
+                                   for a, fill in ((low, np.nan), (high, np.nan), (total, 0), (count, 0))]
+        return(index[::factor], np.fmin.reduce(low, axis = 1), np.fmax.reduce(high, axis = 1),
+               total.sum(axis = 1), count.sum(axis = 1))
+    
+    def rows(i):
+        #block of the rows as the items of level 0
+        part = data.iloc[i:i + block]
+        v = part[cols].to_numpy('float64')
+        valid = ~np.isnan(v)
+        keys = part.index.asi8 if isinstance(part.index, pd.DatetimeIndex) else np.asarray(part.index, 'float64')
+        return(keys, v, v, np.where(valid, v, 0), valid.astype('int64'))
+    
+    def summarise(level, j, items):
+        #summaries of a block of items written at position j of the level
+        index, low, high, total, count = reduce(*items)
+        j = slice(j, j + len(index))
+        level['index'][j], level['min'][j], level['max'][j] = index, low, high
+        level['total'][j], level['count'][j] = total, count
+        level['mean'][j] = np.divide(total, count, out = np.full(total.shape, np.nan), where = count > 0)
+        
+    def levelFile(level, name):
+        return(os.path.join(entry, 'p' + str(level) + '_' + name + '.npy'))
+    
+    #each level is written block by block to memory-mapped .npy files, made from the rows or from the level
+    #below, the sums and counts are only kept until the next level is made
+    block = factor * 8192
+    keyType = 'int64' if isinstance(data.index, pd.DatetimeIndex) else 'float64'
+    below = None
+    levels = 0
+    while True:
+        levels += 1
+        items = len(data) if below is None else len(below['index'])
+        size = -(-items // factor)
+        level = {name: np.lib.format.open_memmap(levelFile(levels, name), 'w+', dtype,
+                                                 (size,) if name == 'index' else (size, len(cols)))
+                 for name, dtype in (('index', keyType), ('min', 'float32'), ('max', 'float32'),
+                                     ('mean', 'float32'), ('total', 'float64'), ('count', 'int64'))}
+        for i in range(0, items, block):
+            summarise(level, i // factor, rows(i) if below is None else
+                      [below[name][i:i + block] for name in ('index', 'min', 'max', 'total', 'count')])
+        for a in level.values():
+            a.flush()
+        #the mapped files are released before they are removed
+        below, a = level, None
+        if levels > 1:
+            for name in ('total', 'count'):
+                os.remove(levelFile(levels - 1, name))
+        if size <= 1000:
+            break
+    level = below = None
+    for name in ('total', 'count'):
+        os.remove(levelFile(levels, name))
+        
+    pyramid = {'factor': factor, 'levels': levels, 'positions': [data.columns.get_loc(c) for c in cols]}
+    metaFile = os.path.join(entry, 'meta.json')
+    with open(metaFile) as f:
+        meta = json.load(f)
+    meta['pyramid'] = pyramid
+    meta['bytes'] += sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry) if f.startswith('p'))
+    with open(metaFile, 'w') as f:
+        json.dump(meta, f, indent = 1)
+    data.attrs['pyramid'] = dict(pyramid, path = entry)
+    
+    return(pyramid)
+
+def pyramidView(data, series, t0 = None, t1 = None, points = None, kind = 'envelope'):
+    """    
+    **********************************************************************************************************************
+    *Function: pyramidView()
+    *Decription: 
+        *    This function gives the series of a time window ready to plot at about "points" x-positions, from the
+             pyramid of the data set (see savePyramid()). The level is picked from the number of rows in the
+             window, so a zoom or pan on a run of any length reads only a few thousand summaries. Windows of
+             fewer than "points" rows are returned as they are.
+        *    The summaries cut by t0 or t1 are made again from the rows inside the window, so the envelope does not
+             reach past the window.
+                -'envelope' : the min and max of every summary, one after the other (like decimate() 'minmax')
+                -'mean'     : the mean of every summary
+             
+        *Parameters:
+            *    data   : the processed data frame with data.attrs['pyramid']
+            *    series : list of column names
+            *    t0, t1 : time window (see timeValue()), the whole run if None
+            *    points : x-positions wanted, "plotPoints" if None
+            *    kind   : 'envelope' or 'mean'
+            
+            *Return
+            *    DataFrame of the series indexed by time
+    **********************************************************************************************************************
+    """
+    
+    info = data.attrs['pyramid']
+    points = plotPoints if points is None else points
+    i, j = windowRows(data, t0, t1)
+    if not points or j - i <= points:
+        return(pd.DataFrame(data.iloc[i:j][series]))
+    
+    #a level with "factor" to factor**2 summaries per x-position (below the finest one with at least one), the
+    #summaries are then merged by "group" so that a little less than "points" x-positions are left
+    factor = info['factor']
+    budget = max(points // (2 if kind == 'envelope' else 1), 1)
+    level = int(np.floor(np.log((j - i) / budget) / np.log(factor))) - 1
+    level = min(max(level, 1), info['levels'])
+    size = factor ** level
+    #only the summaries inside the window, the rows of the summaries cut by t0 or t1 are summarised here
+    a, b = -(-i // size), j // size
+    if a >= b:
+        return(decimate(pd.DataFrame(data.iloc[i:j][series]), points))
+    
+    def read(name):
+        return(np.load(os.path.join(info['path'], 'p' + str(level) + '_' + name + '.npy'), mmap_mode = 'r')[a:b])
+    
+    def edge(k, l):
+        #one summary of the rows k to l, as in savePyramid()
+        v = data.iloc[k:l][series].to_numpy('float64')
+        count = (~np.isnan(v)).sum(axis = 0)
+        mean = np.divide(np.nansum(v, axis = 0), count, out = np.full(len(series), np.nan), where = count > 0)
+        first = data.index[k:k + 1]
+        first = first.asi8 if isinstance(first, pd.DatetimeIndex) else np.asarray(first, 'float64')
+        return(first, np.fmin.reduce(v)[None], np.fmax.reduce(v)[None], mean[None])
+    
+    try:
+        cols = [info['positions'].index(data.columns.get_loc(c)) for c in series]
+        parts = [(read('index'), read('min')[:, cols], read('max')[:, cols], read('mean')[:, cols])]
+    except (ValueError, OSError):
+        #not a sensor column, or the cache entry was removed
+        return(decimate(pd.DataFrame(data.iloc[i:j][series]), points))
+    group = -(-(b - a) // max(budget - 2, 1))
+    if group > 1:
+        #"group" consecutive summaries as one, the last one may be shorter
+        index, low, high, mean = parts[0]
+        starts = np.arange(0, len(index), group)
+        count = np.add.reduceat((~np.isnan(mean)).astype('int64'), starts, axis = 0)
+        total = np.add.reduceat(np.nan_to_num(mean.astype('float64')), starts, axis = 0)
+        parts = [(index[starts], np.fmin.reduceat(low, starts, axis = 0), np.fmax.reduceat(high, starts, axis = 0),
+                  np.divide(total, count, out = np.full(total.shape, np.nan), where = count > 0))]
+    if i < a * size:
+        parts.insert(0, edge(i, a * size))
+    if b * size < j:
+        parts.append(edge(b * size, j))
+    index, low, high, mean = [np.concatenate(part) for part in zip(*parts)]
+    if kind == 'envelope':
+        values = np.empty((2 * len(index), len(series)))
+        values[0::2] = low
+        values[1::2] = high
+        index = np.repeat(index, 2)
+    else:
+        values = mean
+    if isinstance(data.index, pd.DatetimeIndex):
+        index = pd.DatetimeIndex(index.view('datetime64[ns]'), name = data.index.name)
+    else:
+        index = pd.Index(index, name = data.index.name)
+        
+    return(pd.DataFrame(values, index = index, columns = series))
+
+def trimCache(keep = None):
+    """    
+    **********************************************************************************************************************
+    *Function: trimCache()
+    *Decription: 
+        *    This function removes the least recently used cache entries until the cache holds no more than 
+             "cacheSize" bytes.
+             
+        *Parameters:
+            *    keep : key of an entry that is never removed (the one just saved)
+            
+            *Return
+            *    Number of entries removed
+    **********************************************************************************************************************
+    """
+    
+    entries = []
+    for key in os.listdir(cacheDir) if os.path.isdir(cacheDir) else []:
+        try:
+            with open(os.path.join(cacheDir, key, 'meta.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        entries.append((meta['used'], meta['bytes'], key))
+        
+    total = sum(e[1] for e in entries)
+    removed = 0
+    for used, size, key in sorted(entries):
+        if total <= cacheSize:
+            break
+        if key == keep:
+            continue
+        shutil.rmtree(os.path.join(cacheDir, key), ignore_errors = True)
+        total -= size
+        removed += 1
+        
+    return(removed)
+
+def readCalibration(data, calFile = None, scale = None):
+    """    
+    **********************************************************************************************************************
+    *Function: readCalibration()
+    *Decription: 
+        *    This function builds the calibration of every sensor column, to convert the readings to engineering
+             units:
+                -From the Agilent channel table (data.attrs['header']), only when "scale" is True: channels with
+                 "Scale" set use its Gain and Offset (Mx+B) and its Label as unit. The 34972A applies Mx+B itself
+                 and BenchLink logs the scaled readings (the columns are titled with the Label, e.g. '101 (VDC)'),
+                 so by default the channel table is not applied again. Set it only for files of raw readings.
+                -From a JSON calibration file, which replaces the channel table entries. Keys are column names or 
+                 Agilent channel numbers:
+                    {"Cell 1 P": {"gain": 50, "offset": 0, "unit": "psi"},
+                     "102": {"poly": [0.1, 2.0, 0.5]},
+                     "Shunt": {"gain": 0.01, "table": [[0, 1, 2], [0, 1.1, 2.3]]}}
+        *    Each entry may have a "gain", an "offset", a polynomial "poly" (highest power first, as np.polyval) and
+             a lookup "table" ([x values], [y values], linear interpolation), applied in that order.
+             
+        *Parameters:
+            *    data    : the processed data frame
+            *    calFile : location of the JSON calibration file (optional)
+            *    scale   : apply the Mx+B of the channel table, "scaleChannels" if None
+            
+            *Return
+            *    Dictionary "cal" {column name: calibration entry}
+    **********************************************************************************************************************
+    """
+    
+    header = data.attrs.get('header') or {}
+    sensors = [c for c in data.columns if c not in ('Elapsed (sec)', 'Alarms')]
+    channels = header.get('channels', [])
+    numbers = {channel['Channel']: col for channel, col in zip(channels, sensors)}
+    
+    if scale is None:
+        scale = scaleChannels
+    cal = {}
+    for channel, col in zip(channels if scale else [], sensors):
+        if channel['Scale']:
+            cal[col] = {'gain': channel['Gain'], 'offset': channel['Offset'], 'unit': channel['Label']}
+            
+    if calFile:
+        with open(calFile) as f:
+            for key, entry in json.load(f).items():
+                col = numbers.get(key, key)
+                if col not in data.columns:
+                    raise KeyError('Calibration for ' + key + ' but there is no such column')
+                cal[col] = entry
+                
+    return(cal)
+
+def scaleColumns(data, cols, convert, chunkSize = 1000000):
+    """    
+    **********************************************************************************************************************
+    *Function: scaleColumns()
+    *Decription: 
+        *    This function replaces columns of a data set by convert() of their values, used for the calibration 
+             (see calibrate()) and the multipliers of the batch mode and of the run catalog.
+        *    The rows are converted in blocks of "chunkSize", all the columns of a block together (one float64 
+             array of rows x columns). Columns memory-mapped from the cache (see openEntry()) are written to an
+             unnamed temporary file in "cacheDir" and memory-mapped in turn, so peak memory depends on the block
+             size and not on the length of the data set. Other columns are converted in memory.
+             
+        *Parameters:
+            *    data      : the processed data frame
+            *    cols      : columns converted
+            *    convert   : function of a float64 block (rows x columns) giving the new values
+            *    chunkSize : number of rows converted at a time
+            
+            *Return
+            *    DataFrame with the converted columns (float64)
+    **********************************************************************************************************************
+    """
+    
+    rows = len(data)
+    if any(isinstance(data[col].values, np.memmap) for col in cols) and rows:
+        os.makedirs(cacheDir, exist_ok = True)
+        #removed by the system once the columns are dropped
+        values = np.memmap(tempfile.TemporaryFile(dir = cacheDir), 'float64', 'w+', shape = (len(cols), rows))
+    else:
+        values = np.empty((len(cols), rows))
+    for i in range(0, rows, chunkSize):
+        block = np.column_stack([np.asarray(data[col].values[i:i + chunkSize], 'float64') for col in cols])
+        values[:, i:i + chunkSize] = convert(block).T
+        
+    for j, col in enumerate(cols):
+        data[col] = pd.Series(values[j], index = data.index, copy = False)
+        
+    return(data)
+
+@timed('calibration')
+def calibrate(data, cal):
+    """    
+    **********************************************************************************************************************
+    *Function: calibrate()
+    *Decription: 
+        *    This function converts the sensor columns to engineering units once, so every graph reuses the result 
+             instead of scaling its own copy.
+        *    The gains and offsets of all the calibrated columns are applied together, as one broadcast over the 
+             block of channels, then the polynomials and lookup tables of the columns that have one. The columns
+             are replaced in "data", block by block (see scaleColumns()), and the calibration is kept in 
+             data.attrs['calibration'].
+             
+        *Parameters:
+            *    data : the processed data frame
+            *    cal  : calibration from readCalibration()
+            
+            *Return
+            *    DataFrame with the calibrated columns
+    **********************************************************************************************************************
+    """
+    
+    cols = list(cal)
+    if not cols:
+        return(data)
+    
+    gain = np.array([cal[c].get('gain', 1) for c in cols], 'float64')
+    offset = np.array([cal[c].get('offset', 0) for c in cols], 'float64')
+    
+    def convert(values):
+        values *= gain
+        values += offset
+        for j, col in enumerate(cols):
+            if 'poly' in cal[col]:
+                values[:, j] = np.polyval(cal[col]['poly'], values[:, j])
+            if 'table' in cal[col]:
+                values[:, j] = np.interp(values[:, j], *cal[col]['table'])
+        return(values)
+    
+    data = scaleColumns(data, cols, convert)
+    data.attrs['calibration'] = cal
+    #the statistics, events and pyramid were taken in the raw units
+    for key in ('stats', 'events', 'pyramid'):
+        data.attrs.pop(key, None)
+    
+    return(data)
+
+@timed('load Agilent')
+def loadARawData(rawFile, colNames = None, alarms = None):
+    """    
+    **********************************************************************************************************************
+    *Function: loadARawData()
+    *Decription: 
+        *    This function loads an Agilent 34972A raw data set without asking anything, it is the engine behind
+             getARawData() and the batch mode (see runJob()).
+        *    The data set comes from the cache when the file was loaded before. Otherwise the blocks of the file
+             are written to the cache as they are parsed (see storeChunks()) and the data set is opened from there
+             memory-mapped, so peak memory depends on the block size and not on the file size.
+        *    The number of sensors is read from the file header (see readAHeader())
+        *    The alarm states are kept in an 'Alarms' column when a channel has an alarm test set (or "alarms" is
+             True), the scans where they change are stored in data.attrs['alarmTransitions']
+        *    The channel statistics are computed block by block while the file is read and kept in
+             data.attrs['stats'] (see channelStats())
+             
+        *Parameters:
+            *    rawFile  : location of the raw data
+            *    colNames : sensor names in channel order, the user is asked for them if None
+            *    alarms   : keep the alarm states, True/False, or None to follow the channel table
+            
+            *Return
+            *    DataFrame of the named sensor columns
+    **********************************************************************************************************************
+    """
+    
+    data = loadCache(rawFile)
+    if data is not None:
+        print('Loaded from the cache:', ', '.join(data.columns))
+        if colNames is not None:
+            data = nameCols(data, colNames, 1)
+            renameCache(rawFile, data.columns)
+        return(data)
+    
+    #the number of sensors and the header rows come from the file itself
+    header = readAHeader(rawFile)
+    print(header['numSense'], 'sensors found:', ', '.join(header['values']))
+    #keep the alarm states only if an alarm test is set on a channel
+    if alarms is None:
+        alarms = any(channel.get('Test', 'Off') != 'Off' for channel in header['channels'])
+    #the blocks of readAChunks() go straight to the cache store, the channel statistics are taken on the way
+    stats = newStats(header['values'], alarmLimits(header, header['values']))
+    storeChunks(statChunks(readAChunks(rawFile, header = header, alarms = alarms), stats), rawFile, header)
+    data = loadCache(rawFile)
+    data.attrs['stats'] = finishStats(stats)
+        
+    data = nameCols(data, colNames, 1)
+    renameCache(rawFile, data.columns)
+    
+    return(data)
+
+def getARawData(alarms = None):
+    """    
+    **********************************************************************************************************************
+    *Function: getARawData()
+    *Decription: 
+        *    This function gets the raw data set from the user and asks:
+                -For Agilent 34972A raw data sets
+                    -If multiplier is needed (to provide data corrections andimprove analysis)(to be implemented in future
+                    updates)
+        *    The data set is loaded by loadARawData(), see getRawData()
+        *    The function performs a visual inspection of the data through the head(), tail(), info(), len(), size 
+             functions or attributes to provide verification of correct files
+             
+        *Parameters:
+            *    alarms : keep the alarm states, True/False, or None to follow the channel table
+            *    User input for file name
+            *    User input for multiplier (for data correction and analysis)
+            
+            *Return
+            *    Variable in which data is stored and passed for global usage
+    **********************************************************************************************************************
+    """
+    
+    return(getRawData(1, alarms = alarms))
+
+@timed('load HBM')
+def loadHBMRawData(rawFile, colNames = None):
+    """    
+    **********************************************************************************************************************
+    *Function: loadHBMRawData()
+    *Decription: 
+        *    This function loads an HBM MX403B raw data set without asking anything, it is the engine behind
+             getHBMRawData() and the batch mode (see runJob()).
+        *    The data set comes from the cache when the file was loaded before. Files larger than "storeSize" are
+             converted to a memory-mapped store (see convertHBM()), smaller files are parsed and cached.
+             
+        *Parameters:
+            *    rawFile  : location of the raw data
+            *    colNames : sensor names in channel order, the user is asked for them if None
+            
+            *Return
+            *    DataFrame of the named sensor columns indexed by time
+    **********************************************************************************************************************
+    """
+    
+    data = loadCache(rawFile)
+    if data is not None:
+        print('Loaded from the cache:', ', '.join(data.columns))
+        if colNames is not None:
+            data = nameCols(data, colNames, 3)
+            renameCache(rawFile, data.columns)
+        return(data)
+    
+    header = readHBMHeader(rawFile)
+    if os.path.getsize(rawFile) > storeSize:
+        #too large for memory, convert once to a memory-mapped store
+        print('Converting', header['numSense'], 'channels to a memory-mapped store...')
+        convertHBM(rawFile, header)
+        data = nameCols(loadCache(rawFile), colNames, 3)
+        renameCache(rawFile, data.columns)
+        return(data)
+    
+    with span('bulk parse') as stage:
+        data = pd.read_csv(rawFile, sep = r'\s+', skiprows = header['skiprows'], header = None,
+                           names = header['columns'], dtype = header['dtype'])
+        stage['rows'] = len(data)
+    #data.set_index('Time', inplace = True)
+    data.dropna(axis = 1, inplace = True)
+    data.attrs['header'] = header
+    data.head()
+        
+    data = nameCols(data, colNames, 3)
+    saveCache(rawFile, data, header)
+    
+    return(data)
+
+def getHBMRawData():
+    """    
+    **********************************************************************************************************************
+    *Function: getHBMRawData()
+    *Decription: 
+        *    This function gets the raw data set from the user and asks:
+                -For Agilent 34972A raw data sets
+                    -The number of sensors
+                    -If multiplier is needed (to provide data corrections andimprove analysis)(to be implemented in future
+                    updates)
+        *    The data set is loaded by loadHBMRawData(), see getRawData()
+        *    The function performs a visual inspection of the data through the head(), tail(), info(), len(), size 
+             functions or attributes to provide verification of correct files
+             
+        *Parameters:
+            *    User input for number of sensors
+            *    User input for file name
+            *    User input for multiplier (for data correction and analysis)
+            
+            *Return
+            *    Variable in which data is stored and passed for global usage
+    **********************************************************************************************************************
+    """
+    
+    return(getRawData(3))
+
+def loadProcData(rawFile, colNames = None):
+    """    
+    **********************************************************************************************************************
+    *Function: loadProcData()
+    *Decription: 
+        *    This function loads a processed .csv file (Agilent 34972A "Processed" export or a file saved by this 
+             program). The columns are only named when "colNames" is given.
+        *    A 'Time' column becomes the index, a DatetimeIndex for time stamps (the 'Scan' numbers are dropped),
+             so it is not taken for a channel. Files without one are indexed by their first column.
+             
+        *Parameters:
+            *    rawFile  : location of the .csv file
+            *    colNames : sensor names in column order, the names of the file are kept if None
+            
+            *Return
+            *    DataFrame of the file
+    **********************************************************************************************************************
+    """
+    
+    data = pd.DataFrame(pd.read_csv(rawFile, dialect = csv.excel))
+    if 'Time' in data.columns and pd.api.types.is_numeric_dtype(data['Time']):
+        data.set_index('Time', inplace = True)
+    elif 'Time' in data.columns:
+        #time stamps saved by this program, or of the Agilent export (see decodeATime())
+        times = pd.to_datetime(data['Time'], format = 'ISO8601', errors = 'coerce')
+        if times.isna().any():
+            times = decodeATime(data['Time'])
+        data.drop(columns = [c for c in ('Scan', 'Time') if c in data.columns], inplace = True)
+        data.index = pd.DatetimeIndex(times, name = 'Time').as_unit('ns')
+    else:
+        data.set_index(data.columns[0], inplace = True)
+    #the columns of the file, as the channel labels of a raw data header
+    data.attrs['header'] = {'values': [c for c in data.columns if c not in ('Elapsed (sec)', 'Alarms')]}
+    if colNames is not None:
+        data = nameCols(data, colNames, 2)
+        
+    return(data)
+
+@timed('load text')
+def loadTextData(rawFile, colNames = None, daq = 4):
+    """    
+    **********************************************************************************************************************
+    *Function: loadTextData()
+    *Decription: 
+        *    This function loads a delimited text export (HBM MX840B, SMUToolBox, BMMToolBox, see readTextHeader())
+             without asking anything. The data set comes from the cache when the file was loaded before, otherwise
+             the file is parsed, the columns are named and the result is cached. Time stamps in the first column
+             become a DatetimeIndex, seconds stay a number.
+             
+        *Parameters:
+            *    rawFile  : location of the raw data
+            *    colNames : sensor names in channel order, the user is asked for them if None
+            *    daq      : DAQ number of the file in "readers"
+            
+            *Return
+            *    DataFrame of the named sensor columns indexed by time
+    **********************************************************************************************************************
+    """
+    
+    data = loadCache(rawFile)
+    if data is not None:
+        print('Loaded from the cache:', ', '.join(data.columns))
+        if colNames is not None:
+            data = nameCols(data, colNames, daq)
+            renameCache(rawFile, data.columns)
+        return(data)
+    
+    header = readTextHeader(rawFile)
+    data = pd.read_csv(rawFile, sep = header['sep'], skiprows = header['skiprows'], header = None,
+                       names = header['columns'], dtype = header['dtype'], decimal = header['decimal'],
+                       encoding = header['encoding'], encoding_errors = 'replace')
+    time = data.columns[0]
+    if not pd.api.types.is_numeric_dtype(data[time]):
+        data[time] = pd.to_datetime(data[time])
+    data.dropna(axis = 1, how = 'all', inplace = True)
+    data.attrs['header'] = header
+    
+    data = nameCols(data, colNames, daq)
+    saveCache(rawFile, data, header)
+    
+    return(data)
+
+def loadRawData(rawFile, daq = None, colNames = None, **options):
+    """    
+    **********************************************************************************************************************
+    *Function: loadRawData()
+    *Decription: 
+        *    This function loads a data set of any DAQ of "readers" without asking anything, the DAQ is found from
+             the file header when it is not given (see detectDAQ()).
+             
+        *Parameters:
+            *    rawFile  : location of the raw data
+            *    daq      : DAQ number in "readers", found from the file if None
+            *    colNames : sensor names in channel order, the user is asked for them if None
+            *    options  : batch job keys, only the "options" of the DAQ are passed to its loader ('alarms')
+            
+            *Return
+            *    DataFrame of the named sensor columns
+    **********************************************************************************************************************
+    """
+    
+    if daq is None:
+        daq = detectDAQ(rawFile)
+        if daq is None:
+            raise ValueError(rawFile + ' is not a file of a known DAQ, give its "daq"')
+    if daq not in readers:
+        raise ValueError('DAQ ' + str(daq) + ' is not available')
+    reader = readers[daq]
+    options = {key: value for key, value in options.items() if key in reader.get('options', [])}
+    
+    return(readerFunc(daq, 'load')(rawFile, colNames, **reader.get('args', {}), **options))
+
+def getRawData(daq = None, **options):
+    """    
+    **********************************************************************************************************************
+    *Function: getRawData()
+    *Decription: 
+        *    This function gets the raw data set from the user. The DAQ is found from the file header (see
+             detectDAQ()) and only asked (see pickDAQ()) when it is not recognised.
+        *    The data set is loaded by loadRawData(), calibrated with "calFile" and added to the run catalog (see
+             catalogRun()), then it can be saved.
+             
+        *Parameters:
+            *    daq     : DAQ number in "readers", found from the file if None
+            *    options : passed to loadRawData() ('alarms')
+            *    User input for file name
+            
+            *Return
+            *    Variable in which data is stored and passed for global usage
+    **********************************************************************************************************************
+    """
+    
+    global DAQ
+    rawFile = input("Please enter the location of the raw data: ")
+    if daq is None:
+        daq = detectDAQ(rawFile)
+        if daq is None:
+            print('The DAQ of this file is not recognised.')
+            daq = pickDAQ()
+        else:
+            print('Reading', readers[daq]['name'])
+    DAQ = daq
+    data = loadRawData(rawFile, daq, **options)
+    data = calibrate(data, readCalibration(data, calFile))
+    data.attrs['source'] = rawFile
+    if catalogFile:
+        import sqlite3                                  # only needed for the run catalog
+        try:
+            catalogRun(data, rawFile, daq)
+        except sqlite3.Error as e:
+            #the catalog only records the run, the data set is usable without it
+            print('Not added to the run catalog:', e)
+    
+    fileName = input('Save file as? (blank to skip, .csv .csv.gz .csv.zst .parquet .h5 .npz) ')
+    if fileName:
+        fileName = exportPath(fileName)
+        print('Saving', fileName, 'in the background')
+        startExport(data, fileName)
+    
+    return(data)
+
+@timed('naming')
+def nameCols(data, colNames = None, daq = None):
+    """    
+    **********************************************************************************************************************
+    *Function: nameCols()
+    *Decription: 
+        *    This function lets the user name the colums in order.
+            *    Future revision will replace with text boxes in a GUI dialog box
+        *    When "colNames" is given (batch mode) those names are used and nothing is asked
+            
+        *Parameters:
+            *    User input for column names
+            *    colNames : sensor names in order, asked from the user if None
+            *    daq      : DAQ number in "readers" (see pickDAQ()), the DAQ of the menu if None
+            
+            *Return
+            *    DataFrame named data with user named columns
+    **********************************************************************************************************************
+    """
+    
+    if daq is None:
+        daq = DAQ
+    ask = colNames is None
+    colNames = [] if ask else list(colNames)
+    
+    #the first column becomes the index ('Scan', 'Time', see "readers"), unless the data is already indexed by it
+    index = readers[daq].get('index')
+    if index is not None and data.index.name != index:
+        data.rename(columns = {data.columns[0]: index}, inplace = True)
+        data.set_index(index, inplace = True)
+        
+    #'Elapsed (sec)' and 'Alarms' keep their names
+    sensors = [c for c in data.columns if c not in ('Elapsed (sec)', 'Alarms')]
+    for i in range(0, len(sensors) if ask else 0):
+        print("Please enter sensor ", i+1, "name: ")
+        item = input()
+        colNames.append(item)
+        
+    data.rename(columns = dict(zip(sensors, colNames)), inplace = True)
+    if 'stats' in data.attrs:
+        data.attrs['stats'] = data.attrs['stats'].rename(index = dict(zip(sensors, colNames)))
+    if 'events' in data.attrs:
+        data.attrs['events']['channel'] = data.attrs['events']['channel'].replace(dict(zip(sensors, colNames)))
+    
+    # for i in range(1, len(data.columns)):
+    #     print("Please enter sensor ", i, "name: ")
+    #     item = input()
+    #     colNames.append(item)
+        
+    # colNames = defaultColNames + colNames
+    # data.columns = colNames
+    # data.set_index(defaultColNames, inplace = True)
+        
+    return(data)
+    
+def fileNames(rawFile, daq = None):
+    """    
+    **********************************************************************************************************************
+    *Function: fileNames()
+    *Decription: 
+        *    This function gives the channel names written in the header of a raw data file, so a file can be
+             loaded without asking for names (see loadPart() and processFile()). A file already in the cache keeps
+             the names it was cached with.
+             
+        *Parameters:
+            *    rawFile : location of the raw data
+            *    daq     : DAQ number in "readers", found from the file if None (see detectDAQ())
+            
+            *Return
+            *    List of the channel names, None for a cached file or a DAQ without a header reader
+    **********************************************************************************************************************
+    """
+    
+    if loadCache(rawFile) is not None:
+        return(None)
+    if daq is None:
+        daq = detectDAQ(rawFile)
+    if daq not in readers or readers[daq].get('header') is None:
+        return(None)
+    
+    return(readerFunc(daq, 'header')(rawFile)['values'])
+
+def loadPart(rawFile, daq = None, names = None):
+    """    
+    **********************************************************************************************************************
+    *Function: loadPart()
+    *Decription: 
+        *    This function loads one file of a session (see mergeChunks()). The file is parsed and cached once if
+             needed, then opened again from the cache so its columns stay memory-mapped on disk and a session of
+             many files does not have to fit in memory.
+             
+        *Parameters:
+            *    rawFile : location of the raw data
+            *    daq     : DAQ number in "readers", found from the file if None (see detectDAQ())
+            *    names   : sensor names in channel order, the names in the cache (or the file) if None
+            
+            *Return
+            *    DataFrame of the file
+    **********************************************************************************************************************
+    """
+    
+    if names is None:
+        cached = loadCache(rawFile)
+        if cached is not None:
+            return(cached)
+        names = fileNames(rawFile, daq)
+    data = loadRawData(rawFile, daq, names)
+    cached = loadCache(rawFile)
+    
+    return(data if cached is None else cached)
+
+def resampleTimes(t, values, grid, method = 'linear', tolerance = None):
+    """    
+    **********************************************************************************************************************
+    *Function: resampleTimes()
+    *Decription: 
+        *    This function puts channels sampled at times "t" onto the times "grid", all channels at once, with
+             one binary search (searchsorted) for the neighbours of every grid point:
+                -'linear'   : straight line between the scans before and after
+                -'nearest'  : value of the closest scan
+                -'previous' : value of the last scan at or before the grid point (as of join)
+        *    A grid point gets NaN when its neighbours are more than "tolerance" apart (or away, for 'nearest' and
+             'previous'), so gaps and the time outside the file are not filled.
+             
+        *Parameters:
+            *    t         : sorted scan times (int64 ns)
+            *    values    : channel values, array of scans x channels
+            *    grid      : grid times (int64 ns)
+            *    method    : 'linear', 'nearest' or 'previous'
+            *    tolerance : largest gap filled (ns), no limit if None
+            
+            *Return
+            *    Array of grid points x channels
+    **********************************************************************************************************************
+    """
+    
+    n = len(t)
+    out = np.full((len(grid), values.shape[1]), np.nan)
+    if n == 0:
+        return(out)
+    tolerance = np.inf if tolerance is None else tolerance
+    after = t.searchsorted(grid, 'left')
+    a = np.minimum(after, n - 1)
+    b = np.maximum(after - 1, 0)
+    exact = (after < n) & (t[a] == grid)
+    
+    if method == 'linear':
+        span = (t[a] - t[b]).astype('float64')
+        ok = exact | ((after > 0) & (after < n) & (span <= tolerance))
+        w = np.divide(grid - t[b], span, out = np.zeros(len(grid)), where = span > 0)[:, None]
+        out[ok] = (values[b] + w * (values[a] - values[b]))[ok]
+        out[exact] = values[a[exact]]
+    elif method in ('nearest', 'previous'):
+        if method == 'nearest':
+            pick = np.where((after < n) & ((after == 0) | (t[a] - grid < grid - t[b])), a, b)
+        else:
+            pick = np.where(exact, a, b)
+        ok = (abs(t[pick] - grid) <= tolerance) & (exact | (after > 0) | (method == 'nearest'))
+        out[ok] = values[pick[ok]]
+    else:
+        raise ValueError('Unknown resampling method: ' + str(method))
+    
+    return(out)
+
+def mergeChunks(sources, step = None, method = 'linear', chunkSize = 100000):
+    """    
+    **********************************************************************************************************************
+    *Function: mergeChunks()
+    *Decription: 
+        *    This function merges the files of one test into a single session on a uniform time grid, "step"
+             seconds apart, from the first to the last scan of all the files. Consecutive files of the same DAQ
+             are joined one after the other and the channels of different DAQs (Agilent scans that drift between
+             150 and 400 ms, a uniform HBM capture, ...) are resampled onto the grid (see resampleTimes()).
+        *    The grid is made "chunkSize" points at a time, each block only reads the rows of each file in its time
+             window (see timeWindow()), so the session never has to fit in memory. Save it with saveChunks() or
+             join it with pd.concat().
+        *    Each source is a dictionary:
+                -'daq'       : DAQ number in "readers", found from each file if missing (see detectDAQ())
+                -'files'     : raw data files in time order
+                -'names'     : sensor names in channel order (optional)
+                -'columns'   : columns merged (optional, all the sensors)
+                -'prefix'    : added to the column names, for channels of the same name in two DAQs (optional)
+                -'start'     : time stamp of the first HBM sample, HBM times are seconds from the start of the
+                               capture (one per file, or one for all the files if the captures follow each other)
+                -'tolerance' : largest gap filled in seconds (optional, "scanGap" times the median scan interval)
+        *    Calibrate the merged session with calibrate() if needed.
+             
+        *Parameters:
+            *    sources   : list of source dictionaries
+            *    step      : seconds between grid points, "sessionStep" if None
+            *    method    : 'linear', 'nearest' or 'previous', see resampleTimes()
+            *    chunkSize : grid points per block
+            
+            *Return
+            *    Generator of DataFrame blocks indexed by 'Time', with an 'Elapsed (sec)' column
+    **********************************************************************************************************************
+    """
+    
+    #every source as its files (data, start of an HBM file in ns or None, first and last scan in ns)
+    merged = []
+    for source in sources:
+        files = [source['files']] if isinstance(source['files'], str) else source['files']
+        starts = source.get('start')
+        parts = []
+        following = None
+        for i, rawFile in enumerate(files):
+            data = loadPart(rawFile, source.get('daq'), source.get('names'))
+            if isinstance(data.index, pd.DatetimeIndex):
+                start = None
+                times = data.index.asi8
+            else:
+                start = starts[i] if isinstance(starts, (list, tuple)) else (starts if i == 0 else None)
+                if start is not None:
+                    start = pd.Timestamp(start).as_unit('ns').value
+                elif following is not None:
+                    #a single start, this capture follows the previous one
+                    start = following
+                else:
+                    raise ValueError('The HBM source of ' + rawFile + ' needs the time stamp of its first sample, '
+                                     '"start"')
+                seconds = np.asarray(data.index[:100000], 'float64')
+                interval = np.median(np.diff(seconds)) if len(seconds) > 1 else 0
+                following = start + int((float(data.index[-1]) + interval) * 1e9)
+                times = start + np.round(np.asarray(data.index[[0, -1]], 'float64') * 1e9).astype('int64')
+            parts.append((data, start, int(times[0]), int(times[-1])))
+            
+        data, start = parts[0][:2]
+        tolerance = source.get('tolerance')
+        if tolerance is None and len(data) > 1:
+            head = data.index[:100000]
+            head = head.asi8 / 1e9 if start is None else np.asarray(head, 'float64')
+            tolerance = scanGap * np.median(np.diff(head))
+        merged.append({'parts': parts, 'columns': source.get('columns') or sensorCols(data),
+                       'prefix': source.get('prefix', ''), 'tolerance': None if tolerance is None else tolerance * 1e9})
+        
+    first = min(part[2] for source in merged for part in source['parts'])
+    last = max(part[3] for source in merged for part in source['parts'])
+    step = int((step or sessionStep) * 1e9)
+    names = list(dict.fromkeys(source['prefix'] + c for source in merged for c in source['columns']))
+    
+    for g0 in range(first, last + 1, step * chunkSize):
+        grid = np.arange(g0, min(g0 + step * chunkSize, last + 1), step, dtype = 'int64')
+        block = pd.DataFrame(index = pd.DatetimeIndex(grid.view('datetime64[ns]'), name = 'Time'))
+        for source in merged:
+            pad = int(source['tolerance'] or step)
+            times, values = [], []
+            #only the rows of the files in the window of this block are read
+            for data, start, lo, hi in source['parts']:
+                if hi < grid[0] - pad or lo > grid[-1] + pad:
+                    continue
+                if start is None:
+                    window = timeWindow(data, pd.Timestamp(grid[0] - pad), pd.Timestamp(grid[-1] + pad),
+                                        source['columns'])
+                    times.append(window.index.asi8)
+                else:
+                    window = timeWindow(data, (grid[0] - pad - start) / 1e9, (grid[-1] + pad - start) / 1e9,
+                                        source['columns'])
+                    times.append(start + np.round(np.asarray(window.index, 'float64') * 1e9).astype('int64'))
+                values.append(window.to_numpy('float64'))
+            if times:
+                #consecutive files are resampled together, across the change of file
+                values = resampleTimes(np.concatenate(times), np.concatenate(values), grid, method,
+                                       source['tolerance'])
+            else:
+                values = np.full((len(grid), len(source['columns'])), np.nan)
+            for j, col in enumerate(source['columns']):
+                block[source['prefix'] + col] = values[:, j]
+        block = block[names]
+        block['Elapsed (sec)'] = (grid - first) / 1e9
+        
+        yield block
+        
+def mergeSession(session):
+    """    
+    **********************************************************************************************************************
+    *Function: mergeSession()
+    *Decription: 
+        *    This function merges a session described by a dictionary (or a JSON/YAML session file, see readJob())
+             and saves it block by block to a .csv file, or returns it when no file is named.
+                -'sources' : list of sources, see mergeChunks()
+                -'step'    : seconds between grid points ("sessionStep" if missing)
+                -'method'  : 'linear', 'nearest' or 'previous' (default 'linear')
+                -'output'  : file of the merged session (.csv, .parquet, ... see exportType()), in the "outDir"
+                             folder if not a full path (optional)
+             
+        *Parameters:
+            *    session : session dictionary
+            
+            *Return
+            *    Number of rows saved, or the merged DataFrame when there is no 'output'
+    **********************************************************************************************************************
+    """
+    
+    chunks = mergeChunks(session['sources'], session.get('step'), session.get('method', 'linear'))
+    if session.get('output'):
+        #each block is written while the next one is merged
+        return(sum(len(block) for block in exportChunks(chunks, exportPath(session['output']))))
+    
+    return(pd.concat(chunks))
+
+def openCatalog(fileName = None):
+    """    
+    **********************************************************************************************************************
+    *Function: openCatalog()
+    *Decription: 
+        *    This function opens the run catalog, an SQLite database of every data set loaded, and creates its 
+             tables the first time:
+                -runs     : one row per raw file: 'source', 'key' (see fileKey()), 'daq', 'instrument', 'name',
+                            'owner', 'acquired', 'first' and 'last' scan, 'seconds', 'rows', 'cache' (cache entry of
+                            the columns, see openEntry()), 'header', 'calibration' and 'multipliers' (JSON)
+                -channels : one row per sensor column of a run: 'channel' (the name given in nameCols()), 'label'
+                            (the column of the file), 'function', 'unit' and the statistics of channelStats()
+        *    The channels are indexed by name and minimum or maximum so "every run where a channel went over 80" is
+             answered from the index (see findRuns()).
+             
+        *Parameters:
+            *    fileName : location of the database, "catalogFile" if None
+            
+            *Return
+            *    sqlite3 connection, close it after use
+    **********************************************************************************************************************
+    """
+    
+    import sqlite3                                  # only needed for the run catalog
+    fileName = fileName or catalogFile
+    os.makedirs(os.path.dirname(os.path.abspath(fileName)), exist_ok = True)
+    db = sqlite3.connect(fileName, timeout = 60)
+    #batch workers add their runs at the same time
+    db.execute('PRAGMA journal_mode = WAL')
+    db.execute('PRAGMA foreign_keys = ON')
+    db.executescript('''
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY, source TEXT UNIQUE, key TEXT, daq INTEGER, instrument TEXT, name TEXT,
+            owner TEXT, acquired TEXT, first TEXT, last TEXT, seconds REAL, rows INTEGER, cache TEXT, header TEXT,
+            calibration TEXT, multipliers TEXT, added REAL);
+        CREATE TABLE IF NOT EXISTS channels (
+            run INTEGER REFERENCES runs (id) ON DELETE CASCADE, position INTEGER, channel TEXT, label TEXT,
+            function TEXT, unit TEXT, count INTEGER, nan INTEGER, overrange INTEGER, min REAL, minTime TEXT,
+            max REAL, maxTime TEXT, mean REAL, std REAL, rms REAL, threshold REAL, crossTime TEXT,
+            PRIMARY KEY (run, channel));
+        CREATE INDEX IF NOT EXISTS channelMax ON channels (channel, max);
+        CREATE INDEX IF NOT EXISTS channelMin ON channels (channel, min);
+        CREATE INDEX IF NOT EXISTS runTime ON runs (instrument, acquired);
+        ''')
+    
+    return(db)
+
+@timed('catalog')
+def catalogRun(data, rawFile, daq = None, fileName = None):
+    """    
+    **********************************************************************************************************************
+    *Function: catalogRun()
+    *Decription: 
+        *    This function adds a named (and calibrated) data set to the run catalog (see openCatalog()), or 
+             replaces it when the file is already there: the file header, the channel table, the user channel
+             names, the statistics of every channel (see channelStats(), reused by showInfo()) and the cache
+             entry holding its columns.
+             
+        *Parameters:
+            *    data     : the processed data frame
+            *    rawFile  : location of the raw data it was read from
+            *    daq      : DAQ number in "readers", found from the file if None (see detectDAQ())
+            *    fileName : location of the database, "catalogFile" if None
+            
+            *Return
+            *    Run number in the catalog
+    **********************************************************************************************************************
+    """
+    
+    header = data.attrs.get('header') or {}
+    daq = daq or detectDAQ(rawFile)
+    stats = channelStats(data)
+    key = fileKey(rawFile)
+    entry = os.path.join(cacheDir, key)
+    times = [str(data.index[0]), str(data.index[-1])] if len(data) else [None, None]
+    seconds = timeSeconds(data.index[[0, -1]])[-1] if len(data) else 0
+    cal = data.attrs.get('calibration', {})
+    
+    #the channel table and the file columns, in sensor order
+    sensors = [c for c in data.columns if c not in ('Elapsed (sec)', 'Alarms')]
+    channels = header.get('channels', [])
+    labels = header.get('values', [])
+    
+    def value(x):
+        #SQLite only takes numbers and text
+        if x is None or pd.isna(x):
+            return(None)
+        if isinstance(x, np.generic):
+            return(x.item())
+        return(x if isinstance(x, (int, float)) else str(x))
+    
+    source = os.path.abspath(rawFile)
+    db = openCatalog(fileName)
+    try:
+        with db:
+            db.execute('DELETE FROM runs WHERE source = ?', (source,))
+            run = db.execute('INSERT INTO runs (source, key, daq, instrument, name, owner, acquired, first, last, '
+                             'seconds, rows, cache, header, calibration, multipliers, added) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                             (source, key, daq, header.get('instrument') or readers.get(daq, {}).get('name'),
+                              header.get('name'), header.get('owner'), header.get('acquisitionDate'),
+                              times[0], times[1], float(seconds), len(data),
+                              entry if os.path.isdir(entry) else None, json.dumps(header, default = str),
+                              json.dumps(cal), json.dumps(data.attrs.get('multipliers', {})),
+                              time.time())).lastrowid
+            rows = []
+            for i, col in enumerate(sensors):
+                channel = channels[i] if i < len(channels) else {}
+                row = stats.loc[col] if col in stats.index else {}
+                rows.append((run, i, str(col), labels[i] if i < len(labels) else None, channel.get('Function'),
+                             cal.get(col, {}).get('unit'))
+                            + tuple(value(row.get(name)) for name in ('count', 'nan', 'overrange', 'min', 'minTime', 
+                                                                      'max', 'maxTime', 'mean', 'std', 'rms',
+                                                                      'threshold', 'crossTime')))
+            db.executemany('INSERT INTO channels VALUES (' + ', '.join(['?'] * 18) + ')', rows)
+    finally:
+        db.close()
+        
+    return(run)
+
+def catalogFiles(paths, pattern = '*.csv', daq = None, fileName = None):
+    """    
+    **********************************************************************************************************************
+    *Function: catalogFiles()
+    *Decription: 
+        *    This function adds runs saved before the catalog existed: every file given, and the files matching
+             "pattern" in the folders given and their sub-folders. Files already in the catalog and unchanged since
+             (see fileKey()) are left as they are. Each other file is parsed once into the cache (see
+             loadPart(), the channels keep the names of the file or of the cache), calibrated from its channel
+             table (see readCalibration()) and added with catalogRun(). Files that can not be read are reported
+             and skipped.
+             
+        *Parameters:
+            *    paths    : list of files and folders
+            *    pattern  : file pattern searched in the folders
+            *    daq      : DAQ number in "readers", found from every file if None
+            *    fileName : location of the database, "catalogFile" if None
+            
+            *Return
+            *    Number of runs added
+    **********************************************************************************************************************
+    """
+    
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(f for f in glob.glob(os.path.join(path, '**', pattern), recursive = True)
+                            if os.path.isfile(f))
+        else:
+            files.append(path)
+            
+    db = openCatalog(fileName)
+    try:
+        known = dict(db.execute('SELECT source, key FROM runs').fetchall())
+    finally:
+        db.close()
+        
+    added = 0
+    for rawFile in files:
+        try:
+            #runs already in the catalog keep their names, calibration and multipliers
+            if known.get(os.path.abspath(rawFile)) == fileKey(rawFile):
+                continue
+            data = loadPart(rawFile, daq)
+            data = calibrate(data, readCalibration(data))
+            catalogRun(data, rawFile, daq, fileName)
+            added += 1
+        except Exception as e:
+            print('skipped', rawFile, type(e).__name__ + ': ' + str(e))
+            
+    return(added)
+
+def findRuns(channel = None, above = None, below = None, instrument = None, after = None, before = None,
+             fileName = None):
+    """    
+    **********************************************************************************************************************
+    *Function: findRuns()
+    *Decription: 
+        *    This function queries the run catalog (see openCatalog()) without opening any data file, for example
+             every run where 'Cell 3 TC' went over 80:
+                    findRuns('Cell 3 TC', above = 80)
+        *    "channel" may hold the wildcards * and ? ('Cell * TC'), the name is matched with the case.
+             
+        *Parameters:
+            *    channel    : channel name, every channel if None
+            *    above      : only the channels whose maximum is higher
+            *    below      : only the channels whose minimum is lower
+            *    instrument : instrument or DAQ name, with wildcards
+            *    after, before : first scan of the run, time stamps as text ('2020-04-01')
+            *    fileName   : location of the database, "catalogFile" if None
+            
+            *Return
+            *    DataFrame of the matching channels of the runs, one row per run and channel
+    **********************************************************************************************************************
+    """
+    
+    where, values = [], []
+    for test, value in (('channels.channel GLOB ?', channel), ('channels.max > ?', above), ('channels.min < ?', below),
+                        ('runs.instrument GLOB ?', instrument), ('runs.first >= ?', after),
+                        ('runs.first < ?', before)):
+        if value is not None:
+            where.append(test)
+            values.append(value)
+            
+    db = openCatalog(fileName)
+    try:
+        runs = pd.read_sql_query('SELECT runs.id AS run, runs.source, runs.instrument, runs.first, runs.seconds, '
+                                 'runs.rows, channels.channel, channels.unit, channels.min, channels.minTime, '
+                                 'channels.max, channels.maxTime, channels.mean, channels.std, channels.crossTime '
+                                 'FROM channels JOIN runs ON runs.id = channels.run' +
+                                 (' WHERE ' + ' AND '.join(where) if where else '') +
+                                 ' ORDER BY runs.first, runs.id, channels.position', db, params = values)
+    finally:
+        db.close()
+        
+    return(runs)
+
+def runData(run, fileName = None):
+    """    
+    **********************************************************************************************************************
+    *Function: runData()
+    *Decription: 
+        *    This function opens the data set of a catalog run from its cache entry (see openEntry()), with the 
+             calibration and multipliers it had when it was added. The raw file is only parsed again when the
+             entry was removed from the cache (see trimCache()), its columns are then given the channel names of
+             the catalog by their file label.
+             
+        *Parameters:
+            *    run      : run number in the catalog (see findRuns())
+            *    fileName : location of the database, "catalogFile" if None
+            
+            *Return
+            *    The processed data frame
+    **********************************************************************************************************************
+    """
+    
+    db = openCatalog(fileName)
+    try:
+        found = db.execute('SELECT source, daq, cache, calibration, multipliers FROM runs WHERE id = ?',
+                           (int(run),)).fetchone()
+        names = db.execute('SELECT channel, label FROM channels WHERE run = ? ORDER BY position',
+                           (int(run),)).fetchall()
+    finally:
+        db.close()
+    if found is None:
+        raise KeyError('No run ' + str(run) + ' in the catalog')
+    source, daq, entry, cal, multipliers = found
+    
+    data = openEntry(entry) if entry else None
+    if data is None:
+        if not os.path.exists(source):
+            raise FileNotFoundError('The cache of run ' + str(run) + ' was removed and ' + source + ' is gone')
+        labels = dict((label, name) for name, label in names)
+        if None in labels:
+            #no column labels kept, the names go to the channels in order
+            data = loadPart(source, daq, [name for name, label in names])
+        else:
+            #the file keeps its own column names, each one is matched to its catalog name by label
+            data = loadPart(source, daq)
+            sensors = [c for c in data.columns if c not in ('Elapsed (sec)', 'Alarms')]
+            data = nameCols(data, [labels.get(c, c) for c in sensors], daq)
+    data = calibrate(data, json.loads(cal))
+    multipliers = json.loads(multipliers)
+    if multipliers:
+        data = scaleColumns(data, list(multipliers), lambda values: values * list(multipliers.values()))
+        #the pyramid of the cache entry was taken before the multipliers
+        for key in ('stats', 'events', 'pyramid'):
+            data.attrs.pop(key, None)
+    data.attrs['source'] = source
+    
+    return(data)
+
+def compareRuns(runs, channel = None, fileName = None, title = None, catalog = None, show = False):
+    """    
+    **********************************************************************************************************************
+    *Function: compareRuns()
+    *Decription: 
+        *    This function draws one channel of several catalog runs in one graph, against the seconds from the 
+             first scan of each run so tests of different days line up. Given the rows of findRuns(), each run is
+             drawn with the channel it was found with (a wildcard search can find 'Cell 1 TC' and 'Cell 3 TC').
+             Every run is opened from the cache (see runData()) and only its decimated series is read (see
+             graphSeries()), so a comparison of many long runs stays fast and no raw file is parsed.
+             
+        *Parameters:
+            *    runs     : run numbers, or the DataFrame of findRuns()
+            *    channel  : channel name, the 'channel' of the findRuns() rows if None
+            *    fileName : location of the saved .pdf, "title".pdf in "outDir" if None
+            *    title    : graph title, the channel name if None
+            *    catalog  : location of the database, "catalogFile" if None
+            *    show     : show the graph on screen once saved (see drawGraph())
+            
+            *Return
+            *    Location of the saved .pdf file
+    **********************************************************************************************************************
+    """
+    
+    if isinstance(runs, pd.DataFrame) and channel is None:
+        pairs = list(dict.fromkeys(zip(runs['run'], runs['channel'])))
+    else:
+        runs = runs['run'] if isinstance(runs, pd.DataFrame) else runs
+        pairs = [(run, channel) for run in dict.fromkeys(runs)]
+    names = list(dict.fromkeys(col for run, col in pairs))
+    title = title or ', '.join(str(col) for col in names)
+    fileName = fileName or os.path.join(outDir, title + '.pdf')
+    
+    series = []
+    with span('render', title) as stage:
+        for run, col in pairs:
+            data = runData(run, catalog)
+            if col not in data.columns:
+                continue
+            df = graphSeries(data, {'series': [col]})
+            if isinstance(data.index, pd.DatetimeIndex):
+                x = (df.index - data.index[0]).total_seconds()
+            else:
+                x = np.asarray(df.index, dtype = np.float64) - float(data.index[0])
+            label = str(run) + ' ' + os.path.basename(data.attrs['source'])
+            series.append((label + (' ' + str(col) if len(names) > 1 else ''), np.asarray(x), df[col]))
+            
+        fig = takeFigure('custom', show = show)
+        try:
+            ax = fig.axes[0]
+            setLines(ax, series)
+            ax.set_yscale('linear')
+            ax.relim()
+            ax.set_autoscale_on(True)
+            ax.autoscale_view()
+            ax.legend(loc='best')
+            ax.set_title(title)
+            ax.set_xlabel('Time from the first scan (sec)')
+            ax.set_ylabel(str(names[0]) if len(names) == 1 else '')
+            fig.savefig(fileName)
+            stage['rows'] = len(series)
+        except Exception:
+            releaseFigure(fig)
+            raise
+    try:
+        if show:
+            import matplotlib.pyplot as plt
+            plt.show()
+    finally:
+        releaseFigure(fig)
+        
+    return(fileName)
+
+def showInfo(data):
+    """
+     *********************************************************************************************************************
+    *Function: showInfo()
+    *Decription: 
+        *    This function shows data attributes for the user to confirm that the data
+             is the correct data set. It also allows the user to remove any bad
+             data
+        *    The function prints the run summary (number of scans, first and last scan) and the statistics of
+             every channel (see channelStats()): min/max and when they happened, mean, std, rms, NaN and
+             overrange readings (open inputs) and when an alarm limit was first reached
+             
+        *Parameters:
+            *    The data frame created in the getXXXData() function
+            
+            *Return
+            *    Variable in which data is stored and passed for global usage
+    **********************************************************************************************************************
+    """
+    
+    print(len(data), 'scans from', data.index[0], 'to', data.index[-1])
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(channelStats(data))
+    #print(data.head())                          # Inspect first 5 lines of data
+    #print(data.tail())                          # Inspect last 5 lines of data
+    #print(data.info())                          # get information regarding data types
+    #print(len(data))                            # provide to number of rows
+    #print(data.size)                            # provide total number of entries in data
+    
+def makeGraph(data):
+    """
+     *********************************************************************************************************************
+    *Function: makeGraph()
+    *Decription: 
+        *    This function allows the user to select from a list of predesigned graphs
+        *    The function calls graphing functions and prompts the user to provide required information to the graph's
+             design.
+             
+        *Parameters:
+            *    The processed data frame (cleaned and named columns)
+            
+            *Return
+            *    figures of selected series' graphs
+    **********************************************************************************************************************
+    """
+    
+    graph_list = {
+    0: {'name': "TO QUIT"},
+    1: {'name': 'Temperature Graph'},
+    2: {'name': 'Pressure Graph'},
+    3: {'name': 'Current'},
+    4: {'name': 'Custom Graph'},
+    5: {'name': 'Report (several graphs in one .pdf)'},
+    6: {'name': 'Live Graph (Agilent file still being written)'},
+    7: {'name': 'Event Graph (zoom on a threshold crossing, alarm or scan gap)'},
+    8: {'name': 'Zoom Graph (pan and zoom through a long run)'},
+    9: {'name': 'Compare Graph (one channel of the catalog runs)'}
+    }
+    print("Graph List:")
+    
+    for x, y in graph_list.items():
+        print(x, ':', graph_list[x]['name'])
+ 
+    while x != 0:
+        print("\nSelect a graph type: ")
+        x = int(input())
+ 
+        if x in graph_list.keys():
+            x = int(x)
+            print("\nYou have chosen {0}".format(graph_list[x]['name']))
+            
+            return x
+        
+        elif x == 0:
+            quit()
+            
+        else:
+            print("Your choice is not available.")
+                
+def lttb(x, y, points):
+    """
+     *********************************************************************************************************************
+    *Function: lttb()
+    *Decription: 
+        *    This function picks "points" samples of a series with the Largest-Triangle-Three-Buckets method: the
+             first and last samples are kept, and in each bucket in between the sample making the largest triangle
+             with the previously kept sample and the average of the next bucket is kept. Spikes make large 
+             triangles, so they survive the decimation.
+             
+        *Parameters:
+            *    x      : sample positions (float array)
+            *    y      : sample values (float array)
+            *    points : number of samples to keep (at least 3)
+            
+            *Return
+            *    Array of the row positions kept, in order
+    **********************************************************************************************************************
+    """
+    
+    n = len(y)
+    edges = np.linspace(1, n - 1, points - 1).astype('intp')
+    keep = np.empty(points, 'intp')
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nextHi = edges[i + 2] if i + 2 < len(edges) else n
+        avgX = x[hi:nextHi].mean()
+        avgY = y[hi:nextHi].mean()
+        area = np.abs((x[a] - avgX) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avgY - y[a]))
+        a = lo + np.nanargmax(area) if np.isfinite(area).any() else lo
+        keep[i + 1] = a
+        
+    return(keep)
+
+@timed('decimation')
+def decimate(data, points = None, method = None):
+    """
+     *********************************************************************************************************************
+    *Function: decimate()
+    *Decription: 
+        *    This function thins out the rows of a data set before it is plotted, keeping its peaks and transients. 
+             A figure 8 inches wide can only show a couple of thousand x-positions, so plotting every sample of a 
+             long run only costs time and file size.
+                -'minmax' : the rows are split in points/2 buckets and the rows holding the minimum and maximum of 
+                            every column in each bucket are kept (per-pixel envelope, the exact extremes are kept)
+                -'lttb'   : Largest-Triangle-Three-Buckets on every column, see lttb()
+        *    The rows kept for each column are merged, so all the columns still share the same x-positions.
+             
+        *Parameters:
+            *    data   : DataFrame of the series to plot, rows in time order
+            *    points : x-positions to keep per column, "plotPoints" if None, 0 to keep every row
+            *    method : 'minmax' or 'lttb', "plotMethod" if None
+            
+            *Return
+            *    DataFrame with the rows kept
+    **********************************************************************************************************************
+    """
+    
+    if points is None:
+        points = plotPoints
+    if method is None:
+        method = plotMethod
+    n = len(data)
+    if not points or n <= max(points, 3):
+        return(data)
+    
+    keep = [np.array([0, n - 1])]
+    if method == 'lttb':
+        #x-positions from the time index, or the row numbers
+        index = data.index
+        if index.dtype.kind == 'M':
+            x = index.asi8.astype('float64')
+        elif index.dtype.kind in 'iuf':
+            x = index.to_numpy('float64')
+        else:
+            x = np.arange(n, dtype = 'float64')
+        for col in data.columns:
+            keep.append(lttb(x, data[col].to_numpy('float64'), points))
+    else:
+        size = -(-n // max(points // 2, 1))         # rows per bucket
+        full = n // size * size
+        for col in data.columns:
+            y = data[col].to_numpy()
+            buckets = y[:full].reshape(-1, size)
+            base = np.arange(0, full, size)
+            keep.append(base + buckets.argmin(axis = 1))
+            keep.append(base + buckets.argmax(axis = 1))
+            if full < n:
+                keep.append(full + np.array([y[full:].argmin(), y[full:].argmax()]))
+                
+    return(data.iloc[np.unique(np.concatenate(keep))])
+
+def graphWindow(data, graph):
+    """
+     *********************************************************************************************************************
+    *Function: graphWindow()
+    *Decription: 
+        *    This function gives the time window of a graph: its 'window', or the 'pad' seconds around its 'event'
+             (see eventWindow()).
+             
+        *Parameters:
+            *    data   : the processed data frame
+            *    graph  : graph definition
+            
+            *Return
+            *    [t0, t1] window, None for the whole run
+    **********************************************************************************************************************
+    """
+    
+    if graph.get('event') is not None:
+        return(eventWindow(data, graph['event'], graph.get('pad', 15)))
+    
+    return(graph.get('window') or None)
+
+def graphSeries(data, graph):
+    """
+     *********************************************************************************************************************
+    *Function: graphSeries()
+    *Decription: 
+        *    This function gives the series of a graph ready to plot: the rows of the graph window (see
+             timeWindow()) decimated to "plotPoints" (see decimate()), or read from the pyramid of the data set when
+             it has one (see pyramidView()), so the raw rows are not scanned again.
+        *    A graph 'filter' is applied to the full rows of the window first (see filterData()), 'spectrum'
+             gives their power spectral density instead (see spectrum()).
+             
+        *Parameters:
+            *    data   : the processed data frame
+            *    graph  : graph definition
+            
+            *Return
+            *    DataFrame of the series
+    **********************************************************************************************************************
+    """
+    
+    #report pages get their series ready made, see buildReport()
+    if graph.get('ready'):
+        return(data[graph['series']])
+    
+    window = graphWindow(data, graph) or [None, None]
+    method = graph.get('filter')
+    if graph.get('decimate', True) and 'pyramid' in data.attrs and not method:
+        return(pyramidView(data, graph['series'], *window))
+    
+    df = pd.DataFrame(timeWindow(data, *window, graph['series']) if any(t is not None for t in window)
+                      else data[graph['series']])
+    #filters need every reading, they run before the decimation
+    if method == 'spectrum':
+        return(spectrum(df, graph['series'], graph.get('segment')))
+    if method:
+        df = filterData(df, method, graph.get('filterWindow'), graph['series'])
+    if graph.get('decimate', True):
+        df = decimate(df)
+        
+    return(df)
+
+def seriesMult(data, graph):
+    """
+     *********************************************************************************************************************
+    *Function: seriesMult()
+    *Decription: 
+        *    This function gives the multiplier applied to the series of a graph: the graph 'mult', else the
+             multiplier of the graph type (see graphTypes) unless all the series are calibrated, divided by the
+             known shunt 'resistance' if there is one.
+             
+        *Parameters:
+            *    data   : the processed data frame
+            *    graph  : graph definition
+            
+            *Return
+            *    Multiplier
+    **********************************************************************************************************************
+    """
+    
+    kind = graphTypes[graph.get('type', 'custom')]
+    #calibrated series are already in engineering units
+    calibrated = set(data.attrs.get('calibration', {}))
+    mult = graph.get('mult', 1 if calibrated.issuperset(graph['series']) else kind['mult'])
+    if graph.get('resistance'):
+        mult = mult / graph['resistance']
+        
+    return(mult)
+
+figurePool = {}                                                 # idle figures of each graph type, see takeFigure()
+
+def takeFigure(kind, dates = False, show = False):
+    """
+     *********************************************************************************************************************
+    *Function: takeFigure()
+    *Decription: 
+        *    This function hands out a figure for a graph type (see graphTypes): an idle one of "figurePool" when
+             there is one, else a new 8 x 4.5 in figure with its axes, grid and tick labels set up once. 
+        *    The figures are drawn by the Agg canvas without pyplot, so none is kept open by the pyplot figure
+             list and the batch mode and the reports never need a display. Give every figure back with
+             releaseFigure().
+        *    A figure to "show" on screen (the graphs of the menus) is a new pyplot figure instead, it is not
+             pooled and releaseFigure() closes it.
+             
+        *Parameters:
+            *    kind  : graph type, a key of graphTypes
+            *    dates : x-axis of time stamps (Agilent) rather than numbers (HBM seconds, frequencies)
+            *    show  : figure shown on screen with plt.show()
+            
+            *Return
+            *    The figure, its axes is fig.axes[0]
+    **********************************************************************************************************************
+    """
+    
+    idle = figurePool.setdefault((kind, dates), [])
+    if idle and not show:
+        return(idle.pop())
+    
+    import matplotlib.dates as mdates                           # loaded on the first graph
+    if show:
+        import matplotlib.pyplot as plt
+        fig = plt.figure(figsize = (8, 4.5))
+    else:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        fig = Figure(figsize = (8, 4.5))
+        FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.grid(True)
+    if dates:
+        locator = mdates.AutoDateLocator()
+        ax.xaxis.set_major_locator(locator)
+        ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+    if 'rotation' in graphTypes[kind]:
+        ax.tick_params(axis = 'x', labelrotation = graphTypes[kind]['rotation'])
+    fig.poolKey = None if show else (kind, dates)
+    
+    return(fig)
+
+def releaseFigure(fig):
+    """
+     *********************************************************************************************************************
+    *Function: releaseFigure()
+    *Decription: 
+        *    This function gives a figure of takeFigure() back once it is saved. Up to "poolFigures" figures of each 
+             graph type are kept for the next graphs, the others are dropped and freed with their data. A figure
+             that was shown on screen is closed.
+             
+        *Parameters:
+            *    fig : figure from takeFigure()
+            
+            *Return
+            *    None
+    **********************************************************************************************************************
+    """
+    
+    if fig.poolKey is None:
+        import matplotlib.pyplot as plt
+        plt.close(fig)
+        return
+    idle = figurePool.setdefault(fig.poolKey, [])
+    if len(idle) < poolFigures and fig not in idle:
+        idle.append(fig)
+
+def setLines(ax, series):
+    """
+     *********************************************************************************************************************
+    *Function: setLines()
+    *Decription: 
+        *    This function puts new series in the axes of a pooled figure (see takeFigure()): the lines of the last
+             graph are given the new data and labels, lines are added or removed so there is one per series.
+             
+        *Parameters:
+            *    ax     : axes of the figure
+            *    series : list of (label, x values, y values)
+            
+            *Return
+            *    None
+    **********************************************************************************************************************
+    """
+    
+    lines = ax.get_lines()
+    for i, (label, x, y) in enumerate(series):
+        if i < len(lines):
+            lines[i].set_data(x, y)
+            lines[i].set_label(label)
+        else:
+            ax.plot(x, y, label = label, color = 'C' + str(i % 10))
+    for line in lines[len(series):]:
+        line.remove()
+
+def plotGraph(data, graph, show = False):
+    """
+     *********************************************************************************************************************
+    *Function: plotGraph()
+    *Decription: 
+        *    This function draws one graph from a graph definition, without asking anything or saving it.
+        *    The graph is drawn in a figure of takeFigure(): only the lines, limits, scale, legend and titles are
+             set, the lines of the previous graph are reused. Give the figure back with releaseFigure().
+             A graph to "show" is drawn in a new pyplot figure.
+        *    The graph definition is a dictionary:
+                -'type'       : 'temp', 'pressure', 'current' or 'custom' (see graphTypes), 'custom' if missing
+                -'series'     : list of column names plotted together
+                -'title'      : graph title, also the .pdf file name
+                -'ylim'       : [lower, upper] y-axis limits (optional)
+                -'mult'       : multiplier applied to the series (optional, 50 for uncalibrated pressure)
+                -'resistance' : known shunt resistance, the series are divided by it (optional)
+                -'xlabel', 'ylabel' : axis titles (optional, from the graph type)
+                -'decimate'   : false to plot every sample, see decimate() (optional)
+                -'window'     : [t0, t1] zoom on a time window, see timeWindow() (optional)
+                -'event', 'pad' : zoom on an event of eventIndex(), 'pad' seconds each side (optional, 15 s)
+                -'filter'     : 'mean', 'median', 'savgol' or 'derivative' (see filterData()), or 'spectrum' to
+                                plot the power spectral density against frequency (see spectrum()) (optional)
+                -'filterWindow' : samples per filter window (optional, "filterWindow")
+                -'segment'    : samples per FFT segment of a spectrum (optional, "psdSegment")
+             
+        *Parameters:
+            *    data   : the processed data frame
+            *    graph  : graph definition
+            *    show   : draw in a pyplot figure to show on screen (see takeFigure())
+            
+            *Return
+            *    The figure, from takeFigure()
+    **********************************************************************************************************************
+    """
+    
+    kind = graphTypes[graph.get('type', 'custom')]
+    df = graphSeries(data, graph)
+    mult = seriesMult(data, graph)
+    spectral = graph.get('filter') == 'spectrum'
+    if spectral:
+        #the power goes with the square of the signal
+        mult = mult ** 2
+    if mult != 1:
+        df = df * mult
+        
+    dates = isinstance(df.index, pd.DatetimeIndex)
+    x = df.index.to_numpy()
+    fig = takeFigure(graph.get('type', 'custom'), dates, show)
+    ax = fig.axes[0]
+    setLines(ax, [(col, x, df[col]) for col in df.columns])
+    ax.set_yscale('log' if spectral else 'linear')
+    ax.relim()
+    ax.set_autoscale_on(True)
+    ax.autoscale_view()
+    if graph.get('ylim'):
+        ax.set_ylim(*graph['ylim'])
+    elif graph.get('type', 'custom') == 'custom' and not spectral:
+        ax.set_ylim(df.min().min(), df.max().max())
+    ylabel = graph.get('ylabel', kind['ylabel'])
+    if 'ylabel' not in graph and graph.get('filter') == 'derivative':
+        ylabel = ylabel + ' per sec'
+    if 'ylabel' not in graph and spectral:
+        ylabel = 'PSD, ' + ylabel + ' squared per Hz'
+    ax.legend(loc='best')
+    ax.set_title(graph.get('title', ''))
+    ax.set_xlabel('Frequency (Hz)' if spectral and 'xlabel' not in graph else graph.get('xlabel', kind['xlabel']))
+    ax.set_ylabel(ylabel)
+    
+    return(fig)
+
+def drawGraph(data, graph, folder = None, show = False):
+    """
+     *********************************************************************************************************************
+    *Function: drawGraph()
+    *Decription: 
+        *    This function draws (see plotGraph()) and saves one graph from a graph definition, without asking 
+             anything. It is the engine behind TempGraph(), PressureGraph(), CurrentGraph(), CustomGraph() and the
+             batch mode. The figure is given back to the pool once saved (see releaseFigure()).
+        *    The graphs of the menus are also shown on screen ("show"), until the graph window is closed. The batch
+             mode and the reports only use the Agg canvas.
+             
+        *Parameters:
+            *    data   : the processed data frame
+            *    graph  : graph definition
+            *    folder : folder of the saved graph, "outDir" if None
+            *    show   : show the graph on screen once saved
+            
+            *Return
+            *    Location of the saved .pdf file
+    **********************************************************************************************************************
+    """
+    
+    with span('render', graph.get('title')) as stage:
+        fig = plotGraph(data, graph, show)
+        fileName = os.path.join(folder or outDir, graph.get('title', 'graph') + '.pdf')
+        try:
+            fig.savefig(fileName)
+            stage['rows'] = len(data)
+        except Exception:
+            releaseFigure(fig)
+            raise
+    try:
+        if show:
+            import matplotlib.pyplot as plt
+            plt.show()
+    finally:
+        releaseFigure(fig)
+        
+    return(fileName)
+
+def renderPage(data, graph):
+    """
+     *********************************************************************************************************************
+    *Function: renderPage()
+    *Decription: 
+        *    This function renders one report page on the Agg canvas and gives the figure back to the pool (see
+             takeFigure()), it runs in the report worker processes (see buildReport()), each one with its own pool.
              
         *Parameters:
-            *    User input for number of sensors
-            *    User input for file name
-            *    User input for multiplier (for data correction and analysis)
+            *    data   : the series of the graph
+            *    graph  : graph definition
             
             *Return
-            *    Variable in which data is stored and passed for global usage
+            *    RGBA image of the page (array of height x width x 4)
     **********************************************************************************************************************
     """
     
-    #numSense = int(input('Please enter number of sensors used: '))
-    
-    data = input("Please enter the location of the raw data: ")
-    data = pd.read_csv(data, sep = '\s+', skiprows = 38)
-    #data.set_index('Time', inplace = True)
-    data.dropna(axis = 1, inplace = True)
-    data.head()
-        
-    data = nameCols(data)
-    
-    fileName = input('Save file as? ')
-    data.to_csv('C:/Users/mb89539/Desktop/Data_Analysis_workbook/create_csvs/' + fileName + '.csv')
+    with span('render', graph.get('title')) as stage:
+        fig = plotGraph(data, graph)
+        try:
+            fig.set_dpi(reportDpi)
+            fig.canvas.draw()
+            page = np.array(fig.canvas.buffer_rgba())
+        finally:
+            releaseFigure(fig)
+        stage['rows'] = len(data)
     
-    return(data)
+    return(page)
 
-def nameCols(data):
-    """    
-    **********************************************************************************************************************
-    *Function: nameCols()
+@timed('report')
+def buildReport(data, graphs, fileName, workers = None, inFlight = None):
+    """
+     *********************************************************************************************************************
+    *Function: buildReport()
     *Decription: 
-        *    This function lets the user name the colums in order.
-            *    Future revision will replace with text boxes in a GUI dialog box
-            
+        *    This function makes a single multi-page .pdf report, one graph definition (see plotGraph()) per page,
+             in the order of "graphs".
+        *    The pages are rendered at "reportDpi" in parallel worker processes (see renderPage()) and written to
+             one PdfPages document as they come back. Only the series of each graph are sent to the workers, 
+             already decimated, and at most "inFlight" pages are waiting at any time, so memory stays bounded
+             however many graphs the report has. The pages are written through one figure, cleared for each page.
+             
         *Parameters:
-            *    User input for column names
+            *    data     : the processed data frame
+            *    graphs   : list of graph definitions
+            *    fileName : location of the .pdf report
+            *    workers  : number of worker processes (default one per CPU), 0 to render in this process
+            *    inFlight : pages rendered or waiting at once (default twice the number of workers)
             
             *Return
-            *    DataFrame named data with user named columns
+            *    Number of pages written
     **********************************************************************************************************************
     """
     
-    colNames = []
-    if DAQ == 1:
-        for i in range(0, len(data.columns)-1):
-            print("Please enter sensor ", i+1, "name: ")
-            item = input()
-            colNames.append(item)
+    def pages(render):
+        for graph in graphs:
+            #the workers only get the series, the multiplier is worked out here from the calibration of "data"
+            yield render(graphSeries(data, graph), dict(graph, ready = True, mult = seriesMult(data, graph),
+                                                        resistance = None))
             
-        data.columns = colNames
-        
-    if DAQ == 2:
-        defaultColNames = ['Scan']
-        for i in range(1, len(data.columns)):
-            print("Please enter sensor ", i, "name: ")
-            item = input()
-            colNames.append(item)
-            
-        colNames = defaultColNames + colNames
-        data.columns = colNames
-        data.set_index(defaultColNames, inplace = True)
-        
-    if DAQ == 3:
-        defaultColNames = ['Time']
-        for i in range(1, len(data.columns)):
-            print("Please enter sensor ", i, "name: ")
-            item = input()
-            colNames.append(item)
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_pdf import PdfPages
+    sheet = Figure(dpi = reportDpi)
+    with PdfPages(fileName) as pdf:
+        def write(page):
+            h, w = page.shape[:2]
+            sheet.clear()
+            sheet.set_size_inches(w / reportDpi, h / reportDpi)
+            sheet.figimage(page)
+            pdf.savefig(sheet, dpi = reportDpi)
             
-        colNames = defaultColNames + colNames
-        data.columns = colNames
-        data.set_index(defaultColNames, inplace = True)
-    
-    # for i in range(1, len(data.columns)):
-    #     print("Please enter sensor ", i, "name: ")
-    #     item = input()
-    #     colNames.append(item)
+        if workers == 0:
+            for page in pages(renderPage):
+                write(page)
+            return(len(graphs))
         
-    # colNames = defaultColNames + colNames
-    # data.columns = colNames
-    # data.set_index(defaultColNames, inplace = True)
-        
-    return(data)
-    
-def showInfo(data):
+        workers = workers or os.cpu_count()
+        inFlight = inFlight or 2 * workers
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            waiting = []
+            for future in pages(lambda df, graph: pool.submit(renderPage, df, graph)):
+                waiting.append(future)
+                if len(waiting) >= inFlight:
+                    write(waiting.pop(0).result())
+            for future in waiting:
+                write(future.result())
+                
+    return(len(graphs))
+
+def askSeries():
     """
      *********************************************************************************************************************
-    *Function: showInfo()
+    *Function: askSeries()
     *Decription: 
-        *    This function shows data attributes for the user to confirm that the data
-             is the correct data set. It also allows the user to remove any bad
-             data
-        *    The function performs a visual inspection of the data through the head(), tail(), 
-             info(), len(), size functions or attributes to provide verification of correct files
+        *    This function asks the user for the series plotted together in a figure.
              
         *Parameters:
-            *    The data frame created in the getXXXData() function
+            *    User input for number of series and series names
             
             *Return
-            *    Variable in which data is stored and passed for global usage
+            *    List of series names
     **********************************************************************************************************************
     """
     
-    print(data.head())                          # Inspect first 5 lines of data
-    #print(data.tail())                          # Inspect last 5 lines of data
-    #print(data.info())                          # get information regarding data types
-    #print(len(data))                            # provide to number of rows
-    #print(data.size)                            # provide total number of entries in data
+    howMany = []
+    n = int(input("How many series in this figure? "))
     
-def makeGraph(data):
+    for i in range(0, n):
+        print("Please enter series ", i + 1, "name: ")
+        item = input()
+        howMany.append(item)
+        
+    return(howMany)
+    
+def askFilter(graph):
     """
      *********************************************************************************************************************
-    *Function: makeGraph()
+    *Function: askFilter()
     *Decription: 
-        *    This function allows the user to select from a list of predesigned graphs
-        *    The function calls graphing functions and prompts the user to provide required information to the graph's
-             design.
+        *    This function asks for the filter of a graph (see filterData() and spectrum()) and adds it to the graph
+             definition.
              
         *Parameters:
-            *    The processed data frame (cleaned and named columns)
+            *    graph : graph definition
+            *    User input for the filter and its window
             
             *Return
-            *    figures of selected series' graphs
+            *    The graph definition
     **********************************************************************************************************************
     """
     
-    graph_list = {
-    0: {'name': "TO QUIT"},
-    1: {'name': 'Temperature Graph'},
-    2: {'name': 'Pressure Graph'},
-    3: {'name': 'Current'},
-    4: {'name': 'Custom Graph'}
-    }
-    print("Graph List:")
-    
-    for x, y in graph_list.items():
-        print(x, ':', graph_list[x]['name'])
- 
-    while x != 0:
-        print("\nSelect a graph type: ")
-        x = int(input())
- 
-        if x in graph_list.keys():
-            x = int(x)
-            print("\nYou have chosen {0}".format(graph_list[x]['name']))
-            
-            return x
-        
-        elif x == 0:
-            quit()
+    method = input('Filter (blank for none, mean, median, savgol, derivative, spectrum)? ').strip().lower()
+    if method:
+        graph['filter'] = method
+    if method in ('mean', 'median', 'savgol'):
+        window = input('Samples per window (blank for ' + str(filterWindow) + '): ')
+        if window:
+            graph['filterWindow'] = int(window)
             
-        else:
-            print("Your choice is not available.")
-                
+    return(graph)
+    
 def TempGraph(data):
     """
      *********************************************************************************************************************
@@ -331,25 +4181,14 @@ def TempGraph(data):
     **********************************************************************************************************************
     """
     
-    howMany = []
-    n = int(input("How many series in this figure? "))
-    
-    for i in range(0, n):
-        print("Please enter series ", i + 1, "name: ")
-        item = input()
-        howMany.append(item)
-        
-    df = pd.DataFrame(data[howMany])
-    df.plot(figsize = (8, 4.5), grid = True, legend=None)
-    limit = int(input("Please enter the upper limit for the 'Temperature' axis (typically 1200C): "))
-    plt.ylim(0, limit)
-    plt.legend(loc='best')
-    title = input('Enter Graph Title: ')
-    plt.title(title)
-    plt.xlabel("Time (sec)")
-    plt.ylabel("Temp (C)")
+    graph = askFilter({'type': 'temp', 'series': askSeries()})
+    limits = yLimits(data, graph)
+    limit = input("Please enter the upper limit for the 'Temperature' axis (typically 1200C, blank for " +
+                  str(limits or 'auto') + "): ")
+    graph['ylim'] = [0, float(limit)] if limit else limits
+    graph['title'] = input('Enter Graph Title: ')
     
-    plt.savefig('C:/Users/mb89539/Desktop/Data_Analysis_workbook/create_csvs/' + title + '.pdf')
+    drawGraph(data, graph, show = True)
     
 def PressureGraph(data):
     """
@@ -367,26 +4206,14 @@ def PressureGraph(data):
     **********************************************************************************************************************
     """
     
-    howMany = []
-    n = int(input("How many series in this figure? "))
-    
-    for i in range(0, n):
-        print("Please enter series ", i + 1, "name: ")
-        item = input()
-        howMany.append(item)
-        
-    df = pd.DataFrame(data[howMany])
-    df = df *50
-    df.plot(figsize = (8, 4.5), grid = True)
-    limit = int(input("Please enter the upper limit for the 'Temperature' axis (typically 60): "))
-    plt.ylim(0, limit)
-    plt.legend(loc='best')
-    title = input('Enter Graph Title: ')
-    plt.title(title)
-    plt.xlabel("Time (sec)")
-    plt.ylabel("Pressure (psi)")
+    graph = askFilter({'type': 'pressure', 'series': askSeries()})
+    limits = yLimits(data, graph)
+    limit = input("Please enter the upper limit for the 'Pressure' axis (typically 60, blank for " +
+                  str(limits or 'auto') + "): ")
+    graph['ylim'] = [0, float(limit)] if limit else limits
+    graph['title'] = input('Enter Graph Title: ')
     
-    plt.savefig('C:/Users/mb89539/Desktop/Data_Analysis_workbook/create_csvs/' + title + '.pdf')
+    drawGraph(data, graph, show = True)
     
 def CurrentGraph(data):
     """
@@ -403,26 +4230,15 @@ def CurrentGraph(data):
             *    Variable in which data is stored and passed for global usage
     **********************************************************************************************************************
     """
-    howMany = []
-    n = int(input("How many series in this figure? "))
-    for i in range(0, n):
-        print("Please enter series ", i + 1, "name: ")
-        item = input()
-        howMany.append(item)
-        
-    df = pd.DataFrame(data[howMany])
-    mult = float(input('Enter known resistance: '))
-    df = df / mult
-    df.plot(figsize = (8, 4.5), grid = True)
-    limit = int(input("Please enter the upper limit for the 'Temperature' axis (typically 60): "))
-    plt.ylim(0, limit)
-    plt.legend(loc='best')
-    title = input('Enter Graph Title: ')
-    plt.title(title)
-    plt.xlabel("Time (sec)")
-    plt.ylabel("Pressure (psi)")
+    graph = askFilter({'type': 'current', 'series': askSeries()})
+    graph['resistance'] = float(input('Enter known resistance: '))
+    limits = yLimits(data, graph)
+    limit = input("Please enter the upper limit for the 'Current' axis (typically 60, blank for " +
+                  str(limits or 'auto') + "): ")
+    graph['ylim'] = [0, float(limit)] if limit else limits
+    graph['title'] = input('Enter Graph Title: ')
     
-    plt.savefig('C:/Users/mb89539/Desktop/Data_Analysis_workbook/create_csvs/' + title + '.pdf')
+    drawGraph(data, graph, show = True)
         
 def CustomGraph(data):
     """
@@ -439,34 +4255,20 @@ def CustomGraph(data):
             *    Variable in which data is stored and passed for global usage
     **********************************************************************************************************************
     """
-    howMany = []
     #projName = input('Enter the plot file name: ')
-    n = int(input("How many series in this figure? "))
-    for i in range(0, n):
-        print("Please enter series ", i + 1, "name: ")
-        item = input()
-        howMany.append(item)
-        
-    df = pd.DataFrame(data[howMany])
+    howMany = askSeries()
+    mult = 1
     doYa = input('Do you have a multiplier Y/n? ')
     if doYa == 'Y':
         mult = int(input('Enter multiplier value: '))
-        df = df * mult
         
-    with PdfPages('multipage_pdf.pdf') as pdf:
-        plt.figure(figsize=(8, 4.5))
-        df.plot(figsize = (8, 4.5), grid = True)
-        plt.xticks(rotation = 45)
-        plt.ylim(data.min().min(), data.max().max())
-        plt.legend(loc='best')
-        title = input('Enter Graph Title: ')
-        plt.title(title)
-        xLab = input('Enter x-axis title: ')
-        plt.xlabel(xLab)
-        yLab = input('Enter y-axis title: ')
-        plt.ylabel(yLab)
-        pdf.savefig()  # saves the current figure into a pdf page
-        plt.close()
+    title = input('Enter Graph Title: ')
+    xLab = input('Enter x-axis title: ')
+    yLab = input('Enter y-axis title: ')
+    
+    graph = askFilter({'type': 'custom', 'series': howMany, 'mult': mult, 'title': title, 'xlabel': xLab,
+                       'ylabel': yLab})
+    drawGraph(data, graph, show = True)
     
     # fig = plt.figure()
     
@@ -489,6 +4291,208 @@ def CustomGraph(data):
     # pp.savefig(fig)
     # pp.close()
     
+def ReportGraph(data):
+    """
+     *********************************************************************************************************************
+     *Function: ReportGraph()
+    *Decription: 
+        *    This function asks for several graphs and puts them in one multi-page .pdf report (see buildReport()),
+             one graph per page.
+             
+        *Parameters:
+            *    The processed data frame created in the getXXXData() function
+            
+            *Return
+            *    Location of the .pdf report
+    **********************************************************************************************************************
+    """
+    graphs = []
+    kinds = list(graphTypes)
+    n = int(input("How many graphs in this report? "))
+    for i in range(0, n):
+        print("Graph", i + 1, "type:", ', '.join(str(k) + ' : ' + graphTypes[kind]['name'] for k, kind in enumerate(kinds)))
+        graph = {'type': kinds[int(input())]}
+        graph['series'] = askSeries()
+        if graph['type'] == 'current':
+            graph['resistance'] = float(input('Enter known resistance: '))
+        graph['title'] = input('Enter Graph Title: ')
+        graphs.append(graph)
+        
+    fileName = os.path.join(outDir, input('Save report as? ') + '.pdf')
+    buildReport(data, graphs, fileName)
+    
+    return(fileName)
+    
+def FollowGraph(data):
+    """
+     *********************************************************************************************************************
+     *Function: FollowGraph()
+    *Decription: 
+        *    This function shows a live graph of an Agilent 34972A file while the DAQ is still writing it. Every
+             "followInterval" seconds the new scans are read (see followA()), named and calibrated like the loaded
+             data set, appended to a ring buffer of the last "followRows" scans and the lines of the open figure
+             are updated in place instead of re-plotting.
+        *    Close the graph window to stop.
+             
+        *Parameters:
+            *    The processed data frame created in the getARawData() function
+            
+            *Return
+            *    None
+    **********************************************************************************************************************
+    """
+    header = data.attrs.get('header') or {}
+    if 'source' not in data.attrs or 'channels' not in header:
+        print("Live graphs are only available for Agilent 34972A raw data.")
+        return
+    
+    sensors = [c for c in data.columns if c not in ('Elapsed (sec)', 'Alarms')]
+    names = dict(zip(header['values'], sensors))
+    cal = data.attrs.get('calibration', {})
+    howMany = askSeries()
+    title = input('Enter Graph Title: ')
+    
+    import matplotlib.pyplot as plt
+    plt.ion()
+    fig, ax = plt.subplots(figsize = (8, 4.5))
+    lines = [ax.plot([], [], label = col)[0] for col in howMany]
+    ax.grid(True)
+    ax.legend(loc='best')
+    ax.set_title(title)
+    ax.set_xlabel("Time (sec)")
+    
+    ring = newRing(howMany, followRows)
+    state = {'file': data.attrs['source']}
+    print("Following", state['file'], "- close the graph window to stop")
+    while plt.fignum_exists(fig.number):
+        block = followA(state)
+        if len(block):
+            block = calibrate(block.rename(columns = names), cal)
+            ringAppend(ring, block['Elapsed (sec)'], block[howMany])
+            x, values = ringView(ring)
+            for line, y in zip(lines, values):
+                line.set_data(x, y)
+            ax.relim()
+            ax.autoscale_view()
+            fig.canvas.draw_idle()
+        #no wait while catching up with a long file
+        if len(block) and os.path.getsize(state['file']) - state['offset'] > followBytes:
+            fig.canvas.flush_events()
+        else:
+            plt.pause(followInterval)
+    
+def EventGraph(data):
+    """
+     *********************************************************************************************************************
+     *Function: EventGraph()
+    *Decription: 
+        *    This function lists the events of the run (threshold crossings, alarms and scan gaps, see eventIndex())
+             and draws a custom graph zoomed on the one picked by the user. Only the rows around the event are
+             read and plotted.
+             
+        *Parameters:
+            *    The processed data frame created in the getXXXData() function
+            
+            *Return
+            *    Location of the saved .pdf file, None if the run has no event
+    **********************************************************************************************************************
+    """
+    events = eventIndex(data)
+    if len(events) == 0:
+        print("No threshold crossing, alarm or scan gap in this run.")
+        return
+    print(events.reset_index().to_string())
+    
+    graph = {'type': 'custom', 'event': int(input('Select an event: '))}
+    graph['series'] = askSeries()
+    pad = input('Seconds shown before and after the event (blank for 15): ')
+    graph['pad'] = float(pad) if pad else 15
+    graph['title'] = input('Enter Graph Title: ')
+    
+    return(drawGraph(data, graph, show = True))
+    
+def ZoomGraph(data):
+    """
+     *********************************************************************************************************************
+     *Function: ZoomGraph()
+    *Decription: 
+        *    This function shows a graph that can be zoomed and panned with the figure toolbar. Every time the
+             visible time window changes the series are read again for that window only, from the pyramid of the
+             data set (see pyramidView()) or decimated (see decimate()), so the graph always shows about
+             "plotPoints" x-positions whatever the length of the run.
+        *    Close the graph window to go back to the menu.
+             
+        *Parameters:
+            *    The processed data frame created in the getXXXData() function
+            
+            *Return
+            *    None
+    **********************************************************************************************************************
+    """
+    kinds = list(graphTypes)
+    print("Graph type:", ', '.join(str(k) + ' : ' + graphTypes[kind]['name'] for k, kind in enumerate(kinds)))
+    graph = {'type': kinds[int(input())]}
+    graph['series'] = askSeries()
+    if graph['type'] == 'current':
+        graph['resistance'] = float(input('Enter known resistance: '))
+    graph['title'] = input('Enter Graph Title: ')
+    
+    kind = graphTypes[graph['type']]
+    mult = seriesMult(data, graph)
+    df = graphSeries(data, graph) * mult
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
+    fig, ax = plt.subplots(figsize = (8, 4.5))
+    lines = [ax.plot(df.index, df[col], label = col)[0] for col in graph['series']]
+    ax.grid(True)
+    ax.legend(loc='best')
+    ax.set_title(graph['title'])
+    ax.set_xlabel(graph.get('xlabel', kind['xlabel']))
+    ax.set_ylabel(graph.get('ylabel', kind['ylabel']))
+    
+    def update(ax):
+        window = list(ax.get_xlim())
+        if isinstance(data.index, pd.DatetimeIndex):
+            window = [pd.Timestamp(mdates.num2date(t)).tz_localize(None) for t in window]
+        view = graphSeries(data, dict(graph, window = window)) * mult
+        for line, col in zip(lines, graph['series']):
+            line.set_data(view.index, view[col])
+        fig.canvas.draw_idle()
+        
+    ax.callbacks.connect('xlim_changed', update)
+    plt.show()
+    plt.close(fig)
+    
+def CompareGraph(data):
+    """
+     *********************************************************************************************************************
+    *Function: CompareGraph()
+    *Decription: 
+        *    This function finds the runs of the catalog (see findRuns()) where a channel went over or under a limit,
+             lists them, and draws the channel of all of them in one graph (see compareRuns()).
+             
+        *Parameters:
+            *    The processed data frame, its channels are offered
+            *    User input for the channel, the limits and the graph title
+            
+            *Return
+            *    Location of the saved .pdf file
+    **********************************************************************************************************************
+    """
+    
+    print('Channels of this run:', ', '.join(str(c) for c in sensorCols(data)))
+    channel = input('Channel to compare (* and ? match any text): ')
+    above = input('Only the runs where it went over (blank for all): ')
+    below = input('Only the runs where it went under (blank for all): ')
+    runs = findRuns(channel, float(above) if above else None, float(below) if below else None)
+    if len(runs) == 0:
+        print('No run of the catalog matches.')
+        return
+    print(runs[['run', 'source', 'first', 'channel', 'min', 'max', 'maxTime']].to_string(index = False))
+    
+    title = input('Enter Graph Title: ')
+    return(compareRuns(runs, title = title or None, show = True))
+    
 def selectGraph(graph):
     """
      *********************************************************************************************************************
@@ -518,44 +4522,244 @@ def selectGraph(graph):
                 CurrentGraph(data)
             elif make == 4:
                 CustomGraph(data)
+            elif make == 5:
+                ReportGraph(data)
+            elif make == 6:
+                FollowGraph(data)
+            elif make == 7:
+                EventGraph(data)
+            elif make == 8:
+                ZoomGraph(data)
+            elif make == 9:
+                CompareGraph(data)
         else:
             quit()
         graph = input("Would you like to make a graph, Y/n? ")
         
-###Main progran starts here
+def readJob(jobFile):
+    """
+     *********************************************************************************************************************
+    *Function: readJob()
+    *Decription: 
+        *    This function reads a batch job file, JSON (.json) or YAML (.yaml/.yml, needs the PyYAML package).
+             See runJob() for the job keys.
+             
+        *Parameters:
+            *    jobFile : location of the job file
+            
+            *Return
+            *    Dictionary "job"
+    **********************************************************************************************************************
+    """
+    
+    with open(jobFile) as f:
+        if jobFile.lower().endswith(('.yaml', '.yml')):
+            import yaml                                 # only needed for YAML job files
+            job = yaml.safe_load(f)
+        else:
+            job = json.load(f)
+            
+    return(job)
 
-DAQ = pickDAQ()
-if DAQ == 1:
-    data = getARawData()
-    showInfo(data)
-    graph = input("Would you like to make a graph, Y/n? ")
-    selectGraph(graph)
+def processFile(rawFile, job):
+    """
+     *********************************************************************************************************************
+    *Function: processFile()
+    *Decription: 
+        *    This function runs a batch job on one raw data file: load and name the data set, apply the
+             multipliers, save the .csv (if asked) and draw every graph of the job into a folder named after the
+             file in the job "outDir". Graphs are drawn on the non-interactive Agg canvas (see takeFigure()).
+        *    Errors are caught and reported in the returned status so one bad file does not stop the batch.
+             
+        *Parameters:
+            *    rawFile : location of the raw data
+            *    job     : dictionary from readJob()
+            
+            *Return
+            *    Dictionary "status" with 'file', 'status' ('ok' or 'error'), 'error', 'rows', 'outputs', 'seconds'
+                 and 'spans' (stages recorded in this process, see span()) when the job has 'profile'
+    **********************************************************************************************************************
+    """
     
-if DAQ == 2:
-    data = input("Please enter your file name: ")
-    data = pd.DataFrame(pd.read_csv(data, dialect = csv.excel))
-    showInfo(data)
-    graph = input("Would you like to make a graph, Y/n? ")
-    selectGraph(graph)
+    global profile, profileMemory
+    profile = profile or bool(job.get('profile'))
+    profileMemory = profileMemory or job.get('profile') == 'memory'
+    first = len(spans)
+    start = time.perf_counter()
+    status = {'file': rawFile, 'status': 'ok', 'error': '', 'rows': 0, 'outputs': []}
+    folder = os.path.join(job.get('outDir', outDir), os.path.splitext(os.path.basename(rawFile))[0])
     
-if DAQ == 3:
-    data = getHBMRawData()
-    showInfo(data)
-    graph = input("Would you like to make a graph, Y/n? ")
-    selectGraph(graph)
+    try:
+        #nothing is asked in a batch, without 'names' the channels keep the names of the file
+        names = job.get('names') or fileNames(rawFile, job.get('daq'))
+        data = loadRawData(rawFile, job.get('daq'), names, alarms = job.get('alarms'))
+        
+        data = calibrate(data, readCalibration(data, job.get('calibration'), job.get('scale')))
+        multipliers = job.get('multipliers', {})
+        if multipliers:
+            data = scaleColumns(data, list(multipliers), lambda values: values * list(multipliers.values()))
+            for key in ('stats', 'events', 'pyramid'):
+                data.attrs.pop(key, None)
+        data.attrs['multipliers'] = multipliers
+        if job.get('catalog', catalogFile):
+            import sqlite3                              # only needed for the run catalog
+            try:
+                catalogRun(data, rawFile, job.get('daq'), job.get('catalog') or None)
+            except sqlite3.Error as e:
+                #the file is still processed, the manifest tells it is missing from the catalog
+                status['error'] = 'not catalogued, ' + type(e).__name__ + ': ' + str(e)
+            
+        os.makedirs(folder, exist_ok = True)
+        #the files are written in the background while the graphs are drawn
+        exports = [{'format': 'csv'}] if job.get('csv') else []
+        exports = exports + job.get('export', [])
+        exports = [startExport(data, os.path.join(folder, export.get('name', os.path.basename(folder)) + '.' +
+                                                  export.get('format', exportFormat).replace('hdf5', 'h5')),
+                               export.get('format'), export.get('columns'), export.get('summary', False),
+                               export.get('filter'), export.get('filterWindow'))
+                   for export in exports]
+        if job.get('report'):
+            fileName = os.path.join(folder, job['report'] + '.pdf')
+            buildReport(data, job.get('graphs', []), fileName, workers = 0)
+            status['outputs'].append(fileName)
+        else:
+            for graph in job.get('graphs', []):
+                status['outputs'].append(drawGraph(data, graph, folder))
+        status['outputs'] += [export.result() for export in exports]
+        status['rows'] = len(data)
+        
+    except Exception as e:
+        status['status'] = 'error'
+        status['error'] = type(e).__name__ + ': ' + str(e)
+        
+    status['seconds'] = round(time.perf_counter() - start, 3)
+    if profile:
+        status['spans'] = spans[first:]
+    return(status)
 
+def runJob(job):
+    """
+     *********************************************************************************************************************
+    *Function: runJob()
+    *Decription: 
+        *    This function runs a batch job without any prompt. Every file of the job is processed by
+             processFile() in its own worker process and a manifest of the status and timing of each file is
+             written to "manifest.json" in the job "outDir".
+        *    Job keys:
+                -'daq'         : DAQ number in "readers" as in pickDAQ(), 1 : Agilent raw, 2 : processed .csv, 3 : HBM
+                                 raw, ..., found from the header of every file if missing (see detectDAQ())
+                -'input'       : folder of raw data files, or a list of files
+                -'pattern'     : file pattern in the input folder (default '*')
+                -'names'       : sensor names in channel order, the names of the file header if missing
+                -'multipliers' : {column name: multiplier}
+                -'calibration' : JSON calibration file (see readCalibration())
+                -'scale'       : apply the Agilent channel table Mx+B, for raw readings only (default "scaleChannels")
+                -'graphs'      : list of graph definitions (see drawGraph())
+                -'outDir'      : output folder, one sub-folder per file ("outDir" setting if missing)
+                -'csv'         : save the named data set as .csv (default false)
+                -'export'      : list of files to save, {'format': 'csv', 'csv.gz', 'csv.zst', 'parquet', 'hdf5' or
+                                 'npz', 'columns': [...], 'summary': true/false, 'name': file name, 'filter': 'mean',
+                                 'median', 'savgol', 'derivative' or 'spectrum', 'filterWindow': samples}, see
+                                 exportData()
+                -'report'      : name of a single multi-page .pdf holding all the graphs (see buildReport())
+                -'alarms'      : keep the Agilent alarm states (default from the channel table)
+                -'workers'     : number of worker processes (default one per CPU)
+                -'catalog'     : run catalog the files are added to (see catalogRun()), false for none (default
+                                 "catalogFile")
+                -'profile'     : record the stages of every file (true, or 'memory' to trace memory too), see
+                                 span(), they are added to "spans" of this process
+             
+        *Parameters:
+            *    job : dictionary from readJob()
+            
+            *Return
+            *    List of the file status dictionaries, in file order
+    **********************************************************************************************************************
+    """
     
-# if DAQ == 4:
-#    # data = getProcData()
-#     #showInfo()
-#     graph = input("Would you like to make a graph, Y/n?")
+    files = job['input']
+    if isinstance(files, str):
+        files = sorted(glob.glob(os.path.join(files, job.get('pattern', '*'))))
+    folder = job.get('outDir', outDir)
+    os.makedirs(folder, exist_ok = True)
     
-# if DAQ == 5:
-#     # data = getProcData()
-#     # showInfo()
-#     graph = input("Would you like to make a graph, Y/n?")
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers = job.get('workers')) as pool:
+        manifest = list(pool.map(processFile, files, [job] * len(files)))
+    for status in manifest:
+        spans.extend(status.pop('spans', []))
+        
+    with open(os.path.join(folder, 'manifest.json'), 'w') as f:
+        json.dump({'job': job, 'seconds': round(time.perf_counter() - start, 3), 'files': manifest}, f, indent = 1)
+    for status in manifest:
+        print(status['status'], status['seconds'], 's', status['file'], status['error'])
+        
+    return(manifest)
+        
+###Main progran starts here
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Graphs and .csv files from DAQ data sets')
+    parser.add_argument('--job', help = 'batch job file (.json or .yaml), runs without any prompt')
+    parser.add_argument('--session', help = 'session file (.json or .yaml) merging several DAQ files onto one time '
+                        'grid, see mergeSession()')
+    parser.add_argument('--convert', nargs = '+', metavar = 'FILE', help = 'save raw data files next to them as '
+                        '<name>_converted.<format> without any prompt, the DAQ of each file is found from its header')
+    parser.add_argument('--to', default = exportFormat, help = 'format of the converted files: csv, csv.gz, csv.zst, '
+                        'parquet, h5 or npz')
+    parser.add_argument('--catalog', nargs = '+', metavar = 'PATH', help = 'add files, and the --pattern files of '
+                        'folders, to the run catalog')
+    parser.add_argument('--pattern', default = '*.csv', help = 'files added from the --catalog folders')
+    parser.add_argument('--find', metavar = 'CHANNEL', help = 'list the catalog runs of a channel (* and ? match any '
+                        'text), see findRuns()')
+    parser.add_argument('--above', type = float, help = 'with --find, only the runs where the channel went over')
+    parser.add_argument('--below', type = float, help = 'with --find, only the runs where the channel went under')
+    parser.add_argument('--plot', metavar = 'FILE', help = 'with --find, draw the channel of the runs found in FILE')
+    parser.add_argument('--profile', metavar = 'FILE', help = 'time every stage, print a summary and save it to FILE '
+                        '(.json for a Chrome trace, .csv for the table)')
+    parser.add_argument('--profile-memory', action = 'store_true', help = 'also trace the memory of every stage')
+    args = parser.parse_args()
     
-# if DAQ == 6:
-#     # data = getProcData()
-#     # showInfo()
-#     graph = input("Would you like to make a graph, Y/n?")
\ No newline at end of file
+    if args.profile or args.profile_memory:
+        profile = True
+        profileMemory = args.profile_memory
+        #also written when the user quits from a menu
+        atexit.register(profileReport, args.profile)
+        
+    if args.job:
+        job = readJob(args.job)
+        if profile:
+            job['profile'] = 'memory' if profileMemory else True
+        runJob(job)
+        quit()
+    if args.session:
+        print(mergeSession(readJob(args.session)), 'rows merged')
+        quit()
+    if args.catalog:
+        print(catalogFiles(args.catalog, args.pattern), 'runs added to', catalogFile)
+        quit()
+    if args.find:
+        runs = findRuns(args.find, args.above, args.below)
+        if len(runs) == 0:
+            print('No run of the catalog matches.')
+            quit()
+        with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.max_colwidth', 60):
+            print(runs.drop(columns = ['std', 'crossTime']).to_string(index = False))
+        if args.plot:
+            print('Saved', compareRuns(runs, fileName = args.plot))
+        quit()
+    if args.convert:
+        for rawFile in args.convert:
+            #never over the raw file, a BenchLink export is a .csv too
+            fileName = os.path.splitext(rawFile)[0] + '_converted.' + args.to.lstrip('.')
+            if os.path.abspath(fileName) == os.path.abspath(rawFile):
+                sys.exit('Not converted, ' + fileName + ' is the raw data file')
+            print('Saved', exportData(loadPart(rawFile), fileName))
+        quit()
+        
+    #the DAQ is found from the file header, see detectDAQ()
+    DAQ = None
+    data = getRawData()
+    showInfo(data)
+    graph = input("Would you like to make a graph, Y/n? ")
+    selectGraph(graph)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+#the tests import Data_Visualization from the repository folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,56 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+
+import Data_Visualization as dv
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sample = os.path.join(root, '4 Ch Agilent.csv')
+
+
+def run(home, *args):
+    #the cache and the catalog of the command line go to "home"
+    env = dict(os.environ, HOME = str(home), USERPROFILE = str(home))
+    subprocess.run([sys.executable, os.path.join(root, 'Data_Visualization.py')] + list(args), env = env,
+                   check = True, stdin = subprocess.DEVNULL, capture_output = True)
+
+
+def test_convert_catalog_runData(tmp_path, monkeypatch):
+    raw = tmp_path / 'run.csv'
+    shutil.copy(sample, raw)
+    run(tmp_path, '--convert', str(raw))
+    run(tmp_path, '--catalog', str(tmp_path / 'run_converted.csv'))
+
+    monkeypatch.setattr(dv, 'cacheDir', str(tmp_path / 'DAQ_cache'))
+    catalog = os.path.join(dv.cacheDir, 'catalog.sqlite')
+    expected = dv.loadARawData(str(raw), ['101 (VDC)', '102 (VDC)', '103 (VDC)', '104 (VDC)'])
+    runs = dv.findRuns(fileName = catalog)
+    assert list(runs['channel']) == ['101 (VDC)', '102 (VDC)', '103 (VDC)', '104 (VDC)']
+    assert runs['first'].iloc[0] == str(expected.index[0])
+    assert runs['seconds'].iloc[0] == expected['Elapsed (sec)'].iloc[-1]
+
+    data = dv.runData(runs['run'].iloc[0], catalog)
+    assert isinstance(data.index, pd.DatetimeIndex)
+    pd.testing.assert_frame_equal(data, expected, check_freq = False, check_flags = False)
+
+
+def test_batch_names_survive_runData(tmp_path, monkeypatch):
+    raw = tmp_path / 'run.csv'
+    shutil.copy(sample, raw)
+    run(tmp_path, '--convert', str(raw))
+    monkeypatch.setattr(dv, 'cacheDir', str(tmp_path / 'DAQ_cache'))
+    catalog = str(tmp_path / 'catalog.sqlite')
+    status = dv.processFile(str(tmp_path / 'run_converted.csv'), {'names': ['A', 'B', 'C', 'D'],
+                                                                   'outDir': str(tmp_path), 'catalog': catalog})
+    assert status['status'] == 'ok', status['error']
+
+    runs = dv.findRuns('B', fileName = catalog)
+    data = dv.runData(runs['run'].iloc[0], catalog)
+    expected = pd.read_csv(tmp_path / 'run_converted.csv')
+    assert list(data.columns) == ['A', 'B', 'C', 'D', 'Elapsed (sec)']
+    np.testing.assert_array_equal(data['B'].to_numpy(), expected['102 (VDC)'].to_numpy())
+    assert runs['max'].iloc[0] == expected['102 (VDC)'].max()
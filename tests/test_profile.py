@@ -0,0 +1,14 @@
+import numpy as np
+import pandas as pd
+
+import Data_Visualization as dv
+
+
+def test_statistics_rows(monkeypatch):
+    monkeypatch.setattr(dv, 'profile', True)
+    monkeypatch.setattr(dv, 'spans', [])
+    data = pd.DataFrame(np.random.rand(25000, 3), columns = list('abc'), index = pd.Index(np.arange(25000) * 1e-3, name = 'Time'))
+
+    dv.channelStats(data, chunkSize = 10000)
+
+    assert [(stage['name'], stage['rows']) for stage in dv.spans] == [('statistics', 25000)]
@@ -0,0 +1,23 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import Data_Visualization as dv
+
+
+@pytest.mark.parametrize('kind', ['envelope', 'mean'])
+def test_pyramid_view_points(kind, tmp_path, monkeypatch):
+    rows = 1100000
+    data = pd.DataFrame({'a': np.sin(np.arange(rows) / 5000.)}, index = pd.Index(np.arange(rows) * 1e-3, name = 'Time'))
+    (tmp_path / 'meta.json').write_text(json.dumps({'bytes': 0}))
+    monkeypatch.setattr(dv, 'pyramidRows', 1000)
+    dv.savePyramid(str(tmp_path), data)
+
+    view = dv.pyramidView(data, ['a'], kind = kind)
+
+    assert 0.8 * dv.plotPoints <= len(view) <= dv.plotPoints
+    assert data.index[0] <= view.index[0] and view.index[-1] <= data.index[-1]
+    if kind == 'envelope':
+        assert view['a'].min() == pytest.approx(data['a'].min()) and view['a'].max() == pytest.approx(data['a'].max())
@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import Data_Visualization as dv
+
+
+def lineMax(fig):
+    values = max(np.nanmax(line.get_ydata()) for line in fig.axes[0].get_lines())
+    dv.releaseFigure(fig)
+    return(values)
+
+
+@pytest.mark.parametrize('graph', [{'type': 'pressure', 'series': ['P'], 'title': 'p'},
+                                   {'type': 'pressure', 'series': ['V'], 'title': 'v'},
+                                   {'type': 'current', 'series': ['V'], 'title': 'i', 'resistance': 0.5}])
+def test_report_matches_direct_plot(graph, tmp_path, monkeypatch):
+    index = pd.date_range('2024-01-01', periods = 5000, freq = 's', name = 'Time').as_unit('ns')
+    data = pd.DataFrame({'P': np.linspace(0, 2.7, 5000), 'V': np.linspace(0, 1.5, 5000)}, index = index)
+    data = dv.calibrate(data, {'P': {'gain': 50, 'unit': 'psi'}})
+    pages = []
+    monkeypatch.setattr(dv, 'renderPage', lambda df, page: pages.append(lineMax(dv.plotGraph(df, page))) or
+                        np.zeros((2, 2, 4), 'uint8'))
+
+    dv.buildReport(data, [graph], str(tmp_path / 'report.pdf'), workers = 0)
+
+    assert pages == [pytest.approx(lineMax(dv.plotGraph(data, graph)))]